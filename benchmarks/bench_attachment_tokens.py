@@ -0,0 +1,75 @@
+"""
+Attachment token counting: single concatenated encode vs. threaded batch counting.
+
+    python -m benchmarks.bench_attachment_tokens --counts 1 10 50 --sizes 10000 100000 1000000
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+from claude_auditlimit_python.utils.token_utils import (
+    attachment_token_cache,
+    get_attachments_token_length,
+    get_token_length,
+    get_tokenizer,
+)
+
+WORDS = (
+    "the limit token request claude model usage window redis device conversation "
+    "attachment 用户 对话 限制 模型 使用 def return import async await 0 1 42 {} [] ()"
+).split()
+
+
+def make_text(size: int, rng: random.Random) -> str:
+    parts = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        parts.append(word)
+        length += len(word) + 1
+    return " ".join(parts)[:size]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--counts", type=int, nargs="+", default=[1, 5, 10, 50])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    get_tokenizer()  # 排除词表加载时间
+
+    print(f"{'count':>6} {'size':>9} {'joined_s':>9} {'batch_s':>9} {'cached_s':>9} {'speedup':>8}")
+    for size in args.sizes:
+        for count in args.counts:
+            attachments = [make_text(size, rng) for _ in range(count)]
+            attachment_token_cache.clear()
+
+            _, joined = timed(
+                lambda: get_token_length("".join(attachments))
+            )
+            _, batch = timed(
+                lambda: asyncio.run(get_attachments_token_length(attachments))
+            )
+            _, cached = timed(
+                lambda: asyncio.run(get_attachments_token_length(attachments))
+            )
+            print(
+                f"{count:>6} {size:>9} {joined:>9.3f} {batch:>9.3f} {cached:>9.4f} "
+                f"{joined / batch:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
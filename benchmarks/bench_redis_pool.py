@@ -0,0 +1,90 @@
+"""
+Redis pool size vs. throughput for admission-sized round trips.
+
+Each operation is one pipeline shaped like an /audit_limit check (GET, INCRBY,
+EXPIRE on a per-key counter); ``--concurrency`` tasks share one pool built by
+RedisPool.create_pool, so REDIS_UNIX_SOCKET / REDIS_PROTOCOL apply as in the
+service. Needs a running Redis; keys are written under ``bench:pool:`` and
+deleted afterwards.
+
+    python -m benchmarks.bench_redis_pool --sizes 4 8 16 32 64 --concurrency 256
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from redis.asyncio import Redis
+
+from claude_auditlimit_python.configs import REDIS_DB, REDIS_HOST, REDIS_PORT
+from claude_auditlimit_python.redis_manager.redis_pool import RedisPool
+
+KEY_PREFIX = "bench:pool:"
+
+
+async def one_op(client: Redis, key: str) -> float:
+    start = time.perf_counter()
+    pipe = client.pipeline(transaction=False)
+    pipe.get(key)
+    pipe.incrby(key, 10)
+    pipe.expire(key, 60)
+    await pipe.execute()
+    return time.perf_counter() - start
+
+
+async def run(size: int, concurrency: int, requests: int, keys: int, args) -> dict:
+    pool = RedisPool.create_pool(args.host, args.port, args.db, max_connections=size)
+    client = Redis(connection_pool=pool)
+    latencies = []
+    remaining = iter(range(requests))
+
+    async def worker():
+        for i in remaining:
+            latencies.append(await one_op(client, f"{KEY_PREFIX}{i % keys}"))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    opened = len(pool._available_connections) + len(pool._in_use_connections)
+    await pool.disconnect()
+    latencies.sort()
+    return {
+        "size": size,
+        "connections": opened,
+        "ops_per_s": requests / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+async def main_async(args):
+    print(f"{'pool':>5} {'conns':>6} {'ops/s':>10} {'p50_ms':>8} {'p99_ms':>8}")
+    for size in args.sizes:
+        result = await run(size, args.concurrency, args.requests, args.keys, args)
+        print(
+            f"{result['size']:>5} {result['connections']:>6} {result['ops_per_s']:>10.0f} "
+            f"{result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f}"
+        )
+
+    client = Redis(connection_pool=RedisPool.create_pool(args.host, args.port, args.db))
+    await client.delete(*[f"{KEY_PREFIX}{i}" for i in range(args.keys)])
+    await client.connection_pool.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[4, 8, 16, 32, 64])
+    parser.add_argument("--concurrency", type=int, default=256)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--keys", type=int, default=1000)
+    parser.add_argument("--host", default=REDIS_HOST)
+    parser.add_argument("--port", type=int, default=REDIS_PORT)
+    parser.add_argument("--db", type=int, default=REDIS_DB)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
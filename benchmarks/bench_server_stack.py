@@ -0,0 +1,190 @@
+"""
+Requests/s and server CPU per request for the uvicorn server stack and the
+response format.
+
+Each stack (asyncio + h11, uvloop + httptools) runs the service in a child
+process with admission control off and INFO logging; we drive /audit_limit
+(many keys, so most requests are admitted) and then /token_stats over the
+keys it created, once with JSON and once with msgpack responses. CPU is
+read from /proc for the server process only (Linux), so the load generator
+running on the same host affects req/s but not CPU/req. Needs a running
+Redis and ``pip install '.[fast]'``; keys of the ``bench-stack-`` api keys
+are deleted afterwards.
+
+    python -m benchmarks.bench_server_stack --requests 5000 --concurrency 64
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+import msgspec
+from redis.asyncio import Redis
+
+from claude_auditlimit_python.configs import REDIS_DB, REDIS_HOST, REDIS_PORT
+
+API_KEY_PREFIX = "bench-stack-"
+STACKS = {"default": ("asyncio", "h11"), "fast": ("uvloop", "httptools")}
+ACCEPT = {"json": "application/json", "msgpack": "application/msgpack"}
+
+SERVER = r"""
+import sys
+import uvicorn
+from fastapi import FastAPI
+from claude_auditlimit_python.lifespan import lifespan
+from claude_auditlimit_python.middlewares.register_middlewares import register_middleware
+from claude_auditlimit_python.router import router
+
+app = register_middleware(FastAPI(lifespan=lifespan))
+app.include_router(router)
+uvicorn.run(
+    app, port=int(sys.argv[1]), loop=sys.argv[2], http=sys.argv[3], log_level="warning"
+)
+"""
+
+BODY = msgspec.json.encode(
+    {"model": "claude-3-5-sonnet", "messages": [{"content": "hello " * 50}]}
+)
+
+
+def cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    # utime, stime (字段 14, 15)
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+async def load(client, pid, requests, concurrency, make_request) -> dict:
+    latencies, statuses = [], {}
+    remaining = iter(range(requests))
+
+    async def worker():
+        for i in remaining:
+            start = time.perf_counter()
+            response = await make_request(client, i)
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    cpu_start, start = cpu_seconds(pid), time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed, cpu = time.perf_counter() - start, cpu_seconds(pid) - cpu_start
+    latencies.sort()
+    return {
+        "req_per_s": requests / elapsed,
+        "cpu_ms_per_req": cpu / requests * 1000,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "statuses": statuses,
+    }
+
+
+def audit_limit(keys: int, fmt: str):
+    async def request(client, i):
+        return await client.post(
+            "/audit_limit",
+            content=BODY,
+            headers={
+                "Authorization": f"Bearer {API_KEY_PREFIX}{i % keys}",
+                "User-Agent": "bench",
+                "Accept": ACCEPT[fmt],
+            },
+        )
+
+    return request
+
+
+def token_stats(fmt: str):
+    async def request(client, i):
+        return await client.get("/token_stats", headers={"Accept": ACCEPT[fmt]})
+
+    return request
+
+
+async def bench_stack(name: str, args) -> list:
+    loop, http = STACKS[name]
+    env = dict(os.environ, ADMISSION_CONTROL_ENABLED="0", LOG_LEVEL="INFO")
+    server = subprocess.Popen(
+        [sys.executable, "-c", SERVER, str(args.port), loop, http], env=env
+    )
+    rows = []
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=30
+        ) as client:
+            await wait_ready(client)
+            # 每个 key 的请求数低于请求次数限额, 大部分请求都会被准入
+            keys = max(args.requests // 20, 1)
+            for fmt in ACCEPT:
+                for endpoint, make_request, requests in (
+                    ("/audit_limit", audit_limit(keys, fmt), args.requests),
+                    ("/token_stats", token_stats(fmt), args.stats_requests),
+                ):
+                    result = await load(
+                        client, server.pid, requests, args.concurrency, make_request
+                    )
+                    rows.append((name, endpoint, fmt, result))
+    finally:
+        server.terminate()
+        server.wait()
+    return rows
+
+
+async def cleanup() -> None:
+    client = Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB)
+    keys = [key async for key in client.scan_iter(match=f"*{API_KEY_PREFIX}*")]
+    for i in range(0, len(keys), 500):
+        await client.delete(*keys[i : i + 500])
+    await client.aclose()
+
+
+async def main_async(args):
+    rows = []
+    for name in args.stacks:
+        rows.extend(await bench_stack(name, args))
+        await cleanup()
+
+    print(
+        f"{'stack':>8} {'endpoint':>13} {'format':>8} {'req/s':>8} "
+        f"{'cpu_ms/req':>11} {'p50_ms':>8} {'p99_ms':>8}  statuses"
+    )
+    for name, endpoint, fmt, r in rows:
+        print(
+            f"{name:>8} {endpoint:>13} {fmt:>8} {r['req_per_s']:>8.0f} "
+            f"{r['cpu_ms_per_req']:>11.3f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f}  "
+            f"{r['statuses']}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--stacks", nargs="+", choices=list(STACKS), default=list(STACKS)
+    )
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--stats-requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
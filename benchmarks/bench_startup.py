@@ -0,0 +1,181 @@
+"""
+Import time of ``main`` and first-request latency after startup.
+
+Import time is measured in fresh interpreters (median of ``--imports`` runs),
+with the slowest top-level packages from ``-X importtime``. Then the server
+(``python main.py``) is started ``--starts`` times per mode and we record
+when the port answers, when /ready turns 200, and the latency of the first
+and of the following /audit_limit requests:
+
+- ``cold``: the first request is sent as soon as the port answers, so it may
+  race the background warm-up;
+- ``warm``: the first request is sent after /ready.
+
+Needs a running Redis; keys of the ``bench-startup-`` api keys are deleted
+afterwards.
+
+    python -m benchmarks.bench_startup --imports 10 --starts 3
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+import msgspec
+from redis.asyncio import Redis
+
+from claude_auditlimit_python.configs import REDIS_DB, REDIS_HOST, REDIS_PORT, ROOT
+
+API_KEY_PREFIX = "bench-startup-"
+BODY = msgspec.json.encode(
+    {"model": "claude-3-5-sonnet", "messages": [{"content": "hello " * 50}]}
+)
+IMPORT = (
+    "import time; s = time.perf_counter(); import main; "
+    "print(time.perf_counter() - s)"
+)
+
+
+def import_seconds() -> float:
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(top: int) -> list:
+    # -X importtime 写到 stderr: "import time: self [us] | cumulative | name"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    packages = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # 按顶层包汇总, 取该包最外层一次导入的累计时间
+        package = name.strip().split(".")[0]
+        if package != "main":
+            seconds = int(cumulative) / 1e6
+            packages[package] = max(packages.get(package, 0), seconds)
+    return sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+async def audit(client: httpx.AsyncClient, i: int) -> float:
+    start = time.perf_counter()
+    response = await client.post(
+        "/audit_limit",
+        content=BODY,
+        headers={
+            "Authorization": f"Bearer {API_KEY_PREFIX}{i}",
+            "User-Agent": "bench",
+        },
+    )
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+
+async def poll(client: httpx.AsyncClient, path: str, deadline: float) -> None:
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get(path)).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.01)
+    raise RuntimeError(f"{path} did not answer")
+
+
+async def start_once(mode: str, args) -> dict:
+    env = dict(os.environ, LOG_LEVEL="INFO")
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "main.py", "--port", str(args.port)],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{args.port}", timeout=30
+        ) as client:
+            deadline = time.monotonic() + 60
+            await poll(client, "/", deadline)
+            listening = time.perf_counter() - started
+            if mode == "warm":
+                await poll(client, "/ready", deadline)
+            first = await audit(client, 0)
+            await poll(client, "/ready", deadline)
+            ready = time.perf_counter() - started
+            steady = [await audit(client, i) for i in range(1, args.requests + 1)]
+    finally:
+        server.terminate()
+        server.wait()
+    return {
+        "listening": listening,
+        "ready": ready,
+        "first": first,
+        "steady": statistics.median(steady),
+    }
+
+
+async def cleanup() -> None:
+    client = Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB)
+    keys = [key async for key in client.scan_iter(match=f"*{API_KEY_PREFIX}*")]
+    for i in range(0, len(keys), 500):
+        await client.delete(*keys[i : i + 500])
+    await client.aclose()
+
+
+async def main_async(args):
+    imports = [import_seconds() for _ in range(args.imports)]
+    print(f"import main: median {statistics.median(imports) * 1000:.0f} ms")
+    for name, seconds in slowest_imports(args.top):
+        print(f"  {name:<24} {seconds * 1000:>8.1f} ms")
+
+    print(
+        f"\n{'mode':>6} {'listen_ms':>10} {'ready_ms':>10} "
+        f"{'first_ms':>10} {'steady_ms':>10}"
+    )
+    for mode in ("cold", "warm"):
+        runs = []
+        for _ in range(args.starts):
+            runs.append(await start_once(mode, args))
+            await cleanup()
+        row = {
+            field: statistics.median(run[field] for run in runs) * 1000
+            for field in runs[0]
+        }
+        print(
+            f"{mode:>6} {row['listening']:>10.0f} {row['ready']:>10.0f} "
+            f"{row['first']:>10.2f} {row['steady']:>10.2f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--imports", type=int, default=10)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--starts", type=int, default=3)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Calibrate the sampled token estimator against exact counts.
+
+Pass real payloads (plain text files, or /audit_limit JSON bodies whose
+raw_message.attachments[].extracted_content are used); synthetic Latin, CJK and
+mixed texts are used when no files are given.
+
+    python -m benchmarks.bench_token_estimate payload1.json doc.txt --repeat 20
+"""
+
+import argparse
+import json
+import random
+import time
+from pathlib import Path
+
+from claude_auditlimit_python.configs import TOKEN_ESTIMATE_MAX_ERROR
+from claude_auditlimit_python.utils.token_utils import (
+    estimate_token_length,
+    get_token_length,
+    get_tokenizer,
+)
+
+LATIN = "the quick brown fox jumps over the lazy dog while counting tokens per window".split()
+CJK = "这是一个用于估算令牌数量的中文文本样例包含常见的汉字和标点符号。"
+
+
+def synthetic_payloads(size: int):
+    rng = random.Random(0)
+    latin = " ".join(rng.choice(LATIN) for _ in range(size // 5))[:size]
+    cjk = "".join(rng.choice(CJK) for _ in range(size))
+    mixed = "".join(
+        (" ".join(rng.choices(LATIN, k=50)) if i % 2 else "".join(rng.choices(CJK, k=120)))
+        for i in range(size // 200)
+    )[:size]
+    return {"latin": latin, "cjk": cjk, "mixed": mixed}
+
+
+def load_payloads(paths):
+    payloads = {}
+    for path in paths:
+        content = Path(path).read_text(encoding="utf-8")
+        try:
+            data = json.loads(content)
+        except json.JSONDecodeError:
+            payloads[path] = content
+            continue
+        attachments = (data.get("raw_message") or {}).get("attachments") or []
+        for i, attach in enumerate(attachments):
+            payloads[f"{path}#{i}"] = attach.get("extracted_content") or ""
+    return payloads
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="*")
+    parser.add_argument("--size", type=int, default=4_000_000)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    payloads = load_payloads(args.paths) if args.paths else synthetic_payloads(args.size)
+    get_tokenizer()
+
+    print(f"error bound: {TOKEN_ESTIMATE_MAX_ERROR:.1%}")
+    print(f"{'payload':<24} {'chars':>9} {'exact':>9} {'exact_s':>8} {'est_s':>8} {'max_err':>8} {'fallback':>8}")
+    for name, text in payloads.items():
+        start = time.perf_counter()
+        exact = get_token_length(text)
+        exact_seconds = time.perf_counter() - start
+
+        errors = []
+        fallbacks = 0
+        estimate_seconds = 0.0
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            estimated = estimate_token_length(text)
+            estimate_seconds += time.perf_counter() - start
+            if estimated is None:
+                fallbacks += 1
+            else:
+                errors.append(abs(estimated - exact) / max(exact, 1))
+        max_error = f"{max(errors):.2%}" if errors else "-"
+        print(
+            f"{name[:24]:<24} {len(text):>9} {exact:>9} {exact_seconds:>8.3f} "
+            f"{estimate_seconds / args.repeat:>8.4f} {max_error:>8} {fallbacks:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Cold-start cost of the tokenizer per worker process.
+
+Each worker is a fresh interpreter that loads the configured encodings and
+encodes one prompt; we report load time, first-encode latency and RSS. Run once
+with the baked cache and once with --no-cache (TIKTOKEN_CACHE_DIR="" forces a
+download and parse in every worker).
+
+    python -m benchmarks.bench_tokenizer_startup --workers 4
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+WORKER = r"""
+import json, time
+start = time.perf_counter()
+from claude_auditlimit_python.utils.token_utils import get_token_length, preload_tokenizers
+imported = time.perf_counter()
+preload_tokenizers()
+loaded = time.perf_counter()
+get_token_length("hello world, 你好")
+first = time.perf_counter()
+rss_kb = 0
+with open("/proc/self/status") as f:
+    for line in f:
+        if line.startswith("VmRSS:"):
+            rss_kb = int(line.split()[1])
+print(json.dumps({
+    "import_s": imported - start,
+    "load_s": loaded - imported,
+    "first_encode_ms": (first - loaded) * 1000,
+    "rss_mb": rss_kb / 1024,
+}))
+"""
+
+
+def run_worker(env):
+    output = subprocess.check_output([sys.executable, "-c", WORKER], env=env)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--no-cache", action="store_true")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    if args.no_cache:
+        env["TIKTOKEN_CACHE_DIR"] = ""
+
+    print(f"{'worker':>6} {'import_s':>9} {'load_s':>8} {'first_ms':>9} {'rss_mb':>8}")
+    for i in range(args.workers):
+        result = run_worker(env)
+        print(
+            f"{i:>6} {result['import_s']:>9.3f} {result['load_s']:>8.3f} "
+            f"{result['first_encode_ms']:>9.2f} {result['rss_mb']:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
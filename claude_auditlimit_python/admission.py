@@ -0,0 +1,370 @@
+# admission.py
+# /audit_limit 与 /audit_limit/batch 共用的准入判定
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import msgspec
+from loguru import logger
+
+from claude_auditlimit_python import metrics
+from claude_auditlimit_python.degraded_mode import DegradedJournal, DegradedLimiter
+from claude_auditlimit_python.policy import CompiledTier, LimitWindow, PolicyEngine
+from claude_auditlimit_python.redis_manager.admission_manager import AdmissionManager
+from claude_auditlimit_python.redis_manager.base_redis_manager import BaseRedisManager
+from claude_auditlimit_python.redis_manager.blocklist_manager import BlocklistManager
+from claude_auditlimit_python.redis_manager.circuit_breaker import RedisUnavailableError
+from claude_auditlimit_python.redis_manager.device_manager import DeviceManager
+from claude_auditlimit_python.redis_manager.token_usage_manager import TokenUsageManager
+from claude_auditlimit_python.utils.log_utils import record_decision
+from claude_auditlimit_python.utils.request_utils import (
+    decode_audit_model,
+    decode_audit_request,
+    get_attachment_texts,
+    get_prompt,
+)
+from claude_auditlimit_python.utils.token_utils import (
+    estimate_attachments_token_length,
+    get_token_length,
+    get_token_lengths_async,
+)
+
+
+_PERIOD_TEXT = {
+    "3h": ("3 hours", "3小时"),
+    "12h": ("12 hours", "12小时"),
+    "24h": ("24 hours", "24小时"),
+    "1w": ("week", "周"),
+}
+
+
+def limit_message(window: Optional[LimitWindow], wait_seconds: int) -> str:
+    if window is None:
+        return (
+            f"Usage limit exceeded. Please wait {wait_seconds} seconds. "
+            f"您已触发使用频率限制，请等待{wait_seconds}秒后重试。"
+        )
+    period_en, period_zh = _PERIOD_TEXT[window.period]
+    if window.family:
+        period_en += f" for {window.family} models"
+        period_zh += f"({window.family} 模型)"
+    if window.metric == AdmissionManager.METRIC_TOKENS:
+        unit_en, unit_zh = " tokens", " tokens"
+    else:
+        unit_en, unit_zh = "", " 次"
+    return (
+        f"Usage limit exceeded. Current limit is {window.limit}{unit_en} "
+        f"per {period_en}. Please wait {wait_seconds} seconds. "
+        f"您已触发使用频率限制，当前限制为{window.limit}{unit_zh}/{period_zh}，"
+        f"请等待{wait_seconds}秒后重试。"
+    )
+
+
+def device_limit_message(max_devices: int) -> str:
+    return (
+        f"Maximum number of devices ({max_devices}) reached. Please logout from another device first.\n"
+        f"已达到最大设备数 ({max_devices})。请先从另一台设备注销。"
+    )
+
+
+DEVICE_ERROR_MESSAGE = "Failed to verify device\n无法验证设备"
+
+
+class AdmissionItem:
+    """One admission check: the caller's headers and the raw request body."""
+
+    def __init__(
+        self,
+        api_key: str,
+        user_agent: str,
+        host: str,
+        conversation_uuid: str,
+        body: bytes,
+    ):
+        self.api_key = api_key
+        self.user_agent = user_agent
+        self.host = host
+        self.conversation_uuid = conversation_uuid
+        self.body = body
+
+
+class AdmissionDecision:
+    def __init__(
+        self,
+        status_code: int,
+        decision: str,
+        message: Optional[str] = None,
+        wait_seconds: int = 0,
+    ):
+        self.status_code = status_code
+        self.decision = decision
+        self.message = message
+        self.wait_seconds = wait_seconds
+        self.model: Optional[str] = None
+        self.tokens = 0
+        # 是否由 DegradedLimiter 在 redis 不可用时判定
+        self.degraded = False
+        # 估算过的附件 (text, estimated_tokens), 由调用方在响应后补记差值
+        self.pending_estimates: List[Tuple[str, int]] = []
+
+    def update(
+        self,
+        status_code: int,
+        decision: str,
+        message: Optional[str] = None,
+        wait_seconds: int = 0,
+    ) -> None:
+        self.status_code = status_code
+        self.decision = decision
+        self.message = message
+        self.wait_seconds = wait_seconds
+
+    @property
+    def allowed(self) -> bool:
+        return self.status_code == 200
+
+    def to_dict(self) -> dict:
+        return {
+            "status": self.status_code,
+            "decision": self.decision,
+            "wait_seconds": self.wait_seconds,
+            "message": self.message,
+        }
+
+
+_OUTCOMES = {
+    AdmissionManager.TOKEN_LIMIT: ("token_limit", BlocklistManager.REASON_TOKENS),
+    AdmissionManager.REQUEST_LIMIT: ("request_limit", BlocklistManager.REASON_REQUESTS),
+}
+
+
+def _blocked_decision(
+    tier: CompiledTier, reason: str, wait_seconds: int
+) -> AdmissionDecision:
+    if reason == BlocklistManager.REASON_REQUESTS:
+        window = tier.window(AdmissionManager.METRIC_REQUESTS)
+    else:
+        window = tier.window(AdmissionManager.METRIC_TOKENS)
+    message = limit_message(window, wait_seconds)
+    return AdmissionDecision(429, f"blocklist_{reason}", message, wait_seconds)
+
+
+async def _count_tokens(item: AdmissionItem, decision: AdmissionDecision) -> int:
+    audit_request = decode_audit_request(item.body)
+    # 获取 prompt - 输入内容
+    token_usage = get_token_length(get_prompt(audit_request))
+    attachment_texts = get_attachment_texts(audit_request)
+    if attachment_texts:
+        attach_token_usage, decision.pending_estimates = (
+            await estimate_attachments_token_length(attachment_texts)
+        )
+        token_usage += attach_token_usage
+    return token_usage
+
+
+async def evaluate_admissions(
+    items: List[AdmissionItem], route: str = "/audit_limit"
+) -> List[AdmissionDecision]:
+    """
+    Decide every item with the same rules as a single /audit_limit call.
+
+    Device checks take one pipeline, and each api_key's limit checks and
+    increments run as one script in a second pipeline, so the number of Redis
+    round trips does not grow with the number of items. Items of the same
+    api_key are applied in order.
+    """
+    decisions: List[Optional[AdmissionDecision]] = [None] * len(items)
+    tiers = [PolicyEngine.tier_for(item.api_key) for item in items]
+
+    # Check device authorization, using user agent as device identifier
+    try:
+        devices_allowed = await BaseRedisManager.breaker.call(
+            DeviceManager().check_and_add_devices,
+            [
+                (item.api_key, item.user_agent, item.user_agent, item.host, tier.max_devices)
+                for item, tier in zip(items, tiers)
+            ],
+        )
+    except RedisUnavailableError as e:
+        # redis 不可用时不限制设备数
+        logger.debug(f"Skipping device checks: {e}")
+        metrics.incr("degraded_device_checks", len(items))
+        devices_allowed = [True] * len(items)
+    except Exception as e:
+        logger.error(f"Failed to verify devices: {e}")
+        devices_allowed = None
+
+    metered: List[int] = []
+    for i, item in enumerate(items):
+        if devices_allowed is None:
+            decisions[i] = AdmissionDecision(500, "device_error", DEVICE_ERROR_MESSAGE)
+            continue
+        if not devices_allowed[i]:
+            decisions[i] = AdmissionDecision(
+                403, "device_limit", device_limit_message(tiers[i].max_devices)
+            )
+            continue
+        # 先只解码 model, 非 claude 的请求不会构建其余字段
+        try:
+            model = decode_audit_model(item.body)
+        except msgspec.DecodeError:
+            decisions[i] = AdmissionDecision(400, "invalid_json", "Invalid JSON data")
+            continue
+        logger.debug("audit_limit model: {}, body size: {}", model, len(item.body))
+        if "claude" not in model.lower():
+            decisions[i] = AdmissionDecision(200, "not_metered")
+        else:
+            # 已知超限的 key 直接在本地黑名单拒绝, 不访问 redis
+            blocked = BlocklistManager.get_local_block(item.api_key)
+            if blocked:
+                wait_seconds, reason = blocked
+                decisions[i] = _blocked_decision(tiers[i], reason, wait_seconds)
+            else:
+                decisions[i] = AdmissionDecision(200, "allowed")
+                metered.append(i)
+        decisions[i].model = model
+
+    if metered:
+        await _admit_metered(items, decisions, metered, tiers)
+
+    for item, decision in zip(items, decisions):
+        fields = {}
+        if decision.model is not None:
+            fields["model"] = decision.model
+        if decision.wait_seconds:
+            fields["wait_seconds"] = decision.wait_seconds
+        if decision.tokens:
+            fields["tokens"] = decision.tokens
+        if decision.decision == "allowed":
+            fields["estimated"] = bool(decision.pending_estimates)
+        if decision.degraded:
+            fields["degraded"] = True
+        record_decision(
+            route, item.api_key, decision.decision, decision.status_code, **fields
+        )
+    return decisions
+
+
+def _fail_metered(decisions: List[AdmissionDecision], metered: List[int], e) -> None:
+    logger.error(f"Error checking usage limits: {e}")
+    for i in metered:
+        if decisions[i].allowed:
+            decisions[i].update(500, "error", f"Error checking usage limits: {str(e)}")
+            decisions[i].pending_estimates = []
+
+
+async def _admit_metered(
+    items: List[AdmissionItem],
+    decisions: List[AdmissionDecision],
+    metered: List[int],
+    tiers: List[CompiledTier],
+) -> None:
+    breaker = BaseRedisManager.breaker
+    admission_manager = AdmissionManager()
+    try:
+        # 已经超出 token 限制的 key 不必计算 token, 脚本会直接拒绝
+        try:
+            used_3h = await breaker.call(
+                admission_manager.get_token_usage_3h,
+                list({items[i].api_key: None for i in metered}),
+            )
+        except RedisUnavailableError as e:
+            logger.debug(f"Admission falling back to local limits: {e}")
+            used_3h = None
+
+        requests: Dict[str, List[Tuple[str, int, str]]] = defaultdict(list)
+        key_tiers: Dict[str, CompiledTier] = {}
+        for i in metered:
+            item, decision = items[i], decisions[i]
+            key_tiers[item.api_key] = tiers[i]
+            token_limit = tiers[i].limit(AdmissionManager.METRIC_TOKENS)
+            if (
+                used_3h is None
+                or token_limit is None
+                or used_3h[item.api_key] < token_limit
+            ):
+                try:
+                    decision.tokens = await _count_tokens(item, decision)
+                except msgspec.DecodeError:
+                    decision.update(400, "invalid_json", "Invalid JSON data")
+                    continue
+                except Exception as e:
+                    # 只影响这一项, 同一批的其他请求照常判定
+                    logger.error(f"Error counting tokens: {e}")
+                    decision.update(500, "error", f"Error counting tokens: {str(e)}")
+                    decision.pending_estimates = []
+                    continue
+            logger.debug("api_key: {}, input usage: {}", item.api_key, decision.tokens)
+            requests[item.api_key].append(
+                (
+                    item.conversation_uuid,
+                    decision.tokens,
+                    PolicyEngine.model_family(decision.model),
+                )
+            )
+
+        if not requests:
+            return
+        now = int(time.time())
+        degraded = used_3h is None
+        if degraded:
+            # fail-open: 本地按较低的限额放行, 记账写入本地日志, 恢复后重放
+            outcomes = DegradedLimiter.admit(requests, key_tiers, now)
+        else:
+            # 脚本发出后 redis 可能已经记账, 超时取消只是丢掉了回复; 此时再降级,
+            # 重放本地日志会重复记账. 所以这里不设总超时也不降级, 失败即返回错误;
+            # 取连接和建连仍受连接池和 socket 超时限制
+            outcomes = await breaker.call(
+                admission_manager.admit, requests, key_tiers, now, timeout=None
+            )
+    except Exception as e:
+        _fail_metered(decisions, metered, e)
+        return
+
+    positions: Dict[str, int] = defaultdict(int)
+    for i in metered:
+        decision = decisions[i]
+        if not decision.allowed:
+            continue
+        api_key = items[i].api_key
+        outcome, wait_seconds, window_index = outcomes[api_key][positions[api_key]]
+        positions[api_key] += 1
+        decision.degraded = degraded
+        if outcome == AdmissionManager.ADMITTED:
+            continue
+        name, reason = _OUTCOMES[outcome]
+        window = tiers[i].windows[window_index - 1]
+        # 本地降级限额只在降级期间有效; 只限制某个模型系列的窗口不能拒绝整个 key
+        if not degraded and not window.family:
+            BlocklistManager.block_local(api_key, wait_seconds, reason)
+        decision.update(429, name, limit_message(window, wait_seconds), wait_seconds)
+        if outcome == AdmissionManager.TOKEN_LIMIT:
+            # 没有记账, 也就不需要补记估算差值
+            decision.tokens = 0
+            decision.pending_estimates = []
+
+
+async def reconcile_estimated_usage(api_key, conversation_uuid, pending):
+    """Count estimated attachments exactly and charge the difference."""
+    try:
+        exact = sum(await get_token_lengths_async([text for text, _ in pending]))
+    except Exception as e:
+        logger.error(f"Failed to reconcile estimated usage: {e}")
+        return
+    delta = exact - sum(estimated for _, estimated in pending)
+    logger.debug("estimated usage correction for {}: {}", api_key, delta)
+    if not delta:
+        return
+    try:
+        # 与准入一样, 发出后不设超时, 否则已经写入的差值会再从本地日志重放一次
+        corrected = await BaseRedisManager.breaker.call(
+            TokenUsageManager().correct_conversations,
+            [(api_key, conversation_uuid, delta)],
+            timeout=None,
+        )
+    except RedisUnavailableError as e:
+        logger.debug(f"Journaling usage correction: {e}")
+        corrected = [False]
+    if not corrected[0]:
+        # redis 不可用时写入本地日志, 恢复后重放
+        DegradedJournal.append(api_key, conversation_uuid, delta, False, correction=True)
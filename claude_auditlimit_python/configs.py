@@ -6,6 +6,44 @@ import os
 REDIS_HOST = os.environ.get("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.environ.get("REDIS_PORT", 6379))
 REDIS_DB = 2
+# 客户端一致性哈希分片: 逗号分隔的 host:port 列表, 为空时只用 REDIS_HOST:REDIS_PORT
+# 全局状态(黑名单、notify 队列与去重)放在第一个节点上
+REDIS_SHARDS = [
+    node.strip() for node in os.environ.get("REDIS_SHARDS", "").split(",") if node.strip()
+]
+# key 布局: legacy (token:sk-xxx:3h) 或 hashtag (token:{sk-xxx}:3h),
+# hashtag 布局下同一个 api key 的所有 key 落在同一个 cluster slot;
+# 切换前用 utils/migrate_keyspace.py 迁移已有的 key
+REDIS_KEY_LAYOUT = os.environ.get("REDIS_KEY_LAYOUT", "legacy")
+# 设置后通过 unix socket 连接主节点, 忽略 REDIS_HOST/REDIS_PORT (不能与分片同时使用)
+REDIS_UNIX_SOCKET = os.environ.get("REDIS_UNIX_SOCKET")
+# 所有 manager 共用的连接池: 最大连接数、等待空闲连接的超时、读写/建连超时、健康检查间隔
+REDIS_POOL_MAX_CONNECTIONS = int(os.environ.get("REDIS_POOL_MAX_CONNECTIONS", 64))
+REDIS_POOL_TIMEOUT_SECONDS = 2
+REDIS_SOCKET_TIMEOUT_SECONDS = 5
+REDIS_SOCKET_CONNECT_TIMEOUT_SECONDS = 2
+REDIS_HEALTH_CHECK_INTERVAL_SECONDS = 30
+# 启动预热时每个节点预先建立的连接数
+REDIS_POOL_WARM_CONNECTIONS = min(8, REDIS_POOL_MAX_CONNECTIONS)
+# TCP keepalive: 空闲多久开始探测、探测间隔、探测次数
+REDIS_SOCKET_KEEPALIVE_IDLE_SECONDS = 60
+REDIS_SOCKET_KEEPALIVE_INTERVAL_SECONDS = 10
+REDIS_SOCKET_KEEPALIVE_COUNT = 3
+# 2 = RESP2, 3 = RESP3; 安装 hiredis (redis[hiredis]) 后自动使用 hiredis 解析
+REDIS_PROTOCOL = int(os.environ.get("REDIS_PROTOCOL", 2))
+# 只读副本: 统计和管理接口的只读查询走副本, 准入始终走主节点 (不能与分片同时使用)
+# REDIS_REPLICAS 为逗号分隔的 host:port 列表; 也可以通过 Sentinel 发现副本
+REDIS_REPLICAS = [
+    node.strip() for node in os.environ.get("REDIS_REPLICAS", "").split(",") if node.strip()
+]
+REDIS_SENTINELS = [
+    node.strip() for node in os.environ.get("REDIS_SENTINELS", "").split(",") if node.strip()
+]
+REDIS_SENTINEL_SERVICE = os.environ.get("REDIS_SENTINEL_SERVICE", "mymaster")
+# 副本超过这个时间没有收到主节点的数据就不再读它 (主节点默认每 10 秒 ping 一次副本)
+REDIS_REPLICA_MAX_LAG_SECONDS = 10
+REDIS_REPLICA_CHECK_INTERVAL_SECONDS = 5
+REDIS_REPLICA_DISCOVERY_INTERVAL_SECONDS = 30
 
 
 DOCS_USERNAME = "claude-backend"
@@ -19,12 +57,133 @@ RATE_LIMIT = (
 )  # 6w tokens for 3 hours # token limit for the 3 hours  # Configure this value as needed
 
 USAGE_RECORD_RATE_LIMIT = 45
+# 分级限额: 未分配等级的 key 使用默认等级, 默认等级未在 redis 中定义时使用上面的限额
+DEFAULT_POLICY_TIER = "default"
+# 可以单独设置窗口的模型系列, 按模型名包含的子串匹配
+POLICY_MODEL_FAMILIES = ("opus", "sonnet", "haiku")
+# 策略更新订阅断开后的重连间隔, 以及定时全量重新加载的间隔
+POLICY_RESUBSCRIBE_SECONDS = 5
+POLICY_RELOAD_INTERVAL_SECONDS = 300
 DEFAULT_TOKENIZER = "cl100k_base"
+# tiktoken 批量编码使用的线程数
+TOKENIZER_NUM_THREADS = min(8, os.cpu_count() or 1)
+# 附件 token 数缓存的条目数
+ATTACHMENT_TOKEN_CACHE_SIZE = 4096
+# 超大文本的 token 估算: 起始长度(字符)、采样块数、每块字符数、允许的相对误差
+TOKEN_ESTIMATE_MIN_CHARS = 512 * 1024
+TOKEN_ESTIMATE_SAMPLES = 16
+TOKEN_ESTIMATE_SAMPLE_CHARS = 4096
+TOKEN_ESTIMATE_MAX_ERROR = 0.05
 
 
 # limits check的函数
 CLAUDE_CLIENT_LIMIT_CHECKS_INTERVAL_MINUTES = 60
 
+# 黑名单扫描: 间隔(秒)、每批 SCAN 的数量、每次扫描最多使用的 redis 操作数
+BLOCKLIST_SWEEP_INTERVAL_SECONDS = 20
+BLOCKLIST_SWEEP_BATCH_SIZE = 500
+BLOCKLIST_SWEEP_MAX_REDIS_OPS = 5000
+
+# 对话计数: 一个 apikey 无新增用量多久后整体过期, 对话空闲多久后合并进聚合字段
+# 合并后的对话再次使用时会从 0 重新计数, 所以合并时间不能短于过期时间
+TOKEN_USAGE_IDLE_TTL_SECONDS = 7 * 24 * 60 * 60
+TOKEN_USAGE_COMPACT_AFTER_SECONDS = TOKEN_USAGE_IDLE_TTL_SECONDS
+TOKEN_USAGE_COMPACTION_BATCH_SIZE = 200
+
+# notify 记账队列: memory(进程内) 或 redis(stream, 多 worker 共享)
+NOTIFY_QUEUE_BACKEND = os.environ.get("NOTIFY_QUEUE_BACKEND", "memory")
+NOTIFY_QUEUE_SIZE = 10000
+NOTIFY_QUEUE_WORKERS = 2
+NOTIFY_BATCH_SIZE = 100
+NOTIFY_DRAIN_TIMEOUT_SECONDS = 10
+# redis 队列: 一条消息最多投递的次数, 超过后移到死信 stream (notify_queue:dead)
+NOTIFY_MAX_DELIVERIES = 5
+
+# notify 去重: 上游重试时同一条消息只记一次账
+NOTIFY_DEDUPE_ENABLED = os.environ.get("NOTIFY_DEDUPE_ENABLED", "1") == "1"
+NOTIFY_DEDUPE_WINDOW_SECONDS = 10 * 60
+NOTIFY_REQUEST_ID_HEADER = "X-Request-Id"
+
+# /audit_limit/batch 单次最多的准入请求数
+AUDIT_BATCH_MAX_ITEMS = 500
+
+# 接口响应: Accept 头要求 msgpack 时返回 msgpack, 否则返回 JSON (均由 msgspec 编码)
+RESPONSE_MSGPACK_ENABLED = os.environ.get("RESPONSE_MSGPACK_ENABLED", "1") == "1"
+
+# uvicorn: keep-alive 超时应大于上游代理的空闲超时, 避免复用已被服务端关闭的连接
+SERVER_KEEP_ALIVE_SECONDS = int(os.environ.get("SERVER_KEEP_ALIVE_SECONDS", 65))
+SERVER_BACKLOG = int(os.environ.get("SERVER_BACKLOG", 4096))
+
+# /debug/* (需要文档的 basic auth): 单次采样的最长时间、最小采样间隔、tracemalloc 保存的栈深度
+DEBUG_MAX_SECONDS = 60
+DEBUG_MIN_INTERVAL_SECONDS = 0.001
+DEBUG_TRACEMALLOC_FRAMES = 8
+
+# 导出: 每批 SCAN 的数量 (每批一次 pipeline 读取)
+EXPORT_SCAN_COUNT = 1000
+
+# 用量历史: 每个 key 按小时汇总, 超过保留天数的整天由定时任务合并为按天汇总
+HISTORY_HOURLY_RETENTION_DAYS = 3
+HISTORY_DAILY_RETENTION_DAYS = 180
+# 按天汇总时自然日的时区偏移 (东八区)
+HISTORY_DAY_OFFSET_HOURS = 8
+HISTORY_ROLLUP_INTERVAL_MINUTES = 60
+# /usage_history 单次最多返回的点数和 top-K 的最大 K
+HISTORY_MAX_POINTS = 5000
+HISTORY_MAX_TOP_K = 100
+
+# Redis 熔断: 连续失败次数(慢调用也算失败)、慢调用阈值、单次调用超时、熔断多久后放行探测请求
+REDIS_BREAKER_FAILURE_THRESHOLD = 5
+REDIS_BREAKER_SLOW_CALL_SECONDS = 0.5
+REDIS_CALL_TIMEOUT_SECONDS = 2
+REDIS_BREAKER_OPEN_SECONDS = 10
+# redis 调用延迟滑动平均的平滑系数
+REDIS_LATENCY_EWMA_ALPHA = 0.2
+
+# 准入控制: 按路由分组限制并发, 超出并发的请求在有界队列里等待, 等不到就返回 503
+# 分组 -> (最大并发, 最大排队数); 未列出的路由属于 admin 组
+ADMISSION_CONTROL_ENABLED = os.environ.get("ADMISSION_CONTROL_ENABLED", "1") == "1"
+ADMISSION_BUDGETS = {
+    "admission": (int(os.environ.get("ADMISSION_MAX_CONCURRENCY", 64)), 128),
+    "notify": (32, 256),
+    # 用户自己的设备查询与登出, 不和管理统计抢 admin 的名额
+    "user": (16, 64),
+    "admin": (4, 8),
+    # 导出是长时间的流式响应, 单独限额, 不占用 admin 的名额
+    "export": (2, 2),
+}
+ADMISSION_ROUTE_BUDGETS = {
+    "/audit_limit": "admission",
+    "/audit_limit/batch": "admission",
+    "/response_notify": "notify",
+    "/document_notify": "notify",
+    "/devices": "user",
+    "/logout": "user",
+    "/token_stats": "admin",
+    "/all_token_devices": "admin",
+    "/all_token_usage": "admin",
+    "/usage_history": "admin",
+}
+# 按路径前缀选择限额 (带路径参数的路由)
+ADMISSION_ROUTE_PREFIX_BUDGETS = {
+    "/export/": "export",
+}
+# 不受准入控制的路由, 过载时也能查看状态
+ADMISSION_EXEMPT_PATHS = (
+    "/",
+    "/ready",
+    "/metrics",
+    "/debug/profile",
+    "/debug/memory",
+    "/debug/structures",
+)
+# CoDel: 队列在最近一个 interval 内一直不空时, 排队超过 target 就放弃; 否则最多排队 interval
+ADMISSION_QUEUE_TARGET_SECONDS = 0.05
+ADMISSION_QUEUE_INTERVAL_SECONDS = 0.5
+# redis 延迟超过这个值时不再排队, 超出并发的请求直接 503
+ADMISSION_REDIS_LATENCY_TARGET_SECONDS = 0.1
+ADMISSION_RETRY_AFTER_SECONDS = 1
+
 
 # IP访问的限制
 IP_REQUEST_LIMIT_PER_MINUTE = 40  # 一分钟40次
@@ -34,6 +193,32 @@ ROOT = Path(__file__).parent.parent
 
 LOGS_PATH = ROOT / "logs"
 
+# 日志: 级别、后台写文件队列长度(满了就丢弃并计数)、payload 截断长度、按路由采样率
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "DEBUG")
+LOG_QUEUE_SIZE = 10000
+LOG_PAYLOAD_MAX_CHARS = 2000
+LOG_SAMPLE_RATES = {
+    "/response_notify": 0.05,
+    "/document_notify": 0.05,
+}
+
+# 准入决策的 JSONL 审计记录
+AUDIT_TRAIL_ENABLED = os.environ.get("AUDIT_TRAIL_ENABLED", "1") == "1"
+AUDIT_TRAIL_PATH = LOGS_PATH / "audit.jsonl"
+AUDIT_TRAIL_MAX_BYTES = 100 * 1024 * 1024
+AUDIT_TRAIL_BACKUP_COUNT = 5
+
+# 降级模式: Redis 不可用时每个 worker 的本地限额(占正常限额的比例), 记账先写本地日志, 恢复后重放
+DEGRADED_LIMIT_FRACTION = 0.25
+DEGRADED_JOURNAL_DIR = LOGS_PATH / "degraded_journal"
+DEGRADED_REPLAY_INTERVAL_SECONDS = 30
+
+# 预先下载好的 tiktoken 词表目录(离线加载), 以及启动时预加载的编码
+TOKENIZER_CACHE_DIR = Path(
+    os.environ.get("TOKENIZER_CACHE_DIR", ROOT / "tokenizer_cache")
+)
+TOKENIZER_ENCODINGS = os.environ.get("TOKENIZER_ENCODINGS", DEFAULT_TOKENIZER).split(",")
+
 MAX_DEVICES = 3
 
 LOGS_PATH.mkdir(exist_ok=True)
@@ -0,0 +1,261 @@
+# debug.py
+# /debug/*: 事件循环的采样 profiler、tracemalloc 快照对比、进程内数据结构的大小
+# 只在调用时启动采样线程或 tracemalloc, 平时没有任何开销
+import asyncio
+import os
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+import msgspec
+
+from claude_auditlimit_python import metrics
+from claude_auditlimit_python.configs import (
+    DEBUG_MAX_SECONDS,
+    DEBUG_MIN_INTERVAL_SECONDS,
+    DEBUG_TRACEMALLOC_FRAMES,
+)
+from claude_auditlimit_python.degraded_mode import DegradedLimiter
+from claude_auditlimit_python.policy import PolicyEngine
+from claude_auditlimit_python.redis_manager.base_redis_manager import BaseRedisManager
+from claude_auditlimit_python.redis_manager.blocklist_manager import BlocklistManager
+from claude_auditlimit_python.redis_manager.read_replicas import ReadReplicas
+from claude_auditlimit_python.redis_manager.redis_pool import RedisPool
+from claude_auditlimit_python.utils.token_utils import (
+    attachment_token_cache,
+    get_tokenizer,
+)
+
+FORMAT_COLLAPSED = "collapsed"
+FORMAT_SPEEDSCOPE = "speedscope"
+PROFILE_FORMATS = (FORMAT_COLLAPSED, FORMAT_SPEEDSCOPE)
+GROUP_BY = ("lineno", "filename", "traceback")
+
+
+class DebugBusyError(Exception):
+    """Another profile or memory trace is already running."""
+
+
+_busy = False
+
+
+@contextmanager
+def _exclusive():
+    # 同时只允许一个采样, 避免互相干扰
+    global _busy
+    if _busy:
+        raise DebugBusyError("another profile or memory trace is running")
+    _busy = True
+    try:
+        yield
+    finally:
+        _busy = False
+
+
+def _check_seconds(seconds: float) -> None:
+    if not 0 < seconds <= DEBUG_MAX_SECONDS:
+        raise ValueError(f"seconds must be in (0, {DEBUG_MAX_SECONDS}]")
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    filename = os.path.basename(code.co_filename)
+    return f"{code.co_qualname} ({filename}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Counts the stacks of one thread, sampled from a helper thread."""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="debug-stack-sampler", daemon=True
+        )
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def _collapsed(stacks: Counter) -> bytes:
+    # Brendan Gregg 的 collapsed 格式, 可直接交给 flamegraph.pl
+    return "".join(
+        f"{';'.join(stack)} {count}\n" for stack, count in stacks.most_common()
+    ).encode()
+
+
+def _speedscope(stacks: Counter, interval: float) -> bytes:
+    # https://www.speedscope.app 可直接打开的火焰图文件
+    frames: Dict[str, int] = {}
+    samples, weights = [], []
+    for stack, count in stacks.most_common():
+        samples.append([frames.setdefault(name, len(frames)) for name in stack])
+        weights.append(count * interval)
+    return msgspec.json.encode(
+        {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": [{"name": name} for name in frames]},
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": "event loop",
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": sum(weights),
+                    "samples": samples,
+                    "weights": weights,
+                }
+            ],
+        }
+    )
+
+
+async def profile_event_loop(
+    seconds: float, interval: float, fmt: str = FORMAT_COLLAPSED
+) -> bytes:
+    """
+    Sample the event loop thread every ``interval`` seconds for ``seconds``.
+    Idle time shows up as the selector wait in ``BaseEventLoop._run_once``.
+    """
+    _check_seconds(seconds)
+    if interval < DEBUG_MIN_INTERVAL_SECONDS:
+        raise ValueError(f"interval must be at least {DEBUG_MIN_INTERVAL_SECONDS}s")
+    if fmt not in PROFILE_FORMATS:
+        raise ValueError(f"unknown format {fmt!r}, expected one of {PROFILE_FORMATS}")
+
+    with _exclusive():
+        sampler = StackSampler(threading.get_ident(), interval)
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            sampler.stop()
+    metrics.incr("debug_profiles")
+    if fmt == FORMAT_SPEEDSCOPE:
+        return _speedscope(sampler.stacks, interval)
+    return _collapsed(sampler.stacks)
+
+
+def _compare(before, after, group_by: str, top: int) -> List[Dict[str, Any]]:
+    exclude = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ]
+    stats = after.filter_traces(exclude).compare_to(
+        before.filter_traces(exclude), group_by
+    )
+    return [
+        {
+            "location": stat.traceback.format()
+            if group_by == "traceback"
+            else str(stat.traceback[0]),
+            "size_diff": stat.size_diff,
+            "size": stat.size,
+            "count_diff": stat.count_diff,
+            "count": stat.count,
+        }
+        for stat in stats[:top]
+    ]
+
+
+async def tracemalloc_diff(
+    seconds: float, top: int = 30, group_by: str = "lineno"
+) -> Dict[str, Any]:
+    """
+    Allocations made during ``seconds`` that are still alive, largest first.
+    tracemalloc runs only for the duration unless it was already on.
+    """
+    _check_seconds(seconds)
+    if group_by not in GROUP_BY:
+        raise ValueError(f"unknown group_by {group_by!r}, expected one of {GROUP_BY}")
+
+    with _exclusive():
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start(DEBUG_TRACEMALLOC_FRAMES)
+        try:
+            # 快照和对比都比较耗时, 放到线程里执行
+            before = await asyncio.to_thread(tracemalloc.take_snapshot)
+            await asyncio.sleep(seconds)
+            after = await asyncio.to_thread(tracemalloc.take_snapshot)
+            traced, peak = tracemalloc.get_traced_memory()
+        finally:
+            if started:
+                tracemalloc.stop()
+    metrics.incr("debug_memory_traces")
+    return {
+        "seconds": seconds,
+        "traced_bytes": traced,
+        "peak_bytes": peak,
+        "top": await asyncio.to_thread(_compare, before, after, group_by, top),
+    }
+
+
+def _approx_size(container) -> int:
+    # 容器本身加上一层元素的大小, 不递归
+    size = sys.getsizeof(container)
+    if isinstance(container, dict):
+        return size + sum(
+            sys.getsizeof(k) + sys.getsizeof(v) for k, v in container.items()
+        )
+    return size + sum(sys.getsizeof(item) for item in container)
+
+
+def _middleware_structures(app) -> List[Tuple[str, Any]]:
+    found = []
+    layer: Optional[Any] = getattr(app, "middleware_stack", None)
+    seen = set()
+    while layer is not None and id(layer) not in seen:
+        seen.add(id(layer))
+        limiter = getattr(layer, "limiter", None)
+        if limiter is not None:
+            found.append(("rate_limiter_requests", limiter.requests))
+        for name, budget in getattr(layer, "budgets", {}).items():
+            found.append((f"admission_control_{name}_queue", budget._waiters))
+        layer = getattr(layer, "app", None)
+    return found
+
+
+def _measure(container) -> Dict[str, int]:
+    return {"items": len(container), "bytes": _approx_size(container)}
+
+
+def structure_sizes(app=None) -> Dict[str, Dict[str, int]]:
+    """Item counts and approximate shallow sizes of in-process structures."""
+    structures = [
+        ("redis_manager_instances", BaseRedisManager._instances),
+        ("redis_clients", RedisPool._clients),
+        ("read_replica_freshness", ReadReplicas._fresh),
+        ("local_blocklist", BlocklistManager._local_blocklist),
+        ("degraded_usage", DegradedLimiter._usage),
+        ("policy_tiers", PolicyEngine._tiers),
+        ("policy_assignments", PolicyEngine._assignments),
+        ("metrics_counters", metrics._counters),
+    ]
+    if app is not None:
+        structures.extend(_middleware_structures(app))
+
+    result = {name: _measure(container) for name, container in structures}
+    # 分词线程会同时修改缓存
+    with attachment_token_cache._lock:
+        result["attachment_token_cache"] = _measure(attachment_token_cache._counts)
+    result["tokenizers"] = {"items": get_tokenizer.cache_info().currsize}
+    return result
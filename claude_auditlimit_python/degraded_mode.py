@@ -0,0 +1,280 @@
+# degraded_mode.py
+# Redis 不可用时的本地准入: 每个 worker 的内存计数 + 追加写入的本地记账日志, 恢复后重放
+import json
+import os
+import time
+from collections import defaultdict
+from itertools import groupby
+from pathlib import Path
+from typing import Dict, List, Optional, TextIO, Tuple
+
+from loguru import logger
+
+from claude_auditlimit_python import metrics
+from claude_auditlimit_python.configs import DEGRADED_JOURNAL_DIR, DEGRADED_LIMIT_FRACTION
+from claude_auditlimit_python.policy import CompiledTier
+from claude_auditlimit_python.redis_manager.admission_manager import AdmissionManager
+from claude_auditlimit_python.redis_manager.base_redis_manager import BaseRedisManager
+from claude_auditlimit_python.redis_manager.token_usage_manager import TokenUsageManager
+
+
+class _LocalUsage:
+    def __init__(self, window_start: int):
+        self.window_start = window_start
+        self.tokens = 0
+        self.requests = 0
+        self.conversations: Dict[str, int] = defaultdict(int)
+
+
+class DegradedLimiter:
+    """
+    Per-worker stand-in for AdmissionManager while Redis is unavailable.
+
+    Each key gets a fixed 3-hour window with ``DEGRADED_LIMIT_FRACTION`` of its
+    tier's 3-hour all-model limits, since other workers admit the same key
+    independently; the tier's other windows are not enforced locally. Every
+    charge is appended to the journal and replayed into Redis later.
+    """
+
+    WINDOW_SECONDS = 3 * 3600
+
+    _usage: Dict[str, _LocalUsage] = {}
+
+    @staticmethod
+    def _local_window(tier: CompiledTier, metric: str) -> Tuple[Optional[int], int]:
+        """(local limit or None, 1-based window index) for the tier's 3h window."""
+        window = tier.window(metric)
+        if window is None:
+            return None, 0
+        limit = int(window.limit * DEGRADED_LIMIT_FRACTION)
+        if metric == AdmissionManager.METRIC_REQUESTS:
+            limit = max(limit, 1)
+        return limit, tier.windows.index(window) + 1
+
+    @classmethod
+    def _get_usage(cls, api_key: str, now: int) -> _LocalUsage:
+        usage = cls._usage.get(api_key)
+        if usage is None or now - usage.window_start >= cls.WINDOW_SECONDS:
+            usage = cls._usage[api_key] = _LocalUsage(now)
+        return usage
+
+    @classmethod
+    def admit(
+        cls,
+        requests: Dict[str, List[Tuple[str, int, str]]],
+        tiers: Dict[str, CompiledTier],
+        now: int,
+    ) -> Dict[str, List[Tuple[int, int, int]]]:
+        """Same contract as ``AdmissionManager.admit``."""
+        outcomes: Dict[str, List[Tuple[int, int, int]]] = {}
+        for api_key, entries in requests.items():
+            results = outcomes[api_key] = []
+            token_limit, token_window = cls._local_window(
+                tiers[api_key], AdmissionManager.METRIC_TOKENS
+            )
+            request_limit, request_window = cls._local_window(
+                tiers[api_key], AdmissionManager.METRIC_REQUESTS
+            )
+            for conversation_uuid, tokens, _ in entries:
+                usage = cls._get_usage(api_key, now)
+                wait_seconds = usage.window_start + cls.WINDOW_SECONDS - now
+                if token_limit is not None and usage.tokens >= token_limit:
+                    results.append(
+                        (AdmissionManager.TOKEN_LIMIT, wait_seconds, token_window)
+                    )
+                    continue
+                usage.conversations[conversation_uuid] += tokens
+                usage.tokens += usage.conversations[conversation_uuid]
+                if request_limit is not None and usage.requests >= request_limit:
+                    DegradedJournal.append(api_key, conversation_uuid, tokens, False)
+                    results.append(
+                        (AdmissionManager.REQUEST_LIMIT, wait_seconds, request_window)
+                    )
+                    continue
+                usage.requests += 1
+                DegradedJournal.append(api_key, conversation_uuid, tokens, True)
+                results.append((AdmissionManager.ADMITTED, 0, 0))
+        metrics.incr("degraded_admissions", sum(len(e) for e in requests.values()))
+        return outcomes
+
+
+class DegradedJournal:
+    """
+    Append-only JSONL segments ``{pid}.{seq}.jsonl`` under
+    ``DEGRADED_JOURNAL_DIR``; one line per charge made without Redis.
+    A ``correction`` line adds its tokens to the conversation and the usage
+    as is (see ``TokenUsageManager.correct_conversations``) instead of
+    charging the conversation total.
+
+    ``replay`` closes the current segment, applies every closed segment of
+    this worker (plus segments left behind by dead workers) and deletes each
+    segment once applied. Tokens and the request of a line are charged
+    together; when a shard fails, the segment is rewritten with only the
+    lines that were not applied, so the next replay does not charge the
+    others again.
+    """
+
+    _file: Optional[TextIO] = None
+    _sequence = 0
+    _pending = 0
+
+    @classmethod
+    def append(
+        cls,
+        api_key: str,
+        conversation_uuid: str,
+        tokens: int,
+        request: bool,
+        correction: bool = False,
+    ) -> None:
+        if cls._file is None:
+            DEGRADED_JOURNAL_DIR.mkdir(parents=True, exist_ok=True)
+            cls._sequence += 1
+            path = DEGRADED_JOURNAL_DIR / f"{os.getpid()}.{cls._sequence}.jsonl"
+            cls._file = open(path, "a", encoding="utf-8")
+        entry = {
+            "ts": int(time.time()),
+            "api_key": api_key,
+            "conversation_uuid": conversation_uuid,
+            "tokens": tokens,
+            "request": request,
+        }
+        if correction:
+            entry["correction"] = True
+        cls._file.write(json.dumps(entry) + "\n")
+        cls._file.flush()
+        cls._pending += 1
+
+    @classmethod
+    def pending(cls) -> int:
+        return cls._pending
+
+    @classmethod
+    def close(cls) -> None:
+        if cls._file is not None:
+            cls._file.close()
+            cls._file = None
+
+    @staticmethod
+    def _is_orphan(path: Path) -> bool:
+        pid = int(path.name.split(".")[0])
+        if pid == os.getpid():
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            return False
+        return False
+
+    @classmethod
+    def _claim_segments(cls) -> List[Path]:
+        own_prefix = f"{os.getpid()}."
+        segments = []
+        for path in sorted(DEGRADED_JOURNAL_DIR.glob("*.jsonl")):
+            if path.name.startswith(own_prefix):
+                segments.append(path)
+            elif cls._is_orphan(path):
+                # rename 是原子的, 多个 worker 同时认领时只有一个成功
+                cls._sequence += 1
+                claimed = DEGRADED_JOURNAL_DIR / f"{os.getpid()}.{cls._sequence}.jsonl"
+                try:
+                    path.rename(claimed)
+                except FileNotFoundError:
+                    continue
+                segments.append(claimed)
+        return segments
+
+    @staticmethod
+    def _read_segment(path: Path) -> List[dict]:
+        entries = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # 进程崩溃时最后一行可能不完整
+                    logger.warning(f"Skipping torn line in {path.name}")
+        return entries
+
+    @staticmethod
+    def _rewrite_segment(path: Path, entries: List[dict]) -> None:
+        # 先写临时文件再替换, 崩溃时不会留下半个段文件
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(entry) + "\n" for entry in entries)
+        os.replace(tmp, path)
+
+    @staticmethod
+    async def _apply(entries: List[dict]) -> List[bool]:
+        """
+        Charge the entries in order, one call per run of charges or
+        corrections; stops at the first run with a failed shard. Returns per
+        entry whether it was applied.
+        """
+        manager = TokenUsageManager()
+        applied = [False] * len(entries)
+        runs = groupby(
+            enumerate(entries), key=lambda item: bool(item[1].get("correction"))
+        )
+        for correction, run in runs:
+            run = list(run)
+            if correction:
+                ok = await manager.correct_conversations(
+                    [
+                        (entry["api_key"], entry["conversation_uuid"], entry["tokens"])
+                        for _, entry in run
+                    ]
+                )
+            else:
+                ok = await manager.charge_conversations(
+                    [
+                        (
+                            entry["api_key"],
+                            entry["conversation_uuid"],
+                            entry["tokens"],
+                            int(entry["request"]),
+                        )
+                        for _, entry in run
+                    ]
+                )
+            for (i, _), charged in zip(run, ok):
+                applied[i] = charged
+            if not all(ok):
+                # 后面的行可能依赖这些对话计数, 保持顺序, 留到下次重放
+                break
+        return applied
+
+    @classmethod
+    async def replay(cls) -> int:
+        """Apply journaled charges to Redis; returns the number of entries."""
+        if not DEGRADED_JOURNAL_DIR.exists():
+            return 0
+        if BaseRedisManager.breaker.state != BaseRedisManager.breaker.CLOSED:
+            return 0
+        cls.close()
+        replayed = 0
+        failed_segment = None
+        for path in cls._claim_segments():
+            entries = cls._read_segment(path)
+            applied = await cls._apply(entries)
+            replayed += sum(applied)
+            if not all(applied):
+                # 已记账的行从段文件中去掉, 剩下的下次重放
+                cls._rewrite_segment(
+                    path, [entry for entry, ok in zip(entries, applied) if not ok]
+                )
+                failed_segment = path
+                break
+            path.unlink()
+        if replayed:
+            cls._pending = max(cls._pending - replayed, 0)
+            metrics.incr("degraded_journal_replayed", replayed)
+            logger.info(f"Replayed {replayed} degraded-mode charges into redis")
+        if failed_segment is not None:
+            raise RuntimeError(f"failed to charge {failed_segment.name}")
+        return replayed
+
+
+metrics.register_gauge("degraded_journal_pending", DegradedJournal.pending)
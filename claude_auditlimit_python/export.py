@@ -0,0 +1,134 @@
+# export.py
+# 用量和设备数据的流式导出 (NDJSON / CSV, 可选 gzip), 内存占用与数据量无关
+import csv
+import io
+import zlib
+from typing import AsyncIterator, Dict, List, Optional
+
+import msgspec
+
+from claude_auditlimit_python import metrics
+from claude_auditlimit_python.redis_manager.export_manager import ExportManager
+
+DATASET_USAGE = "usage"
+DATASET_DEVICES = "devices"
+DATASETS = (DATASET_USAGE, DATASET_DEVICES)
+
+FORMAT_NDJSON = "ndjson"
+FORMAT_CSV = "csv"
+FORMATS = (FORMAT_NDJSON, FORMAT_CSV)
+
+MEDIA_TYPES = {FORMAT_NDJSON: "application/x-ndjson", FORMAT_CSV: "text/csv"}
+
+_USAGE_PERIODS = ["total", "3h", "12h", "24h", "1w"]
+_COLUMNS = {
+    DATASET_USAGE: ["api_key"]
+    + [f"tokens_{period}" for period in _USAGE_PERIODS]
+    + [f"requests_{period}" for period in _USAGE_PERIODS],
+    DATASET_DEVICES: ["api_key", "device_hash", "user_agent", "host"],
+}
+
+_encoder = msgspec.json.Encoder()
+
+
+async def validate_export(dataset: str, fmt: str, cursor: str) -> None:
+    """Raise ValueError before any bytes are sent, so callers can answer 400."""
+    if dataset not in DATASETS:
+        raise ValueError(f"unknown dataset {dataset!r}, expected one of {DATASETS}")
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format {fmt!r}, expected one of {FORMATS}")
+    try:
+        ExportManager.parse_cursor(cursor)
+    except ValueError:
+        raise ValueError(f"invalid cursor {cursor!r}") from None
+    # 分片数量只有连上 redis 才知道, 在返回响应头之前检查
+    await ExportManager().check_cursor(cursor)
+
+
+def _flatten(dataset: str, row: Dict) -> List:
+    if dataset == DATASET_USAGE:
+        return (
+            [row["api_key"]]
+            + [row["tokens"].get(period, 0) for period in _USAGE_PERIODS]
+            + [row["requests"].get(period, 0) for period in _USAGE_PERIODS]
+        )
+    return [row[column] for column in _COLUMNS[dataset]]
+
+
+def _csv_lines(rows: List[List]) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(rows)
+    return buffer.getvalue().encode()
+
+
+def _batches(
+    dataset: str, prefix: str, min_total: int, cursor: str
+) -> AsyncIterator:
+    manager = ExportManager()
+    if dataset == DATASET_USAGE:
+        return manager.iter_usage(prefix=prefix, min_total=min_total, cursor=cursor)
+    return manager.iter_devices(prefix=prefix, cursor=cursor)
+
+
+async def _encoded_chunks(
+    dataset: str,
+    fmt: str,
+    prefix: str,
+    min_total: int,
+    cursor: str,
+    limit: Optional[int],
+) -> AsyncIterator[bytes]:
+    if fmt == FORMAT_CSV:
+        yield _csv_lines([_COLUMNS[dataset]])
+
+    count = 0
+    next_cursor = None
+    async for rows, next_cursor in _batches(dataset, prefix, min_total, cursor):
+        if rows:
+            count += len(rows)
+            if fmt == FORMAT_CSV:
+                yield _csv_lines([_flatten(dataset, row) for row in rows])
+            else:
+                yield b"".join(_encoder.encode(row) + b"\n" for row in rows)
+        # 只在批次边界停止, 这样 next_cursor 续传时不会漏掉数据
+        if limit is not None and count >= limit:
+            break
+
+    metrics.incr(f"export_{dataset}_rows", count)
+    # 末尾附上行数和续传游标, 为 null 表示已导出完毕
+    if fmt == FORMAT_CSV:
+        yield f"# rows={count}, next_cursor={next_cursor or ''}\n".encode()
+    else:
+        yield _encoder.encode(
+            {"_export": {"rows": count, "next_cursor": next_cursor}}
+        ) + b"\n"
+
+
+async def export_chunks(
+    dataset: str,
+    fmt: str = FORMAT_NDJSON,
+    compress: bool = False,
+    prefix: str = "",
+    min_total: int = 0,
+    cursor: str = ExportManager.START_CURSOR,
+    limit: Optional[int] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Stream ``dataset`` as ``fmt`` one SCAN batch at a time, gzip-compressed
+    when ``compress``. The last line carries the row count and the cursor to
+    resume from; ``limit`` stops after the batch that reaches it. Callers
+    check the arguments with ``validate_export`` first.
+    """
+    chunks = _encoded_chunks(dataset, fmt, prefix, min_total, cursor, limit)
+    if not compress:
+        async for chunk in chunks:
+            yield chunk
+        return
+
+    # wbits=31: 带 gzip 头, 可直接用 gunzip 解压
+    compressor = zlib.compressobj(wbits=31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -2,22 +2,44 @@ from contextlib import asynccontextmanager
 from loguru import logger
 from fastapi import FastAPI
 
+from claude_auditlimit_python.degraded_mode import DegradedJournal
+from claude_auditlimit_python.notify_queue import NotifyQueue
 from claude_auditlimit_python.periodic_checks.limit_sheduler import LimitScheduler
+from claude_auditlimit_python.policy import PolicyEngine
+from claude_auditlimit_python.redis_manager.redis_pool import RedisPool
+from claude_auditlimit_python.utils.log_utils import shutdown_logging
 from claude_auditlimit_python.utils.time_zone_utils import set_cn_time_zone
+from claude_auditlimit_python.warmup import Warmup
 
 
 async def on_startup():
     logger.info("Starting up")
     set_cn_time_zone()
+    await RedisPool.start()
     logger.info("Clients loaded")
+    await PolicyEngine.start()
+    logger.info("Policy listener started")
     await LimitScheduler.start()
     logger.info("Scheduler started")
+    await NotifyQueue.start()
+    logger.info("Notify queue started")
+    # tokenizer、redis 连接和 lua 脚本在后台预热, 完成后 /ready 返回 200
+    Warmup.start()
 
 
 async def on_shutdown():
     logger.info("Shutting down")
+    await Warmup.shutdown()
+    await NotifyQueue.shutdown()
+    logger.info("Notify queue drained")
     await LimitScheduler.shutdown()
     logger.info("Scheduler stopped")
+    await PolicyEngine.shutdown()
+    # 未重放的本地记账留在磁盘上, 由下次启动或其他 worker 重放
+    DegradedJournal.close()
+    await RedisPool.shutdown()
+    logger.info("Redis pool closed")
+    shutdown_logging()
 
 
 @asynccontextmanager
@@ -0,0 +1,25 @@
+# metrics.py
+# 进程内的简单指标: 计数器 + 按需计算的 gauge
+from collections import defaultdict
+from typing import Any, Callable, Dict
+
+_counters: Dict[str, int] = defaultdict(int)
+_gauges: Dict[str, Callable[[], Any]] = {}
+
+
+def incr(name: str, value: int = 1) -> None:
+    _counters[name] += value
+
+
+def register_gauge(name: str, fn: Callable[[], Any]) -> None:
+    _gauges[name] = fn
+
+
+def snapshot() -> Dict[str, Any]:
+    result: Dict[str, Any] = dict(_counters)
+    for name, fn in _gauges.items():
+        try:
+            result[name] = fn()
+        except Exception as e:
+            result[name] = f"error: {e}"
+    return result
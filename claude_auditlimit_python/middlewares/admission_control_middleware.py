@@ -0,0 +1,155 @@
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Dict
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from claude_auditlimit_python import metrics
+from claude_auditlimit_python.configs import (
+    ADMISSION_BUDGETS,
+    ADMISSION_EXEMPT_PATHS,
+    ADMISSION_QUEUE_INTERVAL_SECONDS,
+    ADMISSION_QUEUE_TARGET_SECONDS,
+    ADMISSION_REDIS_LATENCY_TARGET_SECONDS,
+    ADMISSION_RETRY_AFTER_SECONDS,
+    ADMISSION_ROUTE_BUDGETS,
+    ADMISSION_ROUTE_PREFIX_BUDGETS,
+)
+from claude_auditlimit_python.redis_manager.base_redis_manager import BaseRedisManager
+
+
+class ConcurrencyBudget:
+    """
+    At most ``max_concurrent`` requests run at once; up to ``max_queue`` more
+    wait in FIFO order.
+
+    The wait is bounded CoDel-style: if the queue has not been empty during
+    the last ``ADMISSION_QUEUE_INTERVAL_SECONDS`` it is a standing queue
+    rather than a burst, and requests give up after
+    ``ADMISSION_QUEUE_TARGET_SECONDS``; otherwise they may wait one interval.
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._last_empty = time.monotonic()
+
+    def _queue_timeout(self) -> float:
+        if time.monotonic() - self._last_empty > ADMISSION_QUEUE_INTERVAL_SECONDS:
+            return ADMISSION_QUEUE_TARGET_SECONDS
+        return ADMISSION_QUEUE_INTERVAL_SECONDS
+
+    async def acquire(self, allow_queue: bool = True) -> bool:
+        """Take a slot; False when the request should be shed."""
+        if not self._waiters:
+            self._last_empty = time.monotonic()
+            if self.in_flight < self.max_concurrent:
+                self.in_flight += 1
+                return True
+        if not allow_queue or len(self._waiters) >= self.max_queue:
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self._queue_timeout())
+            return True
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            return False
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+
+    def _abandon(self, waiter: asyncio.Future) -> None:
+        if waiter.done() and not waiter.cancelled():
+            # 超时或取消的同时刚好分到了名额, 交给下一个请求
+            self.release()
+            return
+        waiter.cancel()
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self) -> None:
+        # 名额直接交给队首的请求, in_flight 不变
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                if not self._waiters:
+                    self._last_empty = time.monotonic()
+                return
+        self.in_flight -= 1
+        self._last_empty = time.monotonic()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "max_concurrent": self.max_concurrent,
+        }
+
+
+def _redis_overloaded() -> bool:
+    # 熔断打开时走本地降级限额, 请求很快, 不算过载
+    breaker = BaseRedisManager.breaker
+    return (
+        breaker.state == breaker.CLOSED
+        and breaker.latency > ADMISSION_REDIS_LATENCY_TARGET_SECONDS
+    )
+
+
+def _route_budget(path: str) -> str:
+    budget = ADMISSION_ROUTE_BUDGETS.get(path)
+    if budget is not None:
+        return budget
+    for prefix, budget in ADMISSION_ROUTE_PREFIX_BUDGETS.items():
+        if path.startswith(prefix):
+            return budget
+    # 未列出的路由 (文档等) 归入 admin
+    return "admin"
+
+
+class AdmissionControlMiddleware:
+    """
+    Per-route-group concurrency budgets in front of the router, so bursts on
+    one group (e.g. dashboards on admin routes) cannot starve /audit_limit.
+    Requests that cannot get a slot in time, or that would have to queue
+    while Redis latency is above target, get 503 with Retry-After.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.budgets = {
+            name: ConcurrencyBudget(name, max_concurrent, max_queue)
+            for name, (max_concurrent, max_queue) in ADMISSION_BUDGETS.items()
+        }
+        for name, budget in self.budgets.items():
+            metrics.register_gauge(f"admission_control_{name}", budget.stats)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] in ADMISSION_EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        budget = self.budgets[_route_budget(scope["path"])]
+        if not await budget.acquire(allow_queue=not _redis_overloaded()):
+            metrics.incr(f"admission_control_shed_{budget.name}")
+            response = JSONResponse(
+                status_code=503,
+                content={"code": 503, "msg": "Server busy, please retry later"},
+                headers={"Retry-After": str(ADMISSION_RETRY_AFTER_SECONDS)},
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            budget.release()
@@ -9,7 +9,8 @@ from claude_auditlimit_python.configs import DOCS_USERNAME, DOCS_PASSWORD
 
 class ApidocBasicAuthMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next: RequestResponseEndpoint):
-        if request.url.path in ["/docs", "/redoc", "/openapi.json"]:
+        path = request.url.path
+        if path in ["/docs", "/redoc", "/openapi.json"] or path.startswith("/debug/"):
             auth_header = request.headers.get("Authorization")
             if auth_header:
                 try:
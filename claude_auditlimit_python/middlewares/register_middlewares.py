@@ -3,7 +3,13 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.docs import get_swagger_ui_html, get_redoc_html
 from fastapi.openapi.utils import get_openapi
 
-from claude_auditlimit_python.configs import IP_REQUEST_LIMIT_PER_MINUTE
+from claude_auditlimit_python.configs import (
+    ADMISSION_CONTROL_ENABLED,
+    IP_REQUEST_LIMIT_PER_MINUTE,
+)
+from claude_auditlimit_python.middlewares.admission_control_middleware import (
+    AdmissionControlMiddleware,
+)
 from claude_auditlimit_python.middlewares.docs_middleware import (
     ApidocBasicAuthMiddleware,
 )
@@ -46,9 +52,17 @@ def register_docs_auth(app: FastAPI):
     return app
 
 
+def register_admission_control(app: FastAPI):
+    # 最后添加的中间件在最外层, 被拒绝的请求不经过其他中间件
+    if ADMISSION_CONTROL_ENABLED:
+        app.add_middleware(AdmissionControlMiddleware)
+    return app
+
+
 def register_middleware(app: FastAPI):
     app = register_cross_origin(app)
     app = register_docs_auth(app)
+    app = register_admission_control(app)
     # app.add_middleware(NotFoundResponseMiddleware)
     # app.add_middleware(RateLimitMiddleware, rate_per_minute=IP_REQUEST_LIMIT_PER_MINUTE)
     return app
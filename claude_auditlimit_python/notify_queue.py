@@ -0,0 +1,333 @@
+# notify_queue.py
+# /response_notify 和 /document_notify 的后台记账队列
+import asyncio
+import re
+from typing import List, Optional, Tuple, Union
+
+import msgspec
+from loguru import logger
+
+from claude_auditlimit_python import metrics
+from claude_auditlimit_python.configs import (
+    NOTIFY_BATCH_SIZE,
+    NOTIFY_DRAIN_TIMEOUT_SECONDS,
+    NOTIFY_QUEUE_BACKEND,
+    NOTIFY_QUEUE_SIZE,
+    NOTIFY_QUEUE_WORKERS,
+)
+from claude_auditlimit_python.degraded_mode import DegradedJournal
+from claude_auditlimit_python.redis_manager.notify_dedupe_manager import (
+    NotifyDedupeManager,
+)
+from claude_auditlimit_python.redis_manager.notify_stream_manager import (
+    NotifyStreamManager,
+)
+from claude_auditlimit_python.redis_manager.token_usage_manager import TokenUsageManager
+from claude_auditlimit_python.schemas import DocumentNotifyBody, ResponseNotifyBody
+from claude_auditlimit_python.utils.log_utils import should_sample, truncate_payload
+from claude_auditlimit_python.utils.token_utils import get_token_lengths_async
+
+_response_decoder = msgspec.json.Decoder(ResponseNotifyBody)
+_document_decoder = msgspec.json.Decoder(DocumentNotifyBody)
+
+
+class NotifyJob:
+    KIND_RESPONSE = "response"
+    KIND_DOCUMENT = "document"
+
+    def __init__(
+        self,
+        kind: str,
+        api_key: str,
+        conversation_uuid: str,
+        body: Union[bytes, str],
+        dedupe_id: Optional[str] = None,
+    ):
+        self.kind = kind
+        self.api_key = api_key
+        self.conversation_uuid = conversation_uuid
+        self.body = body
+        # 入队前记录的去重 id, 任务最终放弃时要释放, 上游重试才不会被当作重复
+        self.dedupe_id = dedupe_id
+        # 由 process_notify_jobs 计数后填入, 不随任务序列化
+        self.tokens: Optional[int] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "kind": self.kind,
+            "api_key": self.api_key,
+            "conversation_uuid": self.conversation_uuid,
+            "body": self.body,
+            # stream 字段不能为 None
+            "dedupe_id": self.dedupe_id or "",
+        }
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> "NotifyJob":
+        """Raises ValueError for anything that is not a serialized job."""
+        if not isinstance(data, dict) or data.get("kind") not in (
+            cls.KIND_RESPONSE,
+            cls.KIND_DOCUMENT,
+        ):
+            raise ValueError("not a notify job")
+        return cls(
+            kind=data.get("kind", ""),
+            api_key=data.get("api_key", ""),
+            conversation_uuid=data.get("conversation_uuid", ""),
+            body=data.get("body", ""),
+            dedupe_id=data.get("dedupe_id") or None,
+        )
+
+    def extract_text(self) -> str:
+        """The text to be charged, parsed from the raw notify body."""
+        if self.kind == self.KIND_DOCUMENT:
+            return _document_decoder.decode(self.body).ExtractedContent
+        data = _response_decoder.decode(self.body).Data
+        if should_sample("/response_notify"):
+            logger.opt(lazy=True).debug(
+                "request_data from response_notify: \n{}",
+                lambda: truncate_payload(data),
+            )
+        text_values = re.findall(r'"text":"(.*?)"', data)
+        # 拼接提取的文本
+        return "".join(text_values)
+
+
+async def release_dedupe_ids(dedupe_ids: List[Optional[str]]) -> None:
+    """Forget the dedupe ids of jobs that were given up, so retries are accepted."""
+    dedupe_ids = [dedupe_id for dedupe_id in dedupe_ids if dedupe_id]
+    if not dedupe_ids:
+        return
+    try:
+        await NotifyDedupeManager().forget(*dedupe_ids)
+    except Exception as e:
+        logger.warning(f"Failed to release notify dedupe ids: {e}")
+
+
+async def charge_conversation_tokens(
+    increments: List[Tuple[str, str, int]],
+) -> List[bool]:
+    """
+    Apply ``(api_key, conversation_uuid, tokens)`` increments in order; every
+    increment grows the conversation counter by its tokens and the key's usage
+    by the resulting conversation total. Returns per increment whether it was
+    charged (each shard is charged atomically, see
+    ``TokenUsageManager.charge_conversations``).
+    """
+    return await TokenUsageManager().charge_conversations(
+        [(api_key, uuid, tokens, 0) for api_key, uuid, tokens in increments]
+    )
+
+
+async def process_notify_jobs(jobs: List[NotifyJob]) -> List[bool]:
+    """
+    Tokenize a batch of jobs on the tokenizer threads and charge them in order.
+    Returns per job whether it is done: charged, or dropped as invalid.
+    """
+    done = [True] * len(jobs)
+    texts = []
+    parsed = []
+    for i, job in enumerate(jobs):
+        try:
+            texts.append(job.extract_text())
+            parsed.append(i)
+        except msgspec.DecodeError as e:
+            metrics.incr("notify_invalid")
+            logger.warning(f"Dropping invalid {job.kind} notify: {e}")
+    if not parsed:
+        return done
+
+    token_counts = await get_token_lengths_async(texts, use_cache=False)
+    charged = await charge_conversation_tokens(
+        [
+            (jobs[i].api_key, jobs[i].conversation_uuid, tokens)
+            for i, tokens in zip(parsed, token_counts)
+        ]
+    )
+    for i, tokens, ok in zip(parsed, token_counts, charged):
+        jobs[i].tokens = tokens
+        done[i] = ok
+
+    metrics.incr("notify_processed", sum(charged))
+    logger.debug(
+        "notify batch accounted: {} jobs, {} keys",
+        sum(charged),
+        len({jobs[i].api_key for i in parsed}),
+    )
+    return done
+
+
+class MemoryNotifyBackend:
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=NOTIFY_QUEUE_SIZE)
+
+    async def start(self) -> None:
+        pass
+
+    async def put(self, job: NotifyJob) -> bool:
+        try:
+            self.queue.put_nowait(job)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def get_batch(self, index: int) -> List[Tuple[Optional[str], NotifyJob]]:
+        batch = [(None, await self.queue.get())]
+        while len(batch) < NOTIFY_BATCH_SIZE and not self.queue.empty():
+            batch.append((None, self.queue.get_nowait()))
+        return batch
+
+    async def ack(self, batch) -> None:
+        for _ in batch:
+            self.queue.task_done()
+
+    async def fail(self, batch) -> None:
+        # 内存队列无法重新投递: 已计数的任务写入降级日志, redis 恢复后重放
+        dropped = []
+        for _, job in batch:
+            if job.tokens is None:
+                logger.error(f"Dropping {job.kind} notify that could not be counted")
+                dropped.append(job)
+                continue
+            try:
+                DegradedJournal.append(
+                    job.api_key, job.conversation_uuid, job.tokens, False
+                )
+            except OSError as e:
+                logger.error(f"Failed to journal {job.kind} notify: {e}")
+                dropped.append(job)
+        metrics.incr("notify_journaled", len(batch) - len(dropped))
+        metrics.incr("notify_dropped", len(dropped))
+        await release_dedupe_ids([job.dedupe_id for job in dropped])
+        await self.ack(batch)
+
+    async def drain(self) -> None:
+        await self.queue.join()
+
+    def size(self) -> int:
+        return self.queue.qsize()
+
+
+class RedisStreamNotifyBackend:
+    BLOCK_MS = 1000
+
+    def __init__(self):
+        self.stream = NotifyStreamManager()
+
+    async def start(self) -> None:
+        await self.stream.ensure_group()
+
+    async def put(self, job: NotifyJob) -> bool:
+        return await self.stream.add(job.to_dict())
+
+    async def get_batch(self, index: int) -> List[Tuple[Optional[str], NotifyJob]]:
+        entries, dead = await self.stream.read(
+            self.stream.consumer_name(index), NOTIFY_BATCH_SIZE, self.BLOCK_MS
+        )
+        if dead:
+            # 多次投递仍未记账, 已移到死信 stream; 释放去重 id 让上游可以重试
+            await release_dedupe_ids(
+                [fields.get("dedupe_id") for _, fields in dead if fields]
+            )
+        batch, invalid = [], []
+        for entry_id, fields in entries:
+            try:
+                batch.append((entry_id, NotifyJob.from_dict(fields)))
+            except ValueError:
+                invalid.append((entry_id, fields))
+        if invalid:
+            # 无法解析的消息每次重新投递都会失败, 直接移到死信 stream
+            metrics.incr("notify_dead_lettered", len(invalid))
+            logger.warning(f"Dead-lettering {len(invalid)} undecodable notify entries")
+            await self.stream.dead_letter(invalid, "undecodable")
+        return batch
+
+    async def ack(self, batch) -> None:
+        await self.stream.ack([entry_id for entry_id, _ in batch])
+
+    async def fail(self, batch) -> None:
+        # 不确认, 空闲超过 CLAIM_IDLE_MS 后会被重新投递
+        pass
+
+    async def drain(self) -> None:
+        # 未处理的消息留在 stream 中, 由其他 worker 或重启后继续处理
+        pass
+
+    def size(self) -> Optional[int]:
+        # stream 长度需要访问 redis, 见 NotifyStreamManager.size
+        return None
+
+
+class NotifyQueue:
+    backend: Optional[Union[MemoryNotifyBackend, RedisStreamNotifyBackend]] = None
+    consumers: List[asyncio.Task] = []
+
+    @staticmethod
+    async def start():
+        if NOTIFY_QUEUE_BACKEND == "redis":
+            backend = RedisStreamNotifyBackend()
+        else:
+            backend = MemoryNotifyBackend()
+        await backend.start()
+        NotifyQueue.backend = backend
+        NotifyQueue.consumers = [
+            asyncio.create_task(NotifyQueue._consume(i))
+            for i in range(NOTIFY_QUEUE_WORKERS)
+        ]
+        metrics.register_gauge("notify_queue_size", backend.size)
+
+    @staticmethod
+    async def shutdown():
+        backend = NotifyQueue.backend
+        if backend is None:
+            return
+        try:
+            await asyncio.wait_for(backend.drain(), NOTIFY_DRAIN_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            logger.warning(f"Notify queue not drained, {backend.size()} jobs left")
+        for task in NotifyQueue.consumers:
+            task.cancel()
+        await asyncio.gather(*NotifyQueue.consumers, return_exceptions=True)
+        NotifyQueue.backend = None
+        NotifyQueue.consumers = []
+
+    @staticmethod
+    async def submit(job: NotifyJob) -> bool:
+        """Enqueue a job; False when the queue is full (or not running)."""
+        backend = NotifyQueue.backend
+        accepted = backend is not None and await backend.put(job)
+        metrics.incr("notify_enqueued" if accepted else "notify_rejected")
+        return accepted
+
+    @staticmethod
+    async def _consume(index: int):
+        backend = NotifyQueue.backend
+        while True:
+            try:
+                batch = await backend.get_batch(index)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to read notify queue: {e}")
+                await asyncio.sleep(1)
+                continue
+            if not batch:
+                continue
+            try:
+                done = await process_notify_jobs([job for _, job in batch])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to account notify batch: {e}")
+                done = [False] * len(batch)
+            failed = [entry for entry, ok in zip(batch, done) if not ok]
+            try:
+                # 只确认已经记账的消息; 其余的由 stream 重新投递
+                await backend.ack([entry for entry, ok in zip(batch, done) if ok])
+                if failed:
+                    metrics.incr("notify_failed", len(failed))
+                    await backend.fail(failed)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to acknowledge notify batch: {e}")
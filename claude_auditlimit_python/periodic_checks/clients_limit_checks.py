@@ -1,12 +1,61 @@
 import asyncio
 import time
-from tqdm.asyncio import tqdm
 
 from loguru import logger
 
+from claude_auditlimit_python.degraded_mode import DegradedJournal
+from claude_auditlimit_python.policy import PolicyEngine
+from claude_auditlimit_python.redis_manager.blocklist_manager import BlocklistManager
+from claude_auditlimit_python.redis_manager.history_manager import HistoryManager
+from claude_auditlimit_python.redis_manager.token_usage_manager import (
+    TokenUsageManager,
+)
+
+# 保持后台任务的引用, 避免被垃圾回收
+_background_tasks = set()
+
+
+async def compact_token_usage():
+    try:
+        await TokenUsageManager().compact()
+    except Exception as e:
+        logger.error(f"Token usage compaction failed: {e}")
+
 
 async def periodic_tasks():
-    tasks = []
+    tasks = [compact_token_usage]
     for task in tasks:
         _task = asyncio.create_task(task())
+        _background_tasks.add(_task)
+        _task.add_done_callback(_background_tasks.discard)
     return {"message": "Check started in background"}
+
+
+async def sweep_blocklist():
+    try:
+        blocked = await BlocklistManager().sweep()
+        logger.debug(f"Blocklist refreshed, {blocked} keys currently blocked")
+    except Exception as e:
+        logger.error(f"Blocklist sweep failed: {e}")
+
+
+async def replay_degraded_journal():
+    try:
+        await DegradedJournal.replay()
+    except Exception as e:
+        logger.error(f"Degraded journal replay failed: {e}")
+
+
+async def reload_policy():
+    try:
+        await PolicyEngine.reload()
+    except Exception as e:
+        logger.error(f"Policy reload failed: {e}")
+
+
+async def downsample_usage_history():
+    try:
+        report = await HistoryManager().downsample(time.time())
+        logger.debug(f"Usage history downsampled: {report}")
+    except Exception as e:
+        logger.error(f"Usage history downsampling failed: {e}")
@@ -1,21 +1,79 @@
 from datetime import datetime
 
-from claude_auditlimit_python.configs import CLAUDE_CLIENT_LIMIT_CHECKS_INTERVAL_MINUTES
+from claude_auditlimit_python.configs import (
+    BLOCKLIST_SWEEP_INTERVAL_SECONDS,
+    CLAUDE_CLIENT_LIMIT_CHECKS_INTERVAL_MINUTES,
+    DEGRADED_REPLAY_INTERVAL_SECONDS,
+    HISTORY_ROLLUP_INTERVAL_MINUTES,
+    POLICY_RELOAD_INTERVAL_SECONDS,
+)
 from claude_auditlimit_python.periodic_checks.clients_limit_checks import (
+    downsample_usage_history,
     periodic_tasks,
+    reload_policy,
+    replay_degraded_journal,
+    sweep_blocklist,
 )
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 
 limit_check_scheduler = AsyncIOScheduler()
 
-# 设置定时任务
+# 设置定时任务, 启动时先执行一次以迁移旧格式的对话计数
 limit_check_scheduler.add_job(
     periodic_tasks,
     trigger=IntervalTrigger(minutes=CLAUDE_CLIENT_LIMIT_CHECKS_INTERVAL_MINUTES),
     id="check_usage_limits",
     name=f"Check API usage limits every {CLAUDE_CLIENT_LIMIT_CHECKS_INTERVAL_MINUTES} minutes",
     replace_existing=True,
+    next_run_time=datetime.now(),
+)
+
+# 黑名单扫描, 启动时立即执行一次
+limit_check_scheduler.add_job(
+    sweep_blocklist,
+    trigger=IntervalTrigger(seconds=BLOCKLIST_SWEEP_INTERVAL_SECONDS),
+    id="sweep_blocklist",
+    name=f"Sweep blocklist every {BLOCKLIST_SWEEP_INTERVAL_SECONDS} seconds",
+    replace_existing=True,
+    max_instances=1,
+    coalesce=True,
+    next_run_time=datetime.now(),
+)
+
+# 重放降级期间的本地记账, 启动时先处理崩溃遗留的日志
+limit_check_scheduler.add_job(
+    replay_degraded_journal,
+    trigger=IntervalTrigger(seconds=DEGRADED_REPLAY_INTERVAL_SECONDS),
+    id="replay_degraded_journal",
+    name=f"Replay degraded journal every {DEGRADED_REPLAY_INTERVAL_SECONDS} seconds",
+    replace_existing=True,
+    max_instances=1,
+    coalesce=True,
+    next_run_time=datetime.now(),
+)
+
+
+# 策略由 pub/sub 通知热更新, 定时全量加载兜底错过的通知
+limit_check_scheduler.add_job(
+    reload_policy,
+    trigger=IntervalTrigger(seconds=POLICY_RELOAD_INTERVAL_SECONDS),
+    id="reload_policy",
+    name=f"Reload limit policy every {POLICY_RELOAD_INTERVAL_SECONDS} seconds",
+    replace_existing=True,
+    max_instances=1,
+    coalesce=True,
+)
+
+# 把超过小时保留期的用量历史合并为按天汇总, 并清理过期的日汇总
+limit_check_scheduler.add_job(
+    downsample_usage_history,
+    trigger=IntervalTrigger(minutes=HISTORY_ROLLUP_INTERVAL_MINUTES),
+    id="downsample_usage_history",
+    name=f"Downsample usage history every {HISTORY_ROLLUP_INTERVAL_MINUTES} minutes",
+    replace_existing=True,
+    max_instances=1,
+    coalesce=True,
 )
 
 
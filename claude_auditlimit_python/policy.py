@@ -0,0 +1,240 @@
+# policy.py
+# 按 api key 分级的限额策略: 每个等级可以有任意多个窗口 (token 数或请求次数, 可限定模型系列)
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+import msgspec
+from loguru import logger
+
+from claude_auditlimit_python import metrics
+from claude_auditlimit_python.configs import (
+    DEFAULT_POLICY_TIER,
+    MAX_DEVICES,
+    POLICY_MODEL_FAMILIES,
+    POLICY_RESUBSCRIBE_SECONDS,
+    RATE_LIMIT,
+    USAGE_RECORD_RATE_LIMIT,
+)
+from claude_auditlimit_python.redis_manager.admission_manager import AdmissionManager
+from claude_auditlimit_python.redis_manager.policy_manager import PolicyManager
+from claude_auditlimit_python.redis_manager.usage_manager import UsageManager
+
+
+class LimitWindow(msgspec.Struct, frozen=True):
+    # tokens 或 requests
+    metric: str
+    # 3h / 12h / 24h / 1w, 与 UsageManager 的计数周期一致
+    period: str
+    limit: int
+    # 为空时对所有模型生效, 否则只统计该系列模型 (见 POLICY_MODEL_FAMILIES)
+    family: Optional[str] = None
+
+
+class TierSpec(msgspec.Struct):
+    windows: List[LimitWindow]
+    max_devices: int = MAX_DEVICES
+
+
+_tier_decoder = msgspec.json.Decoder(TierSpec)
+
+
+def _validate(spec: TierSpec) -> None:
+    for window in spec.windows:
+        if window.metric not in AdmissionManager.METRICS:
+            raise ValueError(f"unknown metric {window.metric!r}")
+        if window.period not in AdmissionManager.PERIODS:
+            raise ValueError(f"unknown period {window.period!r}")
+        if window.limit < 0:
+            raise ValueError("limit must not be negative")
+        if window.family is not None and window.family not in POLICY_MODEL_FAMILIES:
+            raise ValueError(f"unknown model family {window.family!r}")
+    if spec.max_devices < 1:
+        raise ValueError("max_devices must be at least 1")
+
+
+class CompiledTier:
+    """
+    A tier in the argument layout of ``AdmissionManager.admit``.
+
+    Windows on all models read the usage counters shared with the stats
+    endpoints; each family window adds one ``family_counters`` entry that the
+    script increments only for requests of that family.
+    """
+
+    def __init__(self, name: str, spec: TierSpec):
+        self.name = name
+        self.windows = list(spec.windows)
+        self.max_devices = spec.max_devices
+        self.family_counters: List[Tuple[str, str, str]] = []
+        self.window_args: List = [len(self.windows)]
+        for window in self.windows:
+            if window.family:
+                counter = (window.metric, window.family, window.period)
+                if counter not in self.family_counters:
+                    self.family_counters.append(counter)
+                key_index = AdmissionManager.family_key_index(
+                    self.family_counters.index(counter)
+                )
+            else:
+                key_index = AdmissionManager.standard_key_index(
+                    window.metric, window.period
+                )
+            self.window_args.extend(
+                [
+                    AdmissionManager.METRICS.index(window.metric),
+                    key_index,
+                    window.limit,
+                    window.family or "",
+                ]
+            )
+        self.counter_args: List = [len(self.family_counters)]
+        for index, (metric, family, period) in enumerate(self.family_counters):
+            self.counter_args.extend(
+                [
+                    AdmissionManager.METRICS.index(metric),
+                    AdmissionManager.family_key_index(index),
+                    AdmissionManager.PERIODS[period],
+                    family,
+                ]
+            )
+
+    def limit(
+        self, metric: str, period: str = UsageManager.PERIOD_3HOURS
+    ) -> Optional[int]:
+        """The tightest all-model limit for ``metric`` over ``period``."""
+        window = self.window(metric, period)
+        return window.limit if window else None
+
+    def window(
+        self, metric: str, period: str = UsageManager.PERIOD_3HOURS
+    ) -> Optional[LimitWindow]:
+        windows = [
+            w
+            for w in self.windows
+            if w.metric == metric and w.period == period and not w.family
+        ]
+        return min(windows, key=lambda w: w.limit) if windows else None
+
+
+def default_tier_spec() -> TierSpec:
+    return TierSpec(
+        windows=[
+            LimitWindow(
+                AdmissionManager.METRIC_TOKENS, UsageManager.PERIOD_3HOURS, RATE_LIMIT
+            ),
+            LimitWindow(
+                AdmissionManager.METRIC_REQUESTS,
+                UsageManager.PERIOD_3HOURS,
+                USAGE_RECORD_RATE_LIMIT,
+            ),
+        ],
+        max_devices=MAX_DEVICES,
+    )
+
+
+class PolicyEngine:
+    """
+    In-memory view of the tiers in Redis, compiled once per change.
+
+    ``tier_for`` is a dict lookup on the request path. Tiers are reloaded
+    when ``PolicyManager`` announces an update and periodically by the
+    scheduler; a tier that fails to compile keeps its previous version.
+    Keys without an assignment use ``DEFAULT_POLICY_TIER``, which falls back
+    to the limits in configs.py unless it is defined in Redis.
+    """
+
+    _tiers: Dict[str, CompiledTier] = {
+        DEFAULT_POLICY_TIER: CompiledTier(DEFAULT_POLICY_TIER, default_tier_spec())
+    }
+    _assignments: Dict[str, str] = {}
+    _listener: Optional[asyncio.Task] = None
+
+    @classmethod
+    def tier_for(cls, api_key: str) -> CompiledTier:
+        tier = cls._tiers.get(cls._assignments.get(api_key, DEFAULT_POLICY_TIER))
+        return tier or cls._tiers[DEFAULT_POLICY_TIER]
+
+    @staticmethod
+    def model_family(model: str) -> str:
+        model = model.lower()
+        for family in POLICY_MODEL_FAMILIES:
+            if family in model:
+                return family
+        return ""
+
+    @classmethod
+    def apply(cls, raw_tiers: Dict[str, str], assignments: Dict[str, str]) -> None:
+        tiers = {}
+        for name, raw in raw_tiers.items():
+            try:
+                spec = _tier_decoder.decode(raw)
+                _validate(spec)
+                tiers[name] = CompiledTier(name, spec)
+            except (msgspec.DecodeError, ValueError) as e:
+                logger.error(f"Invalid policy tier {name}: {e}")
+                metrics.incr("policy_invalid_tiers")
+                if name in cls._tiers:
+                    tiers[name] = cls._tiers[name]
+        if DEFAULT_POLICY_TIER not in tiers:
+            tiers[DEFAULT_POLICY_TIER] = CompiledTier(
+                DEFAULT_POLICY_TIER, default_tier_spec()
+            )
+        for api_key, name in assignments.items():
+            if name not in tiers:
+                logger.warning(f"{api_key} is assigned to unknown tier {name}")
+        cls._tiers, cls._assignments = tiers, assignments
+
+    @classmethod
+    async def reload(cls) -> None:
+        raw_tiers, assignments = await PolicyManager().load()
+        cls.apply(raw_tiers, assignments)
+        metrics.incr("policy_reloads")
+        logger.debug(
+            f"Policy loaded: {len(cls._tiers)} tiers, {len(assignments)} assigned keys"
+        )
+
+    @classmethod
+    async def _listen(cls):
+        while True:
+            pubsub = None
+            try:
+                pubsub = await PolicyManager().subscribe()
+                # 断开期间可能错过了更新
+                await cls.reload()
+                while True:
+                    message = await pubsub.get_message(
+                        ignore_subscribe_messages=True, timeout=1.0
+                    )
+                    if message is not None:
+                        await cls.reload()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Policy subscription lost: {e}")
+                await asyncio.sleep(POLICY_RESUBSCRIBE_SECONDS)
+            finally:
+                if pubsub is not None:
+                    await pubsub.aclose()
+
+    @classmethod
+    async def start(cls):
+        try:
+            await cls.reload()
+        except Exception as e:
+            # 加载失败时先使用默认等级, 订阅连上后会重新加载
+            logger.error(f"Failed to load policy: {e}")
+        cls._listener = asyncio.create_task(cls._listen())
+
+    @classmethod
+    async def shutdown(cls):
+        if cls._listener is not None:
+            cls._listener.cancel()
+            await asyncio.gather(cls._listener, return_exceptions=True)
+            cls._listener = None
+
+    @classmethod
+    def stats(cls) -> Dict[str, int]:
+        return {"tiers": len(cls._tiers), "assigned_keys": len(cls._assignments)}
+
+
+metrics.register_gauge("policy", PolicyEngine.stats)
@@ -0,0 +1,252 @@
+# admission_manager.py
+import asyncio
+from typing import Any, Dict, List, Tuple
+
+from claude_auditlimit_python.configs import TOKEN_USAGE_IDLE_TTL_SECONDS
+from claude_auditlimit_python.redis_manager.base_redis_manager import BaseRedisManager
+from claude_auditlimit_python.redis_manager.keyspace import key_tag
+from claude_auditlimit_python.redis_manager.token_usage_manager import TokenUsageManager
+from claude_auditlimit_python.redis_manager.usage_manager import UsageManager
+from claude_auditlimit_python.redis_manager.usage_record_manager import (
+    UsageRecordManager,
+)
+
+# 按顺序判定同一个 key 的多个请求, 与单个 /audit_limit 的流程一致:
+# 任一 token 窗口超限 -> 拒绝; 否则对话累加 token, 用量累加对话总量;
+# 任一请求次数窗口超限 -> 拒绝(token 已记账); 否则请求次数 +1
+# KEYS[1..5]: token 用量 total, 3h, 12h, 24h, 1w
+# KEYS[6..10]: 请求次数 total, 3h, 12h, 24h, 1w
+# KEYS[11]: 对话计数 hash, KEYS[12]: 对话最后活跃时间 zset
+# KEYS[13..14]: token 用量 / 请求次数的按小时汇总 hash
+# KEYS[15..]: 只统计某个模型系列的计数器
+# (所有 KEYS 都在同一个 api key 的 slot 里; 所有 key 共用的 top-K zset 由脚本外更新)
+# ARGV: 对话过期时间, 当前时间, 4 个周期的过期时间,
+#       当前小时序号, 用量历史的过期时间,
+#       窗口个数, 每个窗口 (指标, 计数器 KEYS 下标, 上限, 模型系列),
+#       模型系列计数器个数, 每个计数器 (指标, KEYS 下标, 过期时间, 模型系列),
+#       请求个数, 每个请求 (conversation_uuid, tokens, 模型系列)
+# 指标 0 为 token, 1 为请求次数; 模型系列为空表示所有模型
+# 返回每个请求的 (结果, 等待秒数, 触发的窗口序号, 记账的 token 数)
+ADMIT_SCRIPT = """
+local idle_ttl = ARGV[1]
+local now = ARGV[2]
+local expiries = {ARGV[3], ARGV[4], ARGV[5], ARGV[6]}
+local hour = ARGV[7]
+local history_ttl = ARGV[8]
+
+local pos = 9
+local windows = {}
+for i = 1, tonumber(ARGV[pos]) do
+    local base = pos + (i - 1) * 4
+    windows[i] = {tonumber(ARGV[base + 1]), tonumber(ARGV[base + 2]),
+                  tonumber(ARGV[base + 3]), ARGV[base + 4]}
+end
+pos = pos + 1 + #windows * 4
+local counters = {}
+for i = 1, tonumber(ARGV[pos]) do
+    local base = pos + (i - 1) * 4
+    counters[i] = {tonumber(ARGV[base + 1]), tonumber(ARGV[base + 2]),
+                   ARGV[base + 3], ARGV[base + 4]}
+end
+pos = pos + 1 + #counters * 4
+local count = tonumber(ARGV[pos])
+
+local function over_limit(metric, family)
+    for i, w in ipairs(windows) do
+        if w[1] == metric and (w[4] == '' or w[4] == family) then
+            if tonumber(redis.call('GET', KEYS[w[2]]) or '0') >= w[3] then
+                return i, math.max(redis.call('TTL', KEYS[w[2]]), 0)
+            end
+        end
+    end
+    return nil, 0
+end
+
+local function charge(metric, family, amount)
+    local first = metric == 0 and 1 or 6
+    redis.call('INCRBY', KEYS[first], amount)
+    for i = 1, 4 do
+        redis.call('INCRBY', KEYS[first + i], amount)
+        redis.call('EXPIRE', KEYS[first + i], expiries[i])
+    end
+    local history = 13 + metric
+    redis.call('HINCRBY', KEYS[history], hour, amount)
+    redis.call('EXPIRE', KEYS[history], history_ttl)
+    for _, c in ipairs(counters) do
+        if c[1] == metric and c[4] == family then
+            redis.call('INCRBY', KEYS[c[2]], amount)
+            redis.call('EXPIRE', KEYS[c[2]], c[3])
+        end
+    end
+end
+
+local result = {}
+for i = 0, count - 1 do
+    local base = pos + 1 + i * 3
+    local uuid = ARGV[base]
+    local tokens = tonumber(ARGV[base + 1])
+    local family = ARGV[base + 2]
+    local window, wait = over_limit(0, family)
+    if window then
+        table.insert(result, 1)
+        table.insert(result, wait)
+        table.insert(result, window)
+        table.insert(result, 0)
+    else
+        local total = redis.call('HINCRBY', KEYS[11], uuid, tokens)
+        redis.call('ZADD', KEYS[12], now, uuid)
+        redis.call('EXPIRE', KEYS[11], idle_ttl)
+        redis.call('EXPIRE', KEYS[12], idle_ttl)
+        charge(0, family, total)
+        window, wait = over_limit(1, family)
+        if window then
+            table.insert(result, 2)
+            table.insert(result, wait)
+            table.insert(result, window)
+        else
+            charge(1, family, 1)
+            table.insert(result, 0)
+            table.insert(result, 0)
+            table.insert(result, 0)
+        end
+        table.insert(result, total)
+    end
+end
+return result
+"""
+
+
+class AdmissionManager(BaseRedisManager):
+    """
+    Scripted admission checks over the keys owned by UsageManager,
+    UsageRecordManager and TokenUsageManager, plus the per-family counters
+    of tiered policies.
+
+    All requests of one api_key are decided by a single script run that
+    checks every window of the key's tier, and the runs for different
+    api_keys share one pipeline per shard.
+    """
+
+    ADMITTED = 0
+    TOKEN_LIMIT = 1
+    REQUEST_LIMIT = 2
+
+    METRIC_TOKENS = "tokens"
+    METRIC_REQUESTS = "requests"
+    # 脚本里的指标编号即下标
+    METRICS = (METRIC_TOKENS, METRIC_REQUESTS)
+    PERIODS = dict(UsageManager.PERIOD_EXPIRY)
+    _STANDARD_KEYS = 14
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not hasattr(self, "_usage_manager"):
+            self._usage_manager = UsageManager()
+            self._record_manager = UsageRecordManager()
+            self._token_manager = TokenUsageManager()
+
+    @classmethod
+    def standard_key_index(cls, metric: str, period: str) -> int:
+        """1-based KEYS index of a shared usage counter."""
+        first = 1 if metric == cls.METRIC_TOKENS else 6
+        return first + 1 + list(cls.PERIODS).index(period)
+
+    @classmethod
+    def family_key_index(cls, index: int) -> int:
+        return cls._STANDARD_KEYS + 1 + index
+
+    def _get_family_key(self, api_key: str, metric: str, family: str, period: str) -> str:
+        prefix = "token_family" if metric == self.METRIC_TOKENS else "usage_family"
+        return f"{prefix}:{key_tag(api_key)}:{family}:{period}"
+
+    def _get_keys(self, api_key: str, tier=None) -> List[str]:
+        periods = [UsageManager.PERIOD_TOTAL] + list(self.PERIODS)
+        sources = (self._usage_manager, self._record_manager)
+        keys = (
+            [self._usage_manager._get_redis_key(api_key, p) for p in periods]
+            + [self._record_manager._get_redis_key(api_key, p) for p in periods]
+            + [
+                self._token_manager._get_redis_key(api_key),
+                self._token_manager._get_seen_key(api_key),
+            ]
+            + [
+                m._get_history_key(api_key, UsageManager.RESOLUTION_HOUR)
+                for m in sources
+            ]
+        )
+        if tier is not None:
+            keys.extend(
+                self._get_family_key(api_key, metric, family, period)
+                for metric, family, period in tier.family_counters
+            )
+        return keys
+
+    async def get_token_usage_3h(self, api_keys: List[str]) -> Dict[str, int]:
+        """3-hour token usage of many keys in one round trip per shard."""
+
+        async def read(redis, shard_api_keys):
+            pipe = redis.pipeline(transaction=False)
+            for api_key in shard_api_keys:
+                pipe.get(
+                    self._usage_manager._get_redis_key(
+                        api_key, UsageManager.PERIOD_3HOURS
+                    )
+                )
+            return await pipe.execute()
+
+        results = await self.map_shards(api_keys, lambda api_key: api_key, read)
+        return {
+            api_key: int(value) if value else 0
+            for api_key, value in zip(api_keys, results)
+        }
+
+    async def admit(
+        self,
+        requests: Dict[str, List[Tuple[str, int, str]]],
+        tiers: Dict[str, Any],
+        now: int,
+    ) -> Dict[str, List[Tuple[int, int, int]]]:
+        """
+        Decide ``api_key -> [(conversation_uuid, tokens, family), ...]`` in
+        order against each key's ``policy.CompiledTier``. Returns
+        ``api_key -> [(outcome, wait_seconds, window), ...]`` where ``window``
+        is the 1-based index of the tier window that refused the request.
+        """
+        api_keys = list(requests)
+
+        async def run(redis, shard_api_keys):
+            script = redis.register_script(ADMIT_SCRIPT)
+            pipe = redis.pipeline(transaction=False)
+            for api_key in shard_api_keys:
+                tier = tiers[api_key]
+                args = [
+                    TOKEN_USAGE_IDLE_TTL_SECONDS,
+                    now,
+                    *self.PERIODS.values(),
+                    hour,
+                    UsageManager.HISTORY_EXPIRY,
+                    *tier.window_args,
+                    *tier.counter_args,
+                    len(requests[api_key]),
+                ]
+                for entry in requests[api_key]:
+                    args.extend(entry)
+                await script(keys=self._get_keys(api_key, tier), args=args, client=pipe)
+            results = await pipe.execute()
+            tokens, admitted = [], []
+            for api_key, result in zip(shard_api_keys, results):
+                tokens.append((api_key, sum(result[3::4])))
+                admitted.append((api_key, result[::4].count(self.ADMITTED)))
+            await asyncio.gather(
+                self._usage_manager.increment_top(redis, tokens, hour),
+                self._record_manager.increment_top(redis, admitted, hour),
+            )
+            return results
+
+        hour = UsageManager.hour_bucket(now)
+        results = await self.map_shards(api_keys, lambda api_key: api_key, run)
+
+        return {
+            api_key: list(zip(result[::4], result[1::4], result[2::4]))
+            for api_key, result in zip(api_keys, results)
+        }
@@ -1,12 +1,20 @@
 # base_redis_manager.py
+import asyncio
 import json
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
 from redis.asyncio import Redis
 from claude_auditlimit_python.configs import REDIS_HOST, REDIS_PORT, REDIS_DB
+from claude_auditlimit_python.redis_manager.circuit_breaker import CircuitBreaker
+from claude_auditlimit_python.redis_manager.read_replicas import ReadReplicas
+from claude_auditlimit_python.redis_manager.redis_pool import RedisPool
 
 
 class BaseRedisManager:
     # Class-level cache to store instances
     _instances = {}
+    # 所有 manager 共用同一个 redis, 共用一个熔断器
+    breaker = CircuitBreaker("redis")
 
     def __new__(cls, host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB):
         """Implement singleton pattern for each unique connection configuration."""
@@ -22,14 +30,64 @@ class BaseRedisManager:
             self.host = host
             self.port = port
             self.db = db
-            self.aioredis = None
-
-    async def get_aioredis(self):
-        if self.aioredis is None:
-            self.aioredis = await Redis.from_url(
-                f"redis://{self.host}:{self.port}/{self.db}", decode_responses=True
-            )
-        return self.aioredis
+
+    async def get_aioredis(self, shard_key: Optional[str] = None) -> Redis:
+        # 连接池由 RedisPool 统一管理, 相同配置的 manager 共用一个;
+        # 分片时 shard_key (api key) 决定节点, 不传则是存放全局状态的第一个节点
+        return RedisPool.get_client(self.host, self.port, self.db, shard_key)
+
+    async def get_read_aioredis(self, shard_key: Optional[str] = None) -> Redis:
+        # 只给统计/管理接口用: 有新鲜的副本就读副本, 否则读主节点
+        replica = await ReadReplicas.get_client(self.db)
+        return replica or await self.get_aioredis(shard_key)
+
+    def get_all_aioredis(self) -> List[Redis]:
+        return RedisPool.get_all_clients(self.host, self.port, self.db)
+
+    async def get_read_shards(self) -> List[Redis]:
+        """One client per shard for read-only scans, a replica when available."""
+        if ReadReplicas.enabled():
+            return [await self.get_read_aioredis()]
+        return self.get_all_aioredis()
+
+    async def map_shards(
+        self,
+        items: List[Any],
+        shard_key: Callable[[Any], str],
+        fn: Callable[[Redis, List[Any]], Awaitable[List[Any]]],
+    ) -> List[Any]:
+        """
+        Split ``items`` by shard, run ``fn(redis, shard_items)`` on all shards
+        concurrently and return its per-item results in the original order.
+        """
+        groups: Dict[int, tuple] = {}
+        for index, item in enumerate(items):
+            redis = await self.get_aioredis(shard_key(item))
+            group = groups.setdefault(id(redis), (redis, [], []))
+            group[1].append(index)
+            group[2].append(item)
+
+        outputs = await asyncio.gather(
+            *(fn(redis, shard_items) for redis, _, shard_items in groups.values())
+        )
+        results: List[Any] = [None] * len(items)
+        for (_, indices, _), output in zip(groups.values(), outputs):
+            for index, result in zip(indices, output):
+                results[index] = result
+        return results
+
+    async def scan_all(self, match: str, read_only: bool = False, **kwargs) -> List[str]:
+        """
+        SCAN every shard in parallel and return all matching keys;
+        ``read_only`` scans a replica when one is available.
+        """
+
+        async def scan(redis: Redis) -> List[str]:
+            return [key async for key in redis.scan_iter(match=match, **kwargs)]
+
+        clients = await self.get_read_shards() if read_only else self.get_all_aioredis()
+        results = await asyncio.gather(*(scan(redis) for redis in clients))
+        return [key for keys in results for key in keys]
 
     async def decoded_get(self, key):
         res = await (await self.get_aioredis()).get(key)
@@ -0,0 +1,208 @@
+# blocklist_manager.py
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from claude_auditlimit_python.configs import (
+    BLOCKLIST_SWEEP_BATCH_SIZE,
+    BLOCKLIST_SWEEP_INTERVAL_SECONDS,
+    BLOCKLIST_SWEEP_MAX_REDIS_OPS,
+)
+from claude_auditlimit_python.policy import PolicyEngine
+from claude_auditlimit_python.redis_manager.admission_manager import AdmissionManager
+from claude_auditlimit_python.redis_manager.base_redis_manager import BaseRedisManager
+from claude_auditlimit_python.redis_manager.keyspace import (
+    identifier_from_key,
+    pattern_parts,
+)
+from claude_auditlimit_python.redis_manager.usage_manager import UsageManager
+from claude_auditlimit_python.redis_manager.usage_record_manager import (
+    UsageRecordManager,
+)
+
+
+class BlocklistManager(BaseRedisManager):
+    """
+    维护"当前被限流直到T"的黑名单。
+
+    定时任务分批 SCAN 所有3小时计数器, 按每个 key 所属等级的3小时限额,
+    把已经超限的 key 发布到 Redis hash
+    (field 为 api_key, value 为 "blocked_until:reason"), 每个 worker 再把这个
+    hash 拉到本地, 这样 /audit_limit 只需要一次内存查找就能拒绝已知超限的 key。
+    """
+
+    BLOCKLIST_KEY = "blocklist"
+    SWEEP_LOCK_KEY = "blocklist:sweep_lock"
+
+    REASON_TOKENS = "tokens"
+    REASON_REQUESTS = "requests"
+
+    # 本地副本: api_key -> (blocked_until, reason)
+    _local_blocklist: Dict[str, Tuple[int, str]] = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not hasattr(self, "_sources"):
+            self._sources = [
+                (UsageManager(), AdmissionManager.METRIC_TOKENS, self.REASON_TOKENS),
+                (
+                    UsageRecordManager(),
+                    AdmissionManager.METRIC_REQUESTS,
+                    self.REASON_REQUESTS,
+                ),
+            ]
+            # 扫描进度 (计数器来源, 分片, SCAN 游标), 一轮完整扫描可以跨越多次定时任务
+            self._source_index = 0
+            self._shard_index = 0
+            self._cursor = 0
+            self._pending: Dict[str, Tuple[int, str]] = {}
+            self._lock_token = uuid.uuid4().hex
+
+    @classmethod
+    def get_local_block(cls, api_key: str) -> Optional[Tuple[int, str]]:
+        """Return (wait_seconds, reason) if the key is known to be over limit."""
+        entry = cls._local_blocklist.get(api_key)
+        if entry is None:
+            return None
+        wait_seconds = entry[0] - int(time.time())
+        if wait_seconds <= 0:
+            return None
+        return wait_seconds, entry[1]
+
+    @classmethod
+    def block_local(cls, api_key: str, wait_seconds: int, reason: str) -> None:
+        """Record a limit hit seen on the request path before the next sweep."""
+        if wait_seconds > 0:
+            cls._local_blocklist[api_key] = (int(time.time()) + wait_seconds, reason)
+
+    @staticmethod
+    def _encode_entry(blocked_until: int, reason: str) -> str:
+        return f"{blocked_until}:{reason}"
+
+    @staticmethod
+    def _decode_entry(value: str) -> Tuple[int, str]:
+        blocked_until, _, reason = value.partition(":")
+        return int(blocked_until), reason
+
+    @staticmethod
+    def _split_pattern(manager: UsageManager) -> Tuple[str, str]:
+        # 例如 "token:*:3h" -> ("token:", ":3h")
+        return pattern_parts(manager._get_redis_key("*", manager.PERIOD_3HOURS))
+
+    async def _acquire_sweep_lock(self) -> bool:
+        """Only one worker sweeps at a time; the holder keeps renewing the lock."""
+        redis = await self.get_aioredis()
+        ttl = BLOCKLIST_SWEEP_INTERVAL_SECONDS * 3
+        if await redis.set(self.SWEEP_LOCK_KEY, self._lock_token, nx=True, ex=ttl):
+            return True
+        if await redis.get(self.SWEEP_LOCK_KEY) == self._lock_token:
+            await redis.expire(self.SWEEP_LOCK_KEY, ttl)
+            return True
+        return False
+
+    async def _sweep_step(self) -> int:
+        """
+        Continue the keyspace scan until the Redis ops budget is spent or a full
+        pass finishes. Returns the number of Redis operations issued.
+        """
+        shards = self.get_all_aioredis()
+        ops = 0
+        now = int(time.time())
+
+        while ops < BLOCKLIST_SWEEP_MAX_REDIS_OPS:
+            manager, metric, reason = self._sources[self._source_index]
+            redis = shards[self._shard_index]
+            prefix, suffix = self._split_pattern(manager)
+            cursor, keys = await redis.scan(
+                self._cursor,
+                match=f"{prefix}*{suffix}",
+                count=BLOCKLIST_SWEEP_BATCH_SIZE,
+            )
+            ops += 1
+
+            if keys:
+                pipe = redis.pipeline(transaction=False)
+                for key in keys:
+                    pipe.get(key)
+                values = await pipe.execute()
+                ops += len(keys)
+
+                # 只对超限的 key 再取 TTL
+                over_limit: List[str] = []
+                for key, value in zip(keys, values):
+                    if value is None:
+                        continue
+                    identifier = identifier_from_key(key, prefix, suffix)
+                    limit = PolicyEngine.tier_for(identifier).limit(metric)
+                    if limit is not None and int(value) >= limit:
+                        over_limit.append(key)
+                if over_limit:
+                    pipe = redis.pipeline(transaction=False)
+                    for key in over_limit:
+                        pipe.ttl(key)
+                    ttls = await pipe.execute()
+                    ops += len(over_limit)
+                    for key, ttl in zip(over_limit, ttls):
+                        if ttl <= 0:
+                            continue
+                        identifier = identifier_from_key(key, prefix, suffix)
+                        blocked_until = now + ttl
+                        previous = self._pending.get(identifier)
+                        if previous is None or previous[0] < blocked_until:
+                            self._pending[identifier] = (blocked_until, reason)
+
+            self._cursor = cursor
+            if cursor == 0:
+                self._shard_index += 1
+                if self._shard_index < len(shards):
+                    continue
+                self._shard_index = 0
+                self._source_index += 1
+                if self._source_index == len(self._sources):
+                    await self._publish(self._pending)
+                    ops += 1
+                    self._source_index = 0
+                    self._pending = {}
+                    break
+
+        return ops
+
+    async def _publish(self, entries: Dict[str, Tuple[int, str]]) -> None:
+        redis = await self.get_aioredis()
+        pipe = redis.pipeline(transaction=True)
+        pipe.delete(self.BLOCKLIST_KEY)
+        if entries:
+            pipe.hset(
+                self.BLOCKLIST_KEY,
+                mapping={
+                    api_key: self._encode_entry(blocked_until, reason)
+                    for api_key, (blocked_until, reason) in entries.items()
+                },
+            )
+        await pipe.execute()
+        logger.debug(f"Published blocklist with {len(entries)} keys")
+
+    async def refresh_local(self) -> int:
+        """Replace the local copy with the blocklist hash from Redis."""
+        redis = await self.get_aioredis()
+        raw = await redis.hgetall(self.BLOCKLIST_KEY)
+        now = int(time.time())
+        local = {}
+        for api_key, value in raw.items():
+            blocked_until, reason = self._decode_entry(value)
+            if blocked_until > now:
+                local[api_key] = (blocked_until, reason)
+        BlocklistManager._local_blocklist = local
+        return len(local)
+
+    async def sweep(self) -> int:
+        """
+        Run one sweep step if this worker holds the sweep lock, then refresh the
+        local copy. Returns the number of blocked keys known locally.
+        """
+        if await self._acquire_sweep_lock():
+            ops = await self._sweep_step()
+            logger.debug(f"Blocklist sweep used {ops} redis ops")
+        return await self.refresh_local()
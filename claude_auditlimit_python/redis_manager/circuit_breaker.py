@@ -0,0 +1,125 @@
+# circuit_breaker.py
+import asyncio
+import time
+from typing import Optional
+
+from loguru import logger
+from redis.exceptions import RedisError, ResponseError
+
+from claude_auditlimit_python import metrics
+from claude_auditlimit_python.configs import (
+    REDIS_BREAKER_FAILURE_THRESHOLD,
+    REDIS_BREAKER_OPEN_SECONDS,
+    REDIS_BREAKER_SLOW_CALL_SECONDS,
+    REDIS_CALL_TIMEOUT_SECONDS,
+    REDIS_LATENCY_EWMA_ALPHA,
+)
+
+
+class RedisUnavailableError(Exception):
+    """Redis failed, timed out, or the breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    closed -> open after ``REDIS_BREAKER_FAILURE_THRESHOLD`` consecutive
+    failures, where calls slower than ``REDIS_BREAKER_SLOW_CALL_SECONDS`` count
+    as failures too. After ``REDIS_BREAKER_OPEN_SECONDS`` one probe call is let
+    through (half-open); its result closes or re-opens the breaker.
+
+    ``latency`` is a moving average of call durations, used for load shedding.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.latency = 0.0
+        metrics.register_gauge(f"{name}_breaker_state", lambda: self.state)
+        metrics.register_gauge(f"{name}_breaker_failures", lambda: self.failures)
+        metrics.register_gauge(
+            f"{name}_latency_ms", lambda: round(self.latency * 1000, 2)
+        )
+
+    def allow_request(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < REDIS_BREAKER_OPEN_SECONDS:
+                return False
+            self._transition(self.HALF_OPEN)
+        if self.probe_in_flight:
+            return False
+        self.probe_in_flight = True
+        return True
+
+    def record_success(self) -> None:
+        self.probe_in_flight = False
+        self.failures = 0
+        if self.state != self.CLOSED:
+            self._transition(self.CLOSED)
+
+    def record_failure(self) -> None:
+        self.probe_in_flight = False
+        self.failures += 1
+        if self.state == self.HALF_OPEN or (
+            self.state == self.CLOSED
+            and self.failures >= REDIS_BREAKER_FAILURE_THRESHOLD
+        ):
+            self.opened_at = time.monotonic()
+            self._transition(self.OPEN)
+
+    def _observe(self, start: float) -> float:
+        elapsed = time.monotonic() - start
+        self.latency += REDIS_LATENCY_EWMA_ALPHA * (elapsed - self.latency)
+        return elapsed
+
+    def _transition(self, state: str) -> None:
+        logger.warning(f"{self.name} circuit breaker {self.state} -> {state}")
+        metrics.incr(f"{self.name}_breaker_{state}")
+        self.state = state
+
+    async def call(
+        self,
+        fn,
+        *args,
+        timeout: Optional[float] = REDIS_CALL_TIMEOUT_SECONDS,
+        **kwargs,
+    ):
+        """
+        Await ``fn(*args, **kwargs)`` under the breaker. Connection errors and
+        timeouts are raised as RedisUnavailableError; errors returned by the
+        server (ResponseError) are not availability problems and pass through.
+
+        ``timeout=None`` leaves the call bounded only by the pool and socket
+        timeouts, for writes that must not be abandoned once sent.
+        """
+        if not self.allow_request():
+            metrics.incr(f"{self.name}_breaker_rejected")
+            raise RedisUnavailableError(f"{self.name} circuit breaker is open")
+        start = time.monotonic()
+        try:
+            result = await asyncio.wait_for(fn(*args, **kwargs), timeout)
+        except ResponseError:
+            self._observe(start)
+            self.record_success()
+            raise
+        except (RedisError, OSError, asyncio.TimeoutError) as e:
+            self._observe(start)
+            self.record_failure()
+            raise RedisUnavailableError(f"{type(e).__name__}: {e}") from e
+        except BaseException:
+            self.probe_in_flight = False
+            raise
+        if self._observe(start) > REDIS_BREAKER_SLOW_CALL_SECONDS:
+            metrics.incr(f"{self.name}_slow_calls")
+            self.record_failure()
+        else:
+            self.record_success()
+        return result
@@ -2,10 +2,32 @@
 import hashlib
 import json
 from datetime import timedelta
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
 
 from claude_auditlimit_python.configs import MAX_DEVICES
 from claude_auditlimit_python.redis_manager.base_redis_manager import BaseRedisManager
+from claude_auditlimit_python.redis_manager.keyspace import (
+    identifier_from_key,
+    key_tag,
+    pattern_parts,
+)
+
+# 已存在的设备直接通过; 否则在未达到上限时登记设备并刷新过期时间
+# KEYS[1]: 设备集合, KEYS[2]: 设备信息
+# ARGV: device_hash, max_devices, user_agent, host, expire_seconds
+CHECK_AND_ADD_DEVICE_SCRIPT = """
+if redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 1 then
+    return 1
+end
+if redis.call('SCARD', KEYS[1]) >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('SADD', KEYS[1], ARGV[1])
+redis.call('HSET', KEYS[2], 'user_agent', ARGV[3], 'host', ARGV[4])
+redis.call('EXPIRE', KEYS[2], ARGV[5])
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return 1
+"""
 
 
 class DeviceInfo:
@@ -28,49 +50,54 @@ class DeviceManager(BaseRedisManager):
         return hashlib.sha256(identifier.encode()).hexdigest()
 
     def _get_device_key(self, token: str) -> str:
-        return f"devices:{token}"
+        return f"devices:{key_tag(token)}"
 
     def _get_device_info_key(self, token: str, device_hash: str) -> str:
-        return f"device_info:{token}:{device_hash}"
+        return f"device_info:{key_tag(token)}:{device_hash}"
 
     async def check_and_add_device(
-        self, token: str, device_identifier: str, user_agent: str, host: str
+        self,
+        token: str,
+        device_identifier: str,
+        user_agent: str,
+        host: str,
+        max_devices: int = MAX_DEVICES,
     ) -> bool:
-        device_hash = self._generate_device_hash(device_identifier)
-        key = self._get_device_key(token)
-        redis = await self.get_aioredis()
-
-        # Check if device exists
-        exists = await redis.sismember(key, device_hash)
-        if exists:
-            return True
-
-        # Check device count
-        count = await redis.scard(key)
-        if count >= MAX_DEVICES:
-            return False
-
-        # Add device
-        await redis.sadd(key, device_hash)
-
-        # Store device info
-        info = DeviceInfo(user_agent=user_agent, host=host)
-        await self._store_device_info(token, device_hash, info)
-
-        # Set expiration
-        await redis.expire(key, int(self.DEVICE_EXPIRE.total_seconds()))
-        return True
-
-    async def _store_device_info(self, token: str, device_hash: str, info: DeviceInfo):
-        key = self._get_device_info_key(token, device_hash)
-        redis = await self.get_aioredis()
-
-        await redis.hset(key, mapping=info.to_dict())
-        await redis.expire(key, int(self.DEVICE_EXPIRE.total_seconds()))
+        results = await self.check_and_add_devices(
+            [(token, device_identifier, user_agent, host, max_devices)]
+        )
+        return results[0]
+
+    async def check_and_add_devices(
+        self, devices: List[Tuple[str, str, str, str, int]]
+    ) -> List[bool]:
+        """
+        Check ``(token, device_identifier, user_agent, host, max_devices)``
+        items in one pipeline per shard; each check runs atomically as a script.
+        """
+        expire = int(self.DEVICE_EXPIRE.total_seconds())
+
+        async def check(redis, shard_devices):
+            script = redis.register_script(CHECK_AND_ADD_DEVICE_SCRIPT)
+            pipe = redis.pipeline(transaction=False)
+            for token, device_identifier, user_agent, host, max_devices in shard_devices:
+                device_hash = self._generate_device_hash(device_identifier)
+                await script(
+                    keys=[
+                        self._get_device_key(token),
+                        self._get_device_info_key(token, device_hash),
+                    ],
+                    args=[device_hash, max_devices, user_agent, host, expire],
+                    client=pipe,
+                )
+            results = await pipe.execute()
+            return [result == 1 for result in results]
+
+        return await self.map_shards(devices, lambda item: item[0], check)
 
     async def get_device_list(self, token: str) -> List[DeviceInfo]:
         key = self._get_device_key(token)
-        redis = await self.get_aioredis()
+        redis = await self.get_read_aioredis(token)
 
         device_hashes = await redis.smembers(key)
         device_list = []
@@ -87,7 +114,7 @@ class DeviceManager(BaseRedisManager):
         device_hash = self._generate_device_hash(device_identifier)
         key = self._get_device_key(token)
         info_key = self._get_device_info_key(token, device_hash)
-        redis = await self.get_aioredis()
+        redis = await self.get_aioredis(token)
 
         # Remove device info
         await redis.delete(info_key)
@@ -97,12 +124,12 @@ class DeviceManager(BaseRedisManager):
         return removed > 0
 
     async def get_all_token_devices(self) -> Dict[str, List[DeviceInfo]]:
-        redis = await self.get_aioredis()
-        keys = await redis.keys("devices:*")
+        prefix, suffix = pattern_parts(self._get_device_key("*"))
+        keys = await self.scan_all(f"{prefix}*{suffix}", read_only=True)
         result = {}
 
         for key in keys:
-            token = key[8:]  # Remove "devices:" prefix
+            token = identifier_from_key(key, prefix, suffix)
             device_list = await self.get_device_list(token)
             result[token] = device_list
 
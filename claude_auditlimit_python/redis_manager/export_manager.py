@@ -0,0 +1,154 @@
+# export_manager.py
+from typing import AsyncIterator, List, Optional, Tuple
+
+from redis.asyncio import Redis
+
+from claude_auditlimit_python.configs import EXPORT_SCAN_COUNT
+from claude_auditlimit_python.redis_manager.base_redis_manager import BaseRedisManager
+from claude_auditlimit_python.redis_manager.device_manager import DeviceManager
+from claude_auditlimit_python.redis_manager.keyspace import (
+    escape_glob,
+    identifier_from_key,
+    pattern_parts,
+)
+from claude_auditlimit_python.redis_manager.usage_manager import UsageManager
+from claude_auditlimit_python.redis_manager.usage_record_manager import (
+    UsageRecordManager,
+)
+
+
+class ExportManager(BaseRedisManager):
+    """
+    Reads usage and device data one SCAN batch at a time, with one pipelined
+    round trip per batch, for exports of any size.
+
+    Each batch comes with the cursor to resume after it, ``"<shard>:<scan
+    cursor>"`` (``"0:0"`` starts from the beginning), or None after the last
+    batch. Like SCAN itself a resumed export may repeat keys but misses none
+    that existed throughout; a cursor is only meaningful on the node that
+    produced it, so resume against the same replica set and shard layout.
+    """
+
+    START_CURSOR = "0:0"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not hasattr(self, "_usage_manager"):
+            self._usage_manager = UsageManager()
+            self._record_manager = UsageRecordManager()
+            self._device_manager = DeviceManager()
+
+    @staticmethod
+    def parse_cursor(cursor: str) -> Tuple[int, int]:
+        shard, _, scan_cursor = cursor.partition(":")
+        shard_index, scan_cursor = int(shard), int(scan_cursor)
+        if shard_index < 0 or scan_cursor < 0:
+            raise ValueError(f"invalid cursor {cursor!r}")
+        return shard_index, scan_cursor
+
+    async def check_cursor(self, cursor: str) -> None:
+        """Raise ValueError unless ``cursor`` points at one of the read shards."""
+        shard_index, _ = self.parse_cursor(cursor)
+        shards = len(await self.get_read_shards())
+        if shard_index >= shards:
+            raise ValueError(f"cursor {cursor!r} does not match {shards} shards")
+
+    async def _scan_batches(
+        self, match: str, cursor: str
+    ) -> AsyncIterator[Tuple[Redis, List[str], Optional[str]]]:
+        shards = await self.get_read_shards()
+        shard_index, scan_cursor = self.parse_cursor(cursor)
+        if shard_index >= len(shards):
+            raise ValueError(f"cursor {cursor!r} does not match {len(shards)} shards")
+        while shard_index < len(shards):
+            redis = shards[shard_index]
+            scan_cursor, keys = await redis.scan(
+                scan_cursor, match=match, count=EXPORT_SCAN_COUNT
+            )
+            if scan_cursor == 0:
+                shard_index += 1
+            next_cursor = (
+                None if shard_index == len(shards) else f"{shard_index}:{scan_cursor}"
+            )
+            yield redis, keys, next_cursor
+
+    async def iter_usage(
+        self, prefix: str = "", min_total: int = 0, cursor: str = START_CURSOR
+    ) -> AsyncIterator[Tuple[List[dict], Optional[str]]]:
+        """
+        Yield ``([{"api_key", "tokens", "requests"}, ...], next_cursor)`` per
+        batch for keys starting with ``prefix`` with at least ``min_total``
+        tokens in total; ``tokens`` and ``requests`` map period -> count.
+        """
+        manager = self._usage_manager
+        total = manager.PERIOD_TOTAL
+        periods = [total] + [period for period, _ in manager.PERIOD_EXPIRY]
+        key_prefix, key_suffix = pattern_parts(manager._get_redis_key("*", total))
+        match = manager._get_redis_key(f"{escape_glob(prefix)}*", total)
+
+        async for redis, keys, next_cursor in self._scan_batches(match, cursor):
+            rows = []
+            if keys:
+                api_keys = [
+                    identifier_from_key(key, key_prefix, key_suffix) for key in keys
+                ]
+                pipe = redis.pipeline(transaction=False)
+                for api_key in api_keys:
+                    for source in (manager, self._record_manager):
+                        for period in periods:
+                            pipe.get(source._get_redis_key(api_key, period))
+                values = await pipe.execute()
+                width = len(periods)
+                for i, api_key in enumerate(api_keys):
+                    counts = [
+                        int(value) if value else 0
+                        for value in values[i * 2 * width : (i + 1) * 2 * width]
+                    ]
+                    if counts[0] < min_total:
+                        continue
+                    rows.append(
+                        {
+                            "api_key": api_key,
+                            "tokens": dict(zip(periods, counts[:width])),
+                            "requests": dict(zip(periods, counts[width:])),
+                        }
+                    )
+            yield rows, next_cursor
+
+    async def iter_devices(
+        self, prefix: str = "", cursor: str = START_CURSOR
+    ) -> AsyncIterator[Tuple[List[dict], Optional[str]]]:
+        """
+        Yield ``([{"api_key", "device_hash", "user_agent", "host"}, ...],
+        next_cursor)`` per batch, one row per registered device.
+        """
+        manager = self._device_manager
+        key_prefix, key_suffix = pattern_parts(manager._get_device_key("*"))
+        match = manager._get_device_key(f"{escape_glob(prefix)}*")
+
+        async for redis, keys, next_cursor in self._scan_batches(match, cursor):
+            rows = []
+            if keys:
+                pipe = redis.pipeline(transaction=False)
+                for key in keys:
+                    pipe.smembers(key)
+                members = await pipe.execute()
+                devices = [
+                    (identifier_from_key(key, key_prefix, key_suffix), device_hash)
+                    for key, hashes in zip(keys, members)
+                    for device_hash in sorted(hashes)
+                ]
+                pipe = redis.pipeline(transaction=False)
+                for api_key, device_hash in devices:
+                    pipe.hgetall(manager._get_device_info_key(api_key, device_hash))
+                infos = await pipe.execute()
+                for (api_key, device_hash), info in zip(devices, infos):
+                    rows.append(
+                        {
+                            "api_key": api_key,
+                            "device_hash": device_hash,
+                            "user_agent": info.get("user_agent", ""),
+                            "host": info.get("host", ""),
+                        }
+                    )
+            yield rows, next_cursor
@@ -0,0 +1,195 @@
+# history_manager.py
+import asyncio
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from redis.asyncio import Redis
+
+from claude_auditlimit_python.configs import (
+    HISTORY_DAILY_RETENTION_DAYS,
+    HISTORY_DAY_OFFSET_HOURS,
+    HISTORY_HOURLY_RETENTION_DAYS,
+)
+from claude_auditlimit_python.redis_manager.base_redis_manager import BaseRedisManager
+from claude_auditlimit_python.redis_manager.keyspace import pattern_parts
+from claude_auditlimit_python.redis_manager.read_replicas import ReadReplicas
+from claude_auditlimit_python.redis_manager.usage_manager import UsageManager
+from claude_auditlimit_python.redis_manager.usage_record_manager import (
+    UsageRecordManager,
+)
+
+# 把一个 key 早于 ARGV[1] 小时的汇总按天合并, 并删除早于 ARGV[2] 天的日汇总
+# KEYS[1]: 按小时汇总 hash, KEYS[2]: 按天汇总 hash
+# ARGV: 小时保留的起点 (整天的开始), 日保留的起点, 时区偏移小时, 日汇总的过期时间
+DOWNSAMPLE_SCRIPT = """
+local cutoff_hour = tonumber(ARGV[1])
+local cutoff_day = tonumber(ARGV[2])
+local offset = tonumber(ARGV[3])
+local moved = 0
+local entries = redis.call('HGETALL', KEYS[1])
+for i = 1, #entries, 2 do
+    local hour = tonumber(entries[i])
+    if hour < cutoff_hour then
+        local day = math.floor((hour + offset) / 24)
+        if day >= cutoff_day then
+            redis.call('HINCRBY', KEYS[2], day, entries[i + 1])
+        end
+        redis.call('HDEL', KEYS[1], entries[i])
+        moved = moved + 1
+    end
+end
+for _, day in ipairs(redis.call('HKEYS', KEYS[2])) do
+    if tonumber(day) < cutoff_day then
+        redis.call('HDEL', KEYS[2], day)
+    end
+end
+if moved > 0 then
+    redis.call('EXPIRE', KEYS[2], ARGV[4])
+end
+return moved
+"""
+
+# 把一天的 top-K 小时 zset 合并进当天的 zset 并删除; 重复执行不会重复累加
+# KEYS[1]: 当天的 zset, KEYS[2..]: 当天各小时的 zset; ARGV[1]: 过期时间
+DOWNSAMPLE_TOP_SCRIPT = """
+redis.call('ZUNIONSTORE', KEYS[1], #KEYS, unpack(KEYS))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+redis.call('DEL', unpack(KEYS, 2))
+return #KEYS - 1
+"""
+
+
+class HistoryManager(BaseRedisManager):
+    """
+    Reads and maintains the usage history written by ``UsageManager``.
+
+    Each hour lives in exactly one place: in the hourly hash of the key (and
+    the hourly top-K zset) until its whole day is older than
+    ``HISTORY_HOURLY_RETENTION_DAYS``, then in the daily ones. Daily data is
+    kept for ``HISTORY_DAILY_RETENTION_DAYS``.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not hasattr(self, "_managers"):
+            self._managers = {
+                "tokens": UsageManager(),
+                "requests": UsageRecordManager(),
+            }
+
+    def manager(self, metric: str) -> UsageManager:
+        return self._managers[metric]
+
+    @staticmethod
+    def hourly_cutoff(now: float) -> int:
+        """First hour still kept at hourly resolution; always a day start."""
+        today = UsageManager.day_bucket(UsageManager.hour_bucket(now))
+        return UsageManager.day_start_hour(today - HISTORY_HOURLY_RETENTION_DAYS)
+
+    @staticmethod
+    def daily_cutoff(now: float) -> int:
+        today = UsageManager.day_bucket(UsageManager.hour_bucket(now))
+        return today - HISTORY_DAILY_RETENTION_DAYS
+
+    async def get_history(
+        self, metric: str, api_keys: List[str]
+    ) -> List[Tuple[Dict[int, int], Dict[int, int]]]:
+        """``(hour -> count, day -> count)`` of each key."""
+        manager = self.manager(metric)
+
+        async def read(redis, shard_api_keys):
+            pipe = redis.pipeline(transaction=False)
+            for api_key in shard_api_keys:
+                for resolution in (manager.RESOLUTION_HOUR, manager.RESOLUTION_DAY):
+                    pipe.hgetall(manager._get_history_key(api_key, resolution))
+            values = await pipe.execute()
+            return [
+                tuple(
+                    {int(bucket): int(count) for bucket, count in value.items()}
+                    for value in values[i : i + 2]
+                )
+                for i in range(0, len(values), 2)
+            ]
+
+        if ReadReplicas.enabled():
+            # 有副本时不分片, 一个副本有全部数据
+            return await read(await self.get_read_aioredis(), api_keys)
+        return await self.map_shards(api_keys, lambda api_key: api_key, read)
+
+    async def get_top_scores(
+        self, metric: str, hours: List[int], days: List[int]
+    ) -> List[Tuple[str, float]]:
+        """
+        Usage per key summed over the given hourly and daily buckets, one
+        ZUNION per shard; a key may appear once per shard after resharding.
+        """
+        manager = self.manager(metric)
+        keys = [manager._get_top_key(manager.RESOLUTION_HOUR, h) for h in hours] + [
+            manager._get_top_key(manager.RESOLUTION_DAY, d) for d in days
+        ]
+        if not keys:
+            return []
+        shards = await self.get_read_shards()
+        results = await asyncio.gather(
+            *(redis.zunion(keys, withscores=True) for redis in shards)
+        )
+        return [entry for result in results for entry in result]
+
+    async def _downsample_top(
+        self, redis: Redis, manager: UsageManager, now: float
+    ) -> int:
+        cutoff_hour, cutoff_day = self.hourly_cutoff(now), self.daily_cutoff(now)
+        prefix, _ = pattern_parts(manager._get_top_key(manager.RESOLUTION_HOUR, "*"))
+        days: Dict[int, List[str]] = defaultdict(list)
+        async for key in redis.scan_iter(match=f"{prefix}*", count=500):
+            hour = int(key[len(prefix) :])
+            if hour < cutoff_hour:
+                days[UsageManager.day_bucket(hour)].append(key)
+
+        script = redis.register_script(DOWNSAMPLE_TOP_SCRIPT)
+        merged = 0
+        for day, hour_keys in days.items():
+            if day < cutoff_day:
+                await redis.delete(*hour_keys)
+                continue
+            merged += await script(
+                keys=[manager._get_top_key(manager.RESOLUTION_DAY, day), *hour_keys],
+                args=[manager.HISTORY_EXPIRY],
+            )
+        return merged
+
+    async def _downsample_keys(
+        self, redis: Redis, manager: UsageManager, now: float
+    ) -> int:
+        prefix, suffix = pattern_parts(
+            manager._get_history_key("*", manager.RESOLUTION_HOUR)
+        )
+        daily_suffix = pattern_parts(
+            manager._get_history_key("*", manager.RESOLUTION_DAY)
+        )[1]
+        script = redis.register_script(DOWNSAMPLE_SCRIPT)
+        args = [
+            self.hourly_cutoff(now),
+            self.daily_cutoff(now),
+            HISTORY_DAY_OFFSET_HOURS,
+            manager.HISTORY_EXPIRY,
+        ]
+        moved = 0
+        pipe = redis.pipeline(transaction=False)
+        async for key in redis.scan_iter(match=f"{prefix}*{suffix}", count=500):
+            daily_key = key[: len(key) - len(suffix)] + daily_suffix
+            await script(keys=[key, daily_key], args=args, client=pipe)
+            if len(pipe) >= 500:
+                moved += sum(await pipe.execute())
+        if len(pipe):
+            moved += sum(await pipe.execute())
+        return moved
+
+    async def downsample(self, now: float) -> Dict[str, int]:
+        """Fold hours older than the hourly retention into days, on every shard."""
+        report = {"hours": 0, "top_hours": 0}
+        for manager in self._managers.values():
+            for redis in self.get_all_aioredis():
+                report["hours"] += await self._downsample_keys(redis, manager, now)
+                report["top_hours"] += await self._downsample_top(redis, manager, now)
+        return report
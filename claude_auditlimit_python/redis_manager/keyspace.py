@@ -0,0 +1,62 @@
+# keyspace.py
+# key 布局与客户端分片
+import bisect
+import hashlib
+from typing import List, Optional, Tuple
+
+from claude_auditlimit_python.configs import REDIS_KEY_LAYOUT
+
+LAYOUT_LEGACY = "legacy"
+LAYOUT_HASHTAG = "hashtag"
+
+
+def key_tag(identifier: str, layout: str = REDIS_KEY_LAYOUT) -> str:
+    """
+    The api key as it appears inside key names. Under the hashtag layout it is
+    wrapped in ``{}`` so every key of one api key maps to the same cluster slot.
+    """
+    if layout == LAYOUT_HASHTAG:
+        return f"{{{identifier}}}"
+    return identifier
+
+
+def pattern_parts(template: str) -> Tuple[str, str]:
+    """Split a key built for the identifier ``*`` into (prefix, suffix)."""
+    prefix, suffix = template.split("*")
+    return prefix, suffix
+
+
+def escape_glob(value: str) -> str:
+    """Escape SCAN MATCH wildcards so ``value`` is matched literally."""
+    return "".join(f"\\{c}" if c in "*?[]\\" else c for c in value)
+
+
+def identifier_from_key(key: str, prefix: str, suffix: str) -> Optional[str]:
+    """Inverse of a key builder, given the parts from ``pattern_parts``."""
+    if not key.startswith(prefix) or not key.endswith(suffix):
+        return None
+    return key[len(prefix) : len(key) - len(suffix)]
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hashing with virtual nodes; adding a node moves ~1/n of the keys."""
+
+    VIRTUAL_NODES = 160
+
+    def __init__(self, nodes: List[str]):
+        self.nodes = list(nodes)
+        ring = sorted(
+            (_hash(f"{node}#{i}"), node)
+            for node in self.nodes
+            for i in range(self.VIRTUAL_NODES)
+        )
+        self._hashes = [h for h, _ in ring]
+        self._owners = [node for _, node in ring]
+
+    def get_node(self, key: str) -> str:
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[index]
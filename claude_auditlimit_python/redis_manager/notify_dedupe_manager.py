@@ -0,0 +1,63 @@
+# notify_dedupe_manager.py
+import hashlib
+import time
+
+from claude_auditlimit_python.configs import NOTIFY_DEDUPE_WINDOW_SECONDS
+from claude_auditlimit_python.redis_manager.base_redis_manager import BaseRedisManager
+
+# KEYS[1]: 当前时间桶, KEYS[2]: 上一个时间桶; ARGV[1]: id 摘要, ARGV[2]: 过期时间
+FIRST_SEEN_SCRIPT = """
+if redis.call('SISMEMBER', KEYS[2], ARGV[1]) == 1 then
+    return 0
+end
+if redis.call('SADD', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+class NotifyDedupeManager(BaseRedisManager):
+    """
+    Remembers notify ids for one to two ``NOTIFY_DEDUPE_WINDOW_SECONDS``.
+
+    Ids are stored as 8-byte digests in one set per time bucket; a bucket
+    expires on its own two windows after it was last written.
+    """
+
+    def _get_bucket_key(self, bucket: int) -> str:
+        return f"notify_dedupe:{bucket}"
+
+    @staticmethod
+    def _digest(dedupe_id: str) -> str:
+        return hashlib.blake2b(dedupe_id.encode(), digest_size=8).hexdigest()
+
+    def _current_bucket(self) -> int:
+        return int(time.time()) // NOTIFY_DEDUPE_WINDOW_SECONDS
+
+    async def first_seen(self, dedupe_id: str) -> bool:
+        """Record the id; False if it was already seen within the window."""
+        redis = await self.get_aioredis()
+        bucket = self._current_bucket()
+        script = redis.register_script(FIRST_SEEN_SCRIPT)
+        result = await script(
+            keys=[self._get_bucket_key(bucket), self._get_bucket_key(bucket - 1)],
+            args=[self._digest(dedupe_id), NOTIFY_DEDUPE_WINDOW_SECONDS * 2],
+        )
+        return result == 1
+
+    async def forget(self, *dedupe_ids: str) -> None:
+        """
+        Undo ``first_seen`` when the notify could not be accepted or charged
+        after all. Both buckets ``first_seen`` checks are cleared.
+        """
+        if not dedupe_ids:
+            return
+        redis = await self.get_aioredis()
+        bucket = self._current_bucket()
+        digests = [self._digest(dedupe_id) for dedupe_id in dedupe_ids]
+        pipe = redis.pipeline(transaction=False)
+        pipe.srem(self._get_bucket_key(bucket), *digests)
+        pipe.srem(self._get_bucket_key(bucket - 1), *digests)
+        await pipe.execute()
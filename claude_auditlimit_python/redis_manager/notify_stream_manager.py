@@ -0,0 +1,123 @@
+# notify_stream_manager.py
+import os
+import socket
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+from redis.exceptions import ResponseError
+
+from claude_auditlimit_python import metrics
+from claude_auditlimit_python.configs import NOTIFY_MAX_DELIVERIES, NOTIFY_QUEUE_SIZE
+from claude_auditlimit_python.redis_manager.base_redis_manager import BaseRedisManager
+
+# (entry id, 字段); 已被删除的消息 XAUTOCLAIM 返回的字段为 None
+StreamEntry = Tuple[str, Optional[Dict[str, str]]]
+
+
+class NotifyStreamManager(BaseRedisManager):
+    """Redis stream backing the notify accounting queue, shared by all workers."""
+
+    STREAM_KEY = "notify_queue"
+    # 超过投递次数或无法解析的消息, 保留原字段以便排查
+    DEAD_LETTER_KEY = "notify_queue:dead"
+    GROUP = "accounting"
+    # 消费者崩溃后, 未确认的消息空闲多久后被其他消费者接管
+    CLAIM_IDLE_MS = 60 * 1000
+
+    def consumer_name(self, index: int) -> str:
+        return f"{socket.gethostname()}-{os.getpid()}-{index}"
+
+    async def ensure_group(self) -> None:
+        redis = await self.get_aioredis()
+        try:
+            await redis.xgroup_create(self.STREAM_KEY, self.GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def add(self, fields: Dict[str, str]) -> bool:
+        """Append a job; refuses when the stream already holds NOTIFY_QUEUE_SIZE entries."""
+        redis = await self.get_aioredis()
+        if await redis.xlen(self.STREAM_KEY) >= NOTIFY_QUEUE_SIZE:
+            return False
+        await redis.xadd(self.STREAM_KEY, fields)
+        return True
+
+    async def read(
+        self, consumer: str, count: int, block_ms: int
+    ) -> Tuple[List[StreamEntry], List[StreamEntry]]:
+        """
+        ``(entries to process, entries dead-lettered by this read)``; the
+        latter were redelivered more than NOTIFY_MAX_DELIVERIES times.
+        """
+        redis = await self.get_aioredis()
+        # 先接管其他消费者遗留的消息
+        _, claimed, *_ = await redis.xautoclaim(
+            self.STREAM_KEY, self.GROUP, consumer, self.CLAIM_IDLE_MS, count=count
+        )
+        if claimed:
+            return await self._drop_redelivered(redis, claimed)
+        response = await redis.xreadgroup(
+            self.GROUP, consumer, {self.STREAM_KEY: ">"}, count=count, block=block_ms
+        )
+        if not response:
+            return [], []
+        # RESP3 下返回 {stream: [entries]}, RESP2 下返回 [[stream, entries]]
+        if isinstance(response, dict):
+            return response[self.STREAM_KEY][0], []
+        return response[0][1], []
+
+    async def _drop_redelivered(
+        self, redis, entries: List[StreamEntry]
+    ) -> Tuple[List[StreamEntry], List[StreamEntry]]:
+        """Dead-letter claimed entries delivered more than NOTIFY_MAX_DELIVERIES times."""
+        pipe = redis.pipeline(transaction=False)
+        for entry_id, _ in entries:
+            pipe.xpending_range(self.STREAM_KEY, self.GROUP, entry_id, entry_id, 1)
+        pending = await pipe.execute()
+        keep, dead = [], []
+        for entry, info in zip(entries, pending):
+            # XAUTOCLAIM 之后投递次数已经加一
+            if info and info[0]["times_delivered"] > NOTIFY_MAX_DELIVERIES:
+                dead.append(entry)
+            else:
+                keep.append(entry)
+        if dead:
+            metrics.incr("notify_dead_lettered", len(dead))
+            logger.warning(
+                f"Dead-lettering {len(dead)} notify entries delivered more than "
+                f"{NOTIFY_MAX_DELIVERIES} times"
+            )
+            await self.dead_letter(dead, "max_deliveries")
+        return keep, dead
+
+    async def dead_letter(
+        self, entries: List[StreamEntry], reason: str
+    ) -> None:
+        """Copy entries to the dead-letter stream, then ack and delete them."""
+        redis = await self.get_aioredis()
+        pipe = redis.pipeline(transaction=True)
+        for entry_id, fields in entries:
+            pipe.xadd(
+                self.DEAD_LETTER_KEY,
+                {**(fields or {}), "_id": entry_id, "_reason": reason},
+                maxlen=NOTIFY_QUEUE_SIZE,
+                approximate=True,
+            )
+        ids = [entry_id for entry_id, _ in entries]
+        pipe.xack(self.STREAM_KEY, self.GROUP, *ids)
+        pipe.xdel(self.STREAM_KEY, *ids)
+        await pipe.execute()
+
+    async def ack(self, ids: List[str]) -> None:
+        if not ids:
+            return
+        redis = await self.get_aioredis()
+        pipe = redis.pipeline(transaction=True)
+        pipe.xack(self.STREAM_KEY, self.GROUP, *ids)
+        pipe.xdel(self.STREAM_KEY, *ids)
+        await pipe.execute()
+
+    async def size(self) -> int:
+        redis = await self.get_aioredis()
+        return await redis.xlen(self.STREAM_KEY)
@@ -0,0 +1,60 @@
+# policy_manager.py
+from typing import Dict, Tuple
+
+from redis.asyncio.client import PubSub
+
+from claude_auditlimit_python.redis_manager.base_redis_manager import BaseRedisManager
+
+
+class PolicyManager(BaseRedisManager):
+    """
+    Limit tiers and api key assignments, stored as two hashes:
+    ``policy:tiers`` (tier name -> JSON spec) and ``policy:keys``
+    (api key -> tier name). Every change is announced on ``policy:updates``
+    so workers reload without a restart.
+    """
+
+    TIERS_KEY = "policy:tiers"
+    KEYS_KEY = "policy:keys"
+    UPDATES_CHANNEL = "policy:updates"
+
+    async def load(self) -> Tuple[Dict[str, str], Dict[str, str]]:
+        """Return (tier name -> JSON spec, api key -> tier name)."""
+        redis = await self.get_aioredis()
+        pipe = redis.pipeline(transaction=True)
+        pipe.hgetall(self.TIERS_KEY)
+        pipe.hgetall(self.KEYS_KEY)
+        tiers, assignments = await pipe.execute()
+        return tiers, assignments
+
+    async def set_tier(self, name: str, spec: str) -> None:
+        redis = await self.get_aioredis()
+        await redis.hset(self.TIERS_KEY, name, spec)
+        await self.publish_update()
+
+    async def delete_tier(self, name: str) -> bool:
+        redis = await self.get_aioredis()
+        removed = await redis.hdel(self.TIERS_KEY, name)
+        await self.publish_update()
+        return removed > 0
+
+    async def assign(self, api_key: str, tier: str) -> None:
+        redis = await self.get_aioredis()
+        await redis.hset(self.KEYS_KEY, api_key, tier)
+        await self.publish_update()
+
+    async def unassign(self, api_key: str) -> bool:
+        redis = await self.get_aioredis()
+        removed = await redis.hdel(self.KEYS_KEY, api_key)
+        await self.publish_update()
+        return removed > 0
+
+    async def publish_update(self) -> None:
+        redis = await self.get_aioredis()
+        await redis.publish(self.UPDATES_CHANNEL, "reload")
+
+    async def subscribe(self) -> PubSub:
+        redis = await self.get_aioredis()
+        pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(self.UPDATES_CHANNEL)
+        return pubsub
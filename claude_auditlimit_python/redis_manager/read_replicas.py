@@ -0,0 +1,126 @@
+# read_replicas.py
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+from redis.asyncio import Redis
+from redis.asyncio.sentinel import Sentinel
+
+from claude_auditlimit_python import metrics
+from claude_auditlimit_python.configs import (
+    REDIS_DB,
+    REDIS_REPLICA_CHECK_INTERVAL_SECONDS,
+    REDIS_REPLICA_DISCOVERY_INTERVAL_SECONDS,
+    REDIS_REPLICA_MAX_LAG_SECONDS,
+    REDIS_REPLICAS,
+    REDIS_SENTINEL_SERVICE,
+    REDIS_SENTINELS,
+    REDIS_SHARDS,
+    REDIS_SOCKET_CONNECT_TIMEOUT_SECONDS,
+)
+from claude_auditlimit_python.redis_manager.redis_pool import RedisPool, _parse_node
+
+
+class ReadReplicas:
+    """
+    Replicas of the primary for read-only admin and statistics calls.
+
+    Replicas come from ``REDIS_REPLICAS`` and, if ``REDIS_SENTINELS`` is set,
+    from Sentinel discovery of ``REDIS_SENTINEL_SERVICE``. A replica is used
+    only while its link to the primary is up and it heard from the primary
+    within ``REDIS_REPLICA_MAX_LAG_SECONDS``; the result of that check is
+    cached per replica. ``get_client`` returns None when no replica is fresh,
+    and callers fall back to the primary.
+
+    Not used together with ``REDIS_SHARDS``: reads then stay on the shard
+    primaries.
+    """
+
+    _nodes: List[Tuple[str, int]] = [_parse_node(node) for node in REDIS_REPLICAS]
+    _sentinel: Optional[Sentinel] = None
+    _discovered: List[Tuple[str, int]] = []
+    _discovered_at = 0.0
+    # node -> (检查时间, 是否可用)
+    _fresh: Dict[Tuple[str, int], Tuple[float, bool]] = {}
+    _next = 0
+
+    @staticmethod
+    def enabled() -> bool:
+        return bool(REDIS_REPLICAS or REDIS_SENTINELS) and not REDIS_SHARDS
+
+    @classmethod
+    async def _discover(cls) -> List[Tuple[str, int]]:
+        if not REDIS_SENTINELS:
+            return []
+        now = time.monotonic()
+        if now - cls._discovered_at < REDIS_REPLICA_DISCOVERY_INTERVAL_SECONDS:
+            return cls._discovered
+        cls._discovered_at = now
+        if cls._sentinel is None:
+            cls._sentinel = Sentinel(
+                [_parse_node(node) for node in REDIS_SENTINELS],
+                socket_timeout=REDIS_SOCKET_CONNECT_TIMEOUT_SECONDS,
+            )
+        try:
+            cls._discovered = [
+                (host, int(port))
+                for host, port in await cls._sentinel.discover_slaves(
+                    REDIS_SENTINEL_SERVICE
+                )
+            ]
+        except Exception as e:
+            # 沿用上一次的结果
+            logger.warning(f"Sentinel replica discovery failed: {e}")
+        return cls._discovered
+
+    @staticmethod
+    async def _check(client: Redis) -> bool:
+        try:
+            info = await asyncio.wait_for(
+                client.info("replication"), REDIS_SOCKET_CONNECT_TIMEOUT_SECONDS
+            )
+        except Exception as e:
+            logger.debug(f"Replica check failed: {e}")
+            return False
+        last_io = int(info.get("master_last_io_seconds_ago", -1))
+        return (
+            info.get("role") == "slave"
+            and info.get("master_link_status") == "up"
+            and not int(info.get("master_sync_in_progress", 0))
+            and 0 <= last_io <= REDIS_REPLICA_MAX_LAG_SECONDS
+        )
+
+    @classmethod
+    async def _is_fresh(cls, node: Tuple[str, int], client: Redis) -> bool:
+        now = time.monotonic()
+        checked = cls._fresh.get(node)
+        if checked is None or now - checked[0] >= REDIS_REPLICA_CHECK_INTERVAL_SECONDS:
+            checked = cls._fresh[node] = (now, await cls._check(client))
+        return checked[1]
+
+    @classmethod
+    async def get_client(cls, db: int = REDIS_DB) -> Optional[Redis]:
+        """A fresh replica, rotating between replicas, or None."""
+        if not cls.enabled():
+            return None
+        nodes = list(dict.fromkeys(cls._nodes + await cls._discover()))
+        for offset in range(len(nodes)):
+            node = nodes[(cls._next + offset) % len(nodes)]
+            client = RedisPool._node_client(node[0], node[1], db)
+            if await cls._is_fresh(node, client):
+                cls._next = (cls._next + offset + 1) % len(nodes)
+                metrics.incr("redis_replica_reads")
+                return client
+        metrics.incr("redis_replica_fallbacks")
+        return None
+
+    @classmethod
+    def stats(cls) -> Dict[str, int]:
+        return {
+            "known": len(cls._fresh),
+            "fresh": sum(1 for _, fresh in cls._fresh.values() if fresh),
+        }
+
+
+metrics.register_gauge("redis_replicas", ReadReplicas.stats)
@@ -0,0 +1,191 @@
+# redis_pool.py
+import socket
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+from redis.asyncio import BlockingConnectionPool, Redis
+from redis.asyncio.connection import Connection, UnixDomainSocketConnection
+from redis.utils import HIREDIS_AVAILABLE
+
+from claude_auditlimit_python import metrics
+from claude_auditlimit_python.configs import (
+    REDIS_DB,
+    REDIS_HEALTH_CHECK_INTERVAL_SECONDS,
+    REDIS_HOST,
+    REDIS_POOL_MAX_CONNECTIONS,
+    REDIS_POOL_TIMEOUT_SECONDS,
+    REDIS_PORT,
+    REDIS_PROTOCOL,
+    REDIS_SHARDS,
+    REDIS_SOCKET_CONNECT_TIMEOUT_SECONDS,
+    REDIS_SOCKET_KEEPALIVE_COUNT,
+    REDIS_SOCKET_KEEPALIVE_IDLE_SECONDS,
+    REDIS_SOCKET_KEEPALIVE_INTERVAL_SECONDS,
+    REDIS_SOCKET_TIMEOUT_SECONDS,
+    REDIS_UNIX_SOCKET,
+)
+from claude_auditlimit_python.redis_manager.keyspace import HashRing
+
+
+def _keepalive_options() -> Dict[int, int]:
+    # TCP_KEEPIDLE 等选项只在部分平台上存在
+    options = {}
+    for name, value in (
+        ("TCP_KEEPIDLE", REDIS_SOCKET_KEEPALIVE_IDLE_SECONDS),
+        ("TCP_KEEPINTVL", REDIS_SOCKET_KEEPALIVE_INTERVAL_SECONDS),
+        ("TCP_KEEPCNT", REDIS_SOCKET_KEEPALIVE_COUNT),
+    ):
+        if hasattr(socket, name):
+            options[getattr(socket, name)] = value
+    return options
+
+
+def _parse_node(node: str) -> Tuple[str, int]:
+    host, _, port = node.rpartition(":")
+    return host, int(port)
+
+
+class RedisPool:
+    """
+    Process-wide Redis clients, one blocking connection pool per
+    ``(host, port, db)``, shared by every BaseRedisManager subclass.
+
+    Clients are created synchronously on first use, so concurrent first calls
+    cannot build two pools. ``start`` creates the default pool and checks the
+    connection at startup; ``shutdown`` closes every pool.
+
+    With ``REDIS_SHARDS`` set, ``shard_key`` (an api key) picks the node on a
+    consistent-hash ring and calls without a shard key go to the first node.
+    """
+
+    _clients: Dict[Tuple[str, int, int], Redis] = {}
+    _ring: Optional[HashRing] = HashRing(REDIS_SHARDS) if REDIS_SHARDS else None
+
+    @staticmethod
+    def shard_node(
+        shard_key: Optional[str] = None,
+        host: str = REDIS_HOST,
+        port: int = REDIS_PORT,
+    ) -> Tuple[str, int]:
+        ring = RedisPool._ring
+        if ring is None:
+            return host, port
+        if shard_key is None:
+            return _parse_node(ring.nodes[0])
+        return _parse_node(ring.get_node(shard_key))
+
+    @staticmethod
+    def shard_nodes(
+        host: str = REDIS_HOST, port: int = REDIS_PORT
+    ) -> List[Tuple[str, int]]:
+        ring = RedisPool._ring
+        if ring is None:
+            return [(host, port)]
+        return [_parse_node(node) for node in ring.nodes]
+
+    @staticmethod
+    def create_pool(
+        host: str = REDIS_HOST,
+        port: int = REDIS_PORT,
+        db: int = REDIS_DB,
+        max_connections: int = REDIS_POOL_MAX_CONNECTIONS,
+        decode_responses: bool = True,
+    ) -> BlockingConnectionPool:
+        kwargs = dict(
+            db=db,
+            max_connections=max_connections,
+            timeout=REDIS_POOL_TIMEOUT_SECONDS,
+            socket_timeout=REDIS_SOCKET_TIMEOUT_SECONDS,
+            socket_connect_timeout=REDIS_SOCKET_CONNECT_TIMEOUT_SECONDS,
+            health_check_interval=REDIS_HEALTH_CHECK_INTERVAL_SECONDS,
+            protocol=REDIS_PROTOCOL,
+            decode_responses=decode_responses,
+        )
+        if (
+            REDIS_UNIX_SOCKET
+            and not REDIS_SHARDS
+            and (host, port) == (REDIS_HOST, REDIS_PORT)
+        ):
+            return BlockingConnectionPool(
+                connection_class=UnixDomainSocketConnection,
+                path=REDIS_UNIX_SOCKET,
+                **kwargs,
+            )
+        return BlockingConnectionPool(
+            connection_class=Connection,
+            host=host,
+            port=port,
+            socket_keepalive=True,
+            socket_keepalive_options=_keepalive_options(),
+            **kwargs,
+        )
+
+    @staticmethod
+    def get_client(
+        host: str = REDIS_HOST,
+        port: int = REDIS_PORT,
+        db: int = REDIS_DB,
+        shard_key: Optional[str] = None,
+    ) -> Redis:
+        host, port = RedisPool.shard_node(shard_key, host, port)
+        return RedisPool._node_client(host, port, db)
+
+    @staticmethod
+    def _node_client(host: str, port: int, db: int) -> Redis:
+        key = (host, port, db)
+        client = RedisPool._clients.get(key)
+        if client is None:
+            pool = RedisPool.create_pool(host, port, db)
+            client = RedisPool._clients[key] = Redis(connection_pool=pool)
+        return client
+
+    @staticmethod
+    def get_all_clients(
+        host: str = REDIS_HOST, port: int = REDIS_PORT, db: int = REDIS_DB
+    ) -> List[Redis]:
+        return [
+            RedisPool._node_client(node_host, node_port, db)
+            for node_host, node_port in RedisPool.shard_nodes(host, port)
+        ]
+
+    @staticmethod
+    def stats() -> Dict[str, int]:
+        # redis-py 没有公开连接池的使用情况, 这里读取内部的连接列表
+        in_use = available = max_connections = 0
+        for client in RedisPool._clients.values():
+            pool = client.connection_pool
+            in_use += len(pool._in_use_connections)
+            available += len(pool._available_connections)
+            max_connections += pool.max_connections
+        return {
+            "pools": len(RedisPool._clients),
+            "in_use": in_use,
+            "idle": available,
+            "max": max_connections,
+        }
+
+    @staticmethod
+    async def start():
+        for client in RedisPool.get_all_clients():
+            kwargs = client.connection_pool.connection_kwargs
+            target = kwargs.get("path") or f"{kwargs.get('host')}:{kwargs.get('port')}"
+            try:
+                await client.ping()
+                logger.info(
+                    f"Redis pool ready: {target}/{REDIS_DB}, "
+                    f"max {REDIS_POOL_MAX_CONNECTIONS} connections, RESP{REDIS_PROTOCOL}, "
+                    f"{'hiredis' if HIREDIS_AVAILABLE else 'python'} parser"
+                )
+            except Exception as e:
+                # 不阻止启动, 请求路径上由熔断器处理
+                logger.error(f"Redis not reachable at startup ({target}): {e}")
+
+    @staticmethod
+    async def shutdown():
+        clients = list(RedisPool._clients.values())
+        RedisPool._clients.clear()
+        for client in clients:
+            await client.connection_pool.disconnect()
+
+
+metrics.register_gauge("redis_pool", RedisPool.stats)
@@ -1,35 +1,123 @@
+import asyncio
 import json
 from datetime import datetime
 import time
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
+from loguru import logger
 from pydantic import BaseModel
-from claude_auditlimit_python.configs import REDIS_PORT, REDIS_HOST, REDIS_DB
+from redis.exceptions import RedisError, ResponseError
+from claude_auditlimit_python.configs import (
+    REDIS_PORT,
+    REDIS_HOST,
+    REDIS_DB,
+    TOKEN_USAGE_COMPACT_AFTER_SECONDS,
+    TOKEN_USAGE_COMPACTION_BATCH_SIZE,
+    TOKEN_USAGE_IDLE_TTL_SECONDS,
+)
 from claude_auditlimit_python.redis_manager.base_redis_manager import BaseRedisManager
+from claude_auditlimit_python.redis_manager.keyspace import (
+    identifier_from_key,
+    key_tag,
+    pattern_parts,
+)
+from claude_auditlimit_python.redis_manager.usage_manager import UsageManager
+from claude_auditlimit_python.redis_manager.usage_record_manager import (
+    UsageRecordManager,
+)
+
+
+# notify 记账: 按顺序累加对话计数, 用量累加每次累加后的对话总量; 一个 key 一次执行
+# KEYS[1]: 对话计数 hash, KEYS[2]: 最后活跃时间 zset
+# KEYS[3..7]: token 用量 total, 3h, 12h, 24h, 1w, KEYS[8]: 按小时汇总 hash
+# ARGV: 对话过期时间, 当前时间, 4 个周期的过期时间, 当前小时序号,
+#       用量历史的过期时间, 之后每个增量 (conversation_uuid, tokens)
+# 返回用量的增量
+CHARGE_CONVERSATIONS_SCRIPT = """
+local usage = 0
+for i = 9, #ARGV, 2 do
+    usage = usage + redis.call('HINCRBY', KEYS[1], ARGV[i], ARGV[i + 1])
+    redis.call('ZADD', KEYS[2], ARGV[2], ARGV[i])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+redis.call('INCRBY', KEYS[3], usage)
+for i = 1, 4 do
+    redis.call('INCRBY', KEYS[3 + i], usage)
+    redis.call('EXPIRE', KEYS[3 + i], ARGV[2 + i])
+end
+redis.call('HINCRBY', KEYS[8], ARGV[7], usage)
+redis.call('EXPIRE', KEYS[8], ARGV[8])
+return usage
+"""
+
+
+# 把空闲的对话计数合并进聚合字段
+# KEYS[1]: 对话计数 hash, KEYS[2]: 最后活跃时间 zset
+# ARGV[1]: 截止时间戳, ARGV[2]: 聚合字段名
+COMPACT_CONVERSATIONS_SCRIPT = """
+local idle = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+local total = 0
+local payload_bytes = 0
+for _, uuid in ipairs(idle) do
+    local value = redis.call('HGET', KEYS[1], uuid)
+    if value then
+        total = total + tonumber(value)
+        payload_bytes = payload_bytes + #uuid + #value
+        redis.call('HDEL', KEYS[1], uuid)
+    end
+    redis.call('ZREM', KEYS[2], uuid)
+end
+if total > 0 then
+    redis.call('HINCRBY', KEYS[1], ARGV[2], total)
+end
+return {#idle, payload_bytes}
+"""
+
+
+class CompactionReport(BaseModel):
+    apikeys: int = 0
+    conversations_compacted: int = 0
+    legacy_keys_migrated: int = 0
+    bytes_reclaimed: int = 0
 
 
 class TokenUsageManager(BaseRedisManager):
+    """
+    Per-conversation token counters.
+
+    Each apikey owns one hash ``token_usage:{apikey}`` (uuid -> tokens) and a
+    zset ``token_usage_seen:{apikey}`` (uuid -> last increment time). Both keys
+    expire after ``TOKEN_USAGE_IDLE_TTL_SECONDS`` without increments, and
+    ``compact`` rolls conversations idle for ``TOKEN_USAGE_COMPACT_AFTER_SECONDS``
+    (never less than the TTL) into the ``_compacted`` field of the hash, which
+    the reads leave out.
+    """
+
+    COMPACTED_FIELD = "_compacted"
+
     def __init__(self, host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB):
         super().__init__(host, port, db)
 
-    def _get_redis_key(self, apikey: str, uuid: str) -> str:
-        """Generate Redis key for storing token usage"""
+    def _get_redis_key(self, apikey: str) -> str:
+        """Generate Redis key for the conversation counters hash"""
+        return f"token_usage:{key_tag(apikey)}"
+
+    def _get_seen_key(self, apikey: str) -> str:
+        """Generate Redis key for the conversation last-seen zset"""
+        return f"token_usage_seen:{key_tag(apikey)}"
+
+    def _get_legacy_redis_key(self, apikey: str, uuid: str) -> str:
+        """Key layout used before conversations were stored in a hash"""
         return f"token_usage:{apikey}:{str(uuid)}"
 
     async def get_token_usage(self, apikey: str, uuid: str) -> int:
         """
         Get token usage for specific apikey and uuid.
-        If not exists, creates new entry with value 0.
+        Returns 0 if the conversation has no counter yet.
         """
-        redis = await self.get_aioredis()
-        key = self._get_redis_key(apikey, uuid)
-
-        value = await redis.get(key)
-        if value is None:
-            # Key doesn't exist, create new with value 0
-            await redis.set(key, 0)
-            return 0
-
-        return int(value)
+        redis = await self.get_aioredis(apikey)
+        value = await redis.hget(self._get_redis_key(apikey), str(uuid))
+        return int(value) if value else 0
 
     async def increment_token_usage(
         self, apikey: str, uuid: str, increment: int = 1
@@ -38,19 +126,118 @@ class TokenUsageManager(BaseRedisManager):
         Increment token usage for specific apikey and uuid by given amount.
         Returns new value after increment.
         """
-        redis = await self.get_aioredis()
-        key = self._get_redis_key(apikey, uuid)
+        redis = await self.get_aioredis(apikey)
+        key = self._get_redis_key(apikey)
+        seen_key = self._get_seen_key(apikey)
+
+        pipe = redis.pipeline(transaction=True)
+        pipe.hincrby(key, str(uuid), increment)
+        pipe.zadd(seen_key, {str(uuid): int(time.time())})
+        pipe.expire(key, TOKEN_USAGE_IDLE_TTL_SECONDS)
+        pipe.expire(seen_key, TOKEN_USAGE_IDLE_TTL_SECONDS)
+        results = await pipe.execute()
+        return results[0]
+
+    async def charge_conversations(
+        self, increments: List[Tuple[str, str, int, int]]
+    ) -> List[bool]:
+        """
+        Apply ``(apikey, uuid, tokens, requests)`` increments in order: the
+        conversation counter grows by its tokens, the key's token usage by the
+        resulting conversation total and its request count by ``requests``.
 
-        # Check if key exists
-        exists = await redis.exists(key)
-        if not exists:
-            # Key doesn't exist, set initial value
-            await redis.set(key, increment)
-            return increment
+        Each shard applies its increments in one MULTI of per-key scripts, so
+        a shard is charged completely or not at all. Returns, per increment,
+        whether its shard was charged; a failed shard is logged, not raised.
+        """
+        if not increments:
+            return []
+        now = int(time.time())
+        usage_manager = UsageManager()
+        record_manager = UsageRecordManager()
+        hour = usage_manager.hour_bucket(now)
+        periods = [UsageManager.PERIOD_TOTAL] + [
+            period for period, _ in UsageManager.PERIOD_EXPIRY
+        ]
+        head = [
+            TOKEN_USAGE_IDLE_TTL_SECONDS,
+            now,
+            *(expiry for _, expiry in UsageManager.PERIOD_EXPIRY),
+            hour,
+            UsageManager.HISTORY_EXPIRY,
+        ]
+
+        async def apply(redis, shard_increments):
+            groups: Dict[str, List] = {}
+            requests: Dict[str, int] = {}
+            for apikey, uuid, tokens, count in shard_increments:
+                groups.setdefault(apikey, []).extend((str(uuid), tokens))
+                requests[apikey] = requests.get(apikey, 0) + count
+            script = redis.register_script(CHARGE_CONVERSATIONS_SCRIPT)
+            try:
+                pipe = redis.pipeline(transaction=True)
+                for apikey, args in groups.items():
+                    keys = [
+                        self._get_redis_key(apikey),
+                        self._get_seen_key(apikey),
+                        *(usage_manager._get_redis_key(apikey, p) for p in periods),
+                        usage_manager._get_history_key(
+                            apikey, UsageManager.RESOLUTION_HOUR
+                        ),
+                    ]
+                    await script(keys=keys, args=head + args, client=pipe)
+                # 请求次数与 token 在同一个 MULTI 里记账
+                for apikey, count in requests.items():
+                    if count:
+                        record_manager._queue_increment(pipe, apikey, count, hour)
+                usage = (await pipe.execute())[: len(groups)]
+            except RedisError as e:
+                logger.error(f"Failed to charge conversations: {e}")
+                return [False] * len(shard_increments)
+            await asyncio.gather(
+                usage_manager.increment_top(redis, list(zip(groups, usage)), hour),
+                record_manager.increment_top(redis, list(requests.items()), hour),
+            )
+            return [True] * len(shard_increments)
+
+        return await self.map_shards(increments, lambda item: item[0], apply)
 
-        # Increment existing value
-        new_value = await redis.incrby(key, increment)
-        return new_value
+    async def correct_conversations(
+        self, corrections: List[Tuple[str, str, int]]
+    ) -> List[bool]:
+        """
+        Apply ``(apikey, uuid, delta)`` corrections of an earlier charge: both
+        the conversation counter and the key's token usage grow by ``delta``
+        (which may be negative). Atomic per shard like ``charge_conversations``.
+        """
+        if not corrections:
+            return []
+        now = int(time.time())
+        usage_manager = UsageManager()
+        hour = usage_manager.hour_bucket(now)
+
+        async def apply(redis, shard_corrections):
+            deltas: Dict[str, int] = {}
+            try:
+                pipe = redis.pipeline(transaction=True)
+                for apikey, uuid, delta in shard_corrections:
+                    key = self._get_redis_key(apikey)
+                    seen_key = self._get_seen_key(apikey)
+                    pipe.hincrby(key, str(uuid), delta)
+                    pipe.zadd(seen_key, {str(uuid): now})
+                    pipe.expire(key, TOKEN_USAGE_IDLE_TTL_SECONDS)
+                    pipe.expire(seen_key, TOKEN_USAGE_IDLE_TTL_SECONDS)
+                    deltas[apikey] = deltas.get(apikey, 0) + delta
+                for apikey, delta in deltas.items():
+                    usage_manager._queue_increment(pipe, apikey, delta, hour)
+                await pipe.execute()
+            except RedisError as e:
+                logger.error(f"Failed to correct conversations: {e}")
+                return [False] * len(shard_corrections)
+            await usage_manager.increment_top(redis, list(deltas.items()), hour)
+            return [True] * len(shard_corrections)
+
+        return await self.map_shards(corrections, lambda item: item[0], apply)
 
     async def get_all_token_usage(
         self, apikey: Optional[str] = None
@@ -64,43 +251,160 @@ class TokenUsageManager(BaseRedisManager):
         - When apikey provided: Dict[uuid_str, usage_count]
         - When apikey is None: Dict[apikey, Dict[uuid_str, usage_count]]
         """
-        redis = await self.get_aioredis()
-
         if apikey:
-            # Get usage for specific apikey
-            pattern = f"token_usage:{apikey}:*"
-            keys = await redis.keys(pattern)
-
-            result = {}
-            for key in keys:
-                # Split key into components
-                if isinstance(key, bytes):
-                    key = key.decode()
-                uuid_str = key.split(":")[-1]
-                value = await redis.get(key)
-                result[uuid_str] = int(value) if value else 0
-
-            return result
+            redis = await self.get_read_aioredis(apikey)
+            values = await redis.hgetall(self._get_redis_key(apikey))
+            return self._conversation_usage(values)
+
+        prefix, suffix = pattern_parts(self._get_redis_key("*"))
+        result = {}
+        for key in await self.scan_all(
+            f"{prefix}*{suffix}", read_only=True, _type="hash"
+        ):
+            current_apikey = identifier_from_key(key, prefix, suffix)
+            redis = await self.get_read_aioredis(current_apikey)
+            values = await redis.hgetall(key)
+            result[current_apikey] = self._conversation_usage(values)
+        return result
+
+    def _conversation_usage(self, values: Dict[str, str]) -> Dict[str, int]:
+        # 聚合字段不是对话
+        return {
+            uuid_str: int(value)
+            for uuid_str, value in values.items()
+            if uuid_str != self.COMPACTED_FIELD
+        }
+
+    async def _memory_usage(self, redis, keys: List[str]) -> Optional[int]:
+        """Sum of MEMORY USAGE for keys, or None if the server lacks the command."""
+        pipe = redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.memory_usage(key)
+        try:
+            results = await pipe.execute()
+        except ResponseError:
+            return None
+        return sum(result or 0 for result in results)
+
+    async def _migrate_legacy_batch(
+        self, redis, keys: List[str], report: CompactionReport
+    ) -> None:
+        pipe = redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.get(key)
+        values = await pipe.execute()
+        memory = await self._memory_usage(redis, keys)
+
+        now = int(time.time())
+        migrated = []
+        targets: Dict[int, Tuple] = {}
+        for key, value in zip(keys, values):
+            if value is None:
+                continue
+            migrated.append(key)
+            _, apikey, uuid = key.split(":", 2)
+            hash_key = self._get_redis_key(apikey)
+            seen_key = self._get_seen_key(apikey)
+            # 分片时 hash 可能在另一个节点上, 每个节点一个 MULTI
+            target = await self.get_aioredis(apikey)
+            if id(target) not in targets:
+                targets[id(target)] = (target, target.pipeline(transaction=True))
+            _, target_pipe = targets[id(target)]
+            target_pipe.hincrby(hash_key, uuid, int(value))
+            target_pipe.zadd(seen_key, {uuid: now}, nx=True)
+            target_pipe.expire(hash_key, TOKEN_USAGE_IDLE_TTL_SECONDS)
+            target_pipe.expire(seen_key, TOKEN_USAGE_IDLE_TTL_SECONDS)
+            if not memory:
+                report.bytes_reclaimed += len(key) + len(value)
+        if not migrated:
+            return
+        await asyncio.gather(*(pipe.execute() for _, pipe in targets.values()))
+        # 写入 hash 之后才删除旧 key
+        await redis.delete(*migrated)
+
+        report.legacy_keys_migrated += len(migrated)
+        if memory:
+            report.bytes_reclaimed += memory
+
+    async def _migrate_legacy_keys(self, redis, report: CompactionReport) -> None:
+        """Fold ``token_usage:{apikey}:{uuid}`` string keys into the hashes."""
+        batch = []
+        async for key in redis.scan_iter(
+            match="token_usage:*:*",
+            count=TOKEN_USAGE_COMPACTION_BATCH_SIZE,
+            _type="string",
+        ):
+            batch.append(key)
+            if len(batch) >= TOKEN_USAGE_COMPACTION_BATCH_SIZE:
+                await self._migrate_legacy_batch(redis, batch, report)
+                batch = []
+        if batch:
+            await self._migrate_legacy_batch(redis, batch, report)
+
+    async def _compact_batch(
+        self, redis, apikeys: List[str], cutoff: int, report: CompactionReport
+    ) -> None:
+        keys = [
+            key
+            for apikey in apikeys
+            for key in (self._get_redis_key(apikey), self._get_seen_key(apikey))
+        ]
+        memory_before = await self._memory_usage(redis, keys)
+
+        script = redis.register_script(COMPACT_CONVERSATIONS_SCRIPT)
+        pipe = redis.pipeline(transaction=False)
+        for apikey in apikeys:
+            await script(
+                keys=[self._get_redis_key(apikey), self._get_seen_key(apikey)],
+                args=[cutoff, self.COMPACTED_FIELD],
+                client=pipe,
+            )
+        results = await pipe.execute()
+
+        compacted = sum(result[0] for result in results)
+        payload_bytes = sum(result[1] for result in results)
+        report.apikeys += len(apikeys)
+        report.conversations_compacted += compacted
+
+        memory_after = await self._memory_usage(redis, keys)
+        if memory_before is not None and memory_after is not None:
+            report.bytes_reclaimed += max(memory_before - memory_after, 0)
         else:
-            # Get usage for all apikeys
-            pattern = "token_usage:*"
-            keys = await redis.keys(pattern)
-
-            result = {}
-            for key in keys:
-                # Split key into components
-                if isinstance(key, bytes):
-                    key = key.decode()
-                key_parts = key.split(":")
-                if len(key_parts) == 3:  # Ensure key format is correct
-                    current_apikey = key_parts[1]
-                    uuid_str = key_parts[2]
-
-                    # Initialize dict for apikey if not exists
-                    if current_apikey not in result:
-                        result[current_apikey] = {}
-
-                    value = await redis.get(key)
-                    result[current_apikey][uuid_str] = int(value) if value else 0
-
-            return result
+            report.bytes_reclaimed += payload_bytes
+
+    async def _compact_shard(self, redis, cutoff: int, report: CompactionReport):
+        await self._migrate_legacy_keys(redis, report)
+
+        prefix, suffix = pattern_parts(self._get_seen_key("*"))
+        batch = []
+        async for seen_key in redis.scan_iter(
+            match=f"{prefix}*{suffix}", count=TOKEN_USAGE_COMPACTION_BATCH_SIZE
+        ):
+            batch.append(identifier_from_key(seen_key, prefix, suffix))
+            if len(batch) >= TOKEN_USAGE_COMPACTION_BATCH_SIZE:
+                await self._compact_batch(redis, batch, cutoff, report)
+                batch = []
+        if batch:
+            await self._compact_batch(redis, batch, cutoff, report)
+
+    async def compact(self) -> CompactionReport:
+        """
+        Migrate legacy per-conversation keys, then roll conversations idle for
+        longer than ``TOKEN_USAGE_COMPACT_AFTER_SECONDS`` into each apikey's
+        aggregate field. Shards are compacted in parallel.
+        """
+        report = CompactionReport()
+        # 合并后的对话恢复时从 0 计数; 只合并已经过了过期时间、不会再被恢复的对话
+        idle_seconds = max(
+            TOKEN_USAGE_COMPACT_AFTER_SECONDS, TOKEN_USAGE_IDLE_TTL_SECONDS
+        )
+        cutoff = int(time.time()) - idle_seconds
+        await asyncio.gather(
+            *(
+                self._compact_shard(redis, cutoff, report)
+                for redis in self.get_all_aioredis()
+            )
+        )
+
+        logger.info(f"Token usage compaction finished: {report.model_dump()}")
+        return report
@@ -2,11 +2,26 @@
 import json
 from datetime import datetime
 import time
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
+from loguru import logger
 from pydantic import BaseModel
+from redis.exceptions import RedisError
 
-from claude_auditlimit_python.configs import REDIS_PORT, REDIS_HOST, REDIS_DB
+from claude_auditlimit_python import metrics
+
+from claude_auditlimit_python.configs import (
+    HISTORY_DAILY_RETENTION_DAYS,
+    HISTORY_DAY_OFFSET_HOURS,
+    REDIS_DB,
+    REDIS_HOST,
+    REDIS_PORT,
+)
 from claude_auditlimit_python.redis_manager.base_redis_manager import BaseRedisManager
+from claude_auditlimit_python.redis_manager.keyspace import (
+    identifier_from_key,
+    key_tag,
+    pattern_parts,
+)
 
 
 class TokenUsageStats(BaseModel):
@@ -25,40 +40,113 @@ class UsageManager(BaseRedisManager):
     PERIOD_WEEK = "1w"
     PERIOD_TOTAL = "total"
 
+    # 各时间窗口及其过期时间
+    PERIOD_EXPIRY = [
+        (PERIOD_3HOURS, 3 * 3600),
+        (PERIOD_12HOURS, 12 * 3600),
+        (PERIOD_24HOURS, 24 * 3600),
+        (PERIOD_WEEK, 7 * 24 * 3600),
+    ]
+
+    # 用量历史的粒度, 以及每个小时/天的 top-K zset 的前缀
+    RESOLUTION_HOUR = "hourly"
+    RESOLUTION_DAY = "daily"
+    TOP_PREFIX = "token_top"
+    HISTORY_EXPIRY = HISTORY_DAILY_RETENTION_DAYS * 24 * 3600
+
     def __init__(self, host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB):
         super().__init__(host, port, db)
 
     def _get_redis_key(self, token: str, period: str) -> str:
-        return f"token:{token}:{period}"
+        return f"token:{key_tag(token)}:{period}"
 
-    async def increment_token_usage(self, token: str, count: int = 1) -> None:
-        redis = await self.get_aioredis()
+    def _get_history_key(self, token: str, resolution: str) -> str:
+        # hash: 小时 (或天) 序号 -> 用量, 例如 token:sk-x:hourly
+        return self._get_redis_key(token, resolution)
+
+    def _get_top_key(self, resolution: str, bucket: int) -> str:
+        # zset: api key -> 该小时 (或天) 的用量; 分片时每个节点只有自己的 key
+        # 所有 key 共用, 不在任何 api key 的 slot 里, 只能在脚本和 MULTI 之外单独写入
+        return f"{self.TOP_PREFIX}:{resolution}:{bucket}"
+
+    @staticmethod
+    def hour_bucket(timestamp: float) -> int:
+        return int(timestamp // 3600)
 
+    @staticmethod
+    def day_bucket(hour: int) -> int:
+        return (hour + HISTORY_DAY_OFFSET_HOURS) // 24
+
+    @staticmethod
+    def day_start_hour(day: int) -> int:
+        return day * 24 - HISTORY_DAY_OFFSET_HOURS
+
+    def _queue_increment(self, pipe, token: str, count: int, hour: int) -> None:
         # Increment total count
-        await redis.incrby(self._get_redis_key(token, self.PERIOD_TOTAL), count)
-
-        # For each limited time period, increment or create key with expiry
-        for period, expiry in [
-            (self.PERIOD_3HOURS, 3 * 3600),
-            (self.PERIOD_12HOURS, 12 * 3600),
-            (self.PERIOD_24HOURS, 24 * 3600),
-            (self.PERIOD_WEEK, 7 * 24 * 3600),
-        ]:
+        pipe.incrby(self._get_redis_key(token, self.PERIOD_TOTAL), count)
+
+        # For each limited time period, increment (creating the key if missing)
+        # and refresh its expiry
+        for period, expiry in self.PERIOD_EXPIRY:
             key = self._get_redis_key(token, period)
-            # Check if key exists
-            exists = await redis.exists(key)
-            if not exists:
-                # Key doesn't exist, set initial value and expire
-                # 使用 set 命令直接初始化值，并设置过期时间
-                await redis.set(key, count, ex=expiry)
-            else:
-                # Key exists, just increment
-                await redis.incrby(key, count)
-                # 确保有效期仍然存在（可选，如果希望更新过期时间）
-                await redis.expire(key, expiry)
+            pipe.incrby(key, count)
+            pipe.expire(key, expiry)
+
+        # 按小时汇总, 供 /usage_history 查询
+        history_key = self._get_history_key(token, self.RESOLUTION_HOUR)
+        pipe.hincrby(history_key, hour, count)
+        pipe.expire(history_key, self.HISTORY_EXPIRY)
+
+    async def increment_top(
+        self, redis, counts: List[Tuple[str, int]], hour: int
+    ) -> None:
+        """
+        Add ``(token, count)`` to the hourly top-K zset on ``redis``, in a
+        non-transactional pipeline of its own. Best effort: the counters are
+        already charged, so a failure is logged rather than raised.
+        """
+        top_key = self._get_top_key(self.RESOLUTION_HOUR, hour)
+        pipe = redis.pipeline(transaction=False)
+        for token, count in counts:
+            # 用量为 0 的 key 不写入, 否则会出现在 top-K 里
+            if count:
+                pipe.zincrby(top_key, count, token)
+        if not len(pipe):
+            return
+        pipe.expire(top_key, self.HISTORY_EXPIRY)
+        try:
+            await pipe.execute()
+        except RedisError as e:
+            metrics.incr("history_top_failed")
+            logger.warning(f"Failed to update {top_key}: {e}")
+
+    async def increment_token_usage(self, token: str, count: int = 1) -> None:
+        redis = await self.get_aioredis(token)
+        hour = self.hour_bucket(time.time())
+        pipe = redis.pipeline(transaction=True)
+        self._queue_increment(pipe, token, count, hour)
+        await pipe.execute()
+        await self.increment_top(redis, [(token, count)], hour)
+
+    async def increment_token_usage_batch(self, counts: Dict[str, int]) -> None:
+        """Apply increments for many tokens in a single round trip."""
+        if not counts:
+            return
+
+        hour = self.hour_bucket(time.time())
+
+        async def apply(redis, shard_counts):
+            pipe = redis.pipeline(transaction=True)
+            for token, count in shard_counts:
+                self._queue_increment(pipe, token, count, hour)
+            await pipe.execute()
+            await self.increment_top(redis, shard_counts, hour)
+            return [None] * len(shard_counts)
+
+        await self.map_shards(list(counts.items()), lambda item: item[0], apply)
 
     async def get_token_usage(self, token: str) -> TokenUsageStats:
-        redis = await self.get_aioredis()
+        redis = await self.get_read_aioredis(token)
 
         total_key = self._get_redis_key(token, self.PERIOD_TOTAL)
         total_val = await redis.get(total_key)
@@ -85,13 +173,17 @@ class UsageManager(BaseRedisManager):
             last_week=last_week,
         )
 
+    def _get_total_key_parts(self):
+        # 例如 "token:*:total" -> ("token:", ":total")
+        return pattern_parts(self._get_redis_key("*", self.PERIOD_TOTAL))
+
     async def get_all_token_usage(self) -> Dict[str, TokenUsageStats]:
-        redis = await self.get_aioredis()
-        keys = await redis.keys("token:*:total")
+        prefix, suffix = self._get_total_key_parts()
+        keys = await self.scan_all(f"{prefix}*{suffix}", read_only=True)
 
         result = {}
         for key in keys:
-            token = key[6:-6]  # Remove "token:" prefix and ":total" suffix
+            token = identifier_from_key(key, prefix, suffix)
             stats = await self.get_token_usage(token)
             result[token] = stats
 
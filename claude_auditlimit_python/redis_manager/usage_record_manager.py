@@ -1,6 +1,7 @@
 # usage_record_manager.py
 from typing import Dict
 
+from .keyspace import identifier_from_key, key_tag
 from .usage_manager import UsageManager, TokenUsageStats
 
 
@@ -11,9 +12,11 @@ class UsageStats(TokenUsageStats):
 
 
 class UsageRecordManager(UsageManager):
+    TOP_PREFIX = "usage_top"
+
     def _get_redis_key(self, identifier: str, period: str) -> str:
         # 只需要修改key前缀，从"token"改为"usage"
-        return f"usage:{identifier}:{period}"
+        return f"usage:{key_tag(identifier)}:{period}"
 
     # 可选：重命名方法使其更符合usage的语义
     async def increment_usage(self, identifier: str, count: int = 1) -> None:
@@ -24,13 +27,12 @@ class UsageRecordManager(UsageManager):
         return UsageStats(**stats.dict())
 
     async def get_all_usage(self) -> Dict[str, UsageStats]:
-        redis = await self.get_aioredis()
-        keys = await redis.keys("usage:*:total")
+        prefix, suffix = self._get_total_key_parts()
+        keys = await self.scan_all(f"{prefix}*{suffix}", read_only=True)
 
         result = {}
         for key in keys:
-            # Remove "usage:" prefix and ":total" suffix
-            identifier = key[6:-6]
+            identifier = identifier_from_key(key, prefix, suffix)
             stats = await self.get_usage(identifier)
             result[identifier] = stats
 
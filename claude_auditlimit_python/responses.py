@@ -0,0 +1,73 @@
+# responses.py
+# 根据 Accept 头返回 JSON 或 msgpack, 均由 msgspec 编码
+from contextvars import ContextVar
+
+import msgspec
+from fastapi import Request
+from starlette.responses import JSONResponse
+
+from claude_auditlimit_python.configs import RESPONSE_MSGPACK_ENABLED
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+_MSGPACK_ALIASES = (
+    MSGPACK_MEDIA_TYPE,
+    "application/x-msgpack",
+    "application/vnd.msgpack",
+)
+_JSON_RANGES = ("application/json", "application/*", "*/*")
+
+_wants_msgpack: ContextVar[bool] = ContextVar("wants_msgpack", default=False)
+_json_encoder = msgspec.json.Encoder()
+_msgpack_encoder = msgspec.msgpack.Encoder()
+
+
+def prefers_msgpack(accept: str) -> bool:
+    """True when ``accept`` ranks msgpack strictly above JSON."""
+    msgpack_q = json_q = 0.0
+    for media_range in accept.split(","):
+        media_type, *params = [part.strip() for part in media_range.split(";")]
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if media_type in _MSGPACK_ALIASES:
+            msgpack_q = max(msgpack_q, q)
+        elif media_type in _JSON_RANGES:
+            json_q = max(json_q, q)
+    return msgpack_q > json_q
+
+
+async def negotiate_response_format(request: Request) -> None:
+    """Router dependency: remember which format this request accepts."""
+    if RESPONSE_MSGPACK_ENABLED:
+        _wants_msgpack.set(prefers_msgpack(request.headers.get("accept", "")))
+
+
+class NegotiatedResponse(JSONResponse):
+    """
+    JSON encoded with msgspec, or msgpack when the request asked for it via
+    ``negotiate_response_format``. Output JSON matches JSONResponse.
+    """
+
+    def __init__(
+        self,
+        content=None,
+        status_code=200,
+        headers=None,
+        media_type=None,
+        background=None,
+    ):
+        if media_type is None and _wants_msgpack.get():
+            media_type = MSGPACK_MEDIA_TYPE
+        if RESPONSE_MSGPACK_ENABLED:
+            headers = {**(headers or {}), "Vary": "Accept"}
+        super().__init__(content, status_code, headers, media_type, background)
+
+    def render(self, content) -> bytes:
+        if self.media_type == MSGPACK_MEDIA_TYPE:
+            return _msgpack_encoder.encode(content)
+        return _json_encoder.encode(content)
@@ -1,22 +1,65 @@
 # router.py
 import json
-from json import JSONDecodeError
 from loguru import logger
-import re
+import msgspec
+from typing import List, Optional
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
 from fastapi import Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import Response, StreamingResponse
 from datetime import datetime
-from claude_auditlimit_python.configs import MAX_DEVICES, RATE_LIMIT, USAGE_RECORD_RATE_LIMIT
+from claude_auditlimit_python import metrics
+from claude_auditlimit_python.admission import (
+    AdmissionDecision,
+    AdmissionItem,
+    evaluate_admissions,
+    reconcile_estimated_usage,
+)
+from claude_auditlimit_python.configs import (
+    AUDIT_BATCH_MAX_ITEMS,
+    NOTIFY_DEDUPE_ENABLED,
+    NOTIFY_REQUEST_ID_HEADER,
+)
+from claude_auditlimit_python.debug import (
+    FORMAT_SPEEDSCOPE,
+    DebugBusyError,
+    profile_event_loop,
+    structure_sizes,
+    tracemalloc_diff,
+)
+from claude_auditlimit_python.export import (
+    MEDIA_TYPES,
+    export_chunks,
+    validate_export,
+)
+from claude_auditlimit_python.notify_queue import NotifyJob, NotifyQueue
 from claude_auditlimit_python.redis_manager.device_manager import DeviceManager
+from claude_auditlimit_python.redis_manager.export_manager import ExportManager
+from claude_auditlimit_python.redis_manager.notify_dedupe_manager import (
+    NotifyDedupeManager,
+)
 from claude_auditlimit_python.redis_manager.token_usage_manager import TokenUsageManager
 from claude_auditlimit_python.redis_manager.usage_manager import UsageManager
 from claude_auditlimit_python.redis_manager.usage_record_manager import UsageRecordManager
+from claude_auditlimit_python.responses import (
+    NegotiatedResponse,
+    negotiate_response_format,
+)
 from claude_auditlimit_python.utils.api_key_utils import remove_beamer
-from claude_auditlimit_python.utils.token_utils import get_token_length
-
-router = APIRouter()
+from claude_auditlimit_python.utils.log_utils import truncate_payload
+from claude_auditlimit_python.utils.request_utils import (
+    body_digest,
+    decode_audit_batch,
+    find_message_uuid,
+    get_conversation_uuid,
+)
+from claude_auditlimit_python.warmup import Warmup
+
+# 所有接口按 Accept 头返回 JSON 或 msgpack
+router = APIRouter(
+    default_response_class=NegotiatedResponse,
+    dependencies=[Depends(negotiate_response_format)],
+)
 
 
 @router.get("/")
@@ -24,60 +67,113 @@ async def _():
     return "Hi this is from claude audit limit python-version"
 
 
+@router.get("/ready")
+async def ready():
+    # 启动预热完成前返回 503, 供负载均衡的就绪探针使用
+    if not Warmup.is_ready():
+        return NegotiatedResponse(
+            content={"code": 1, "msg": "warming up", "data": Warmup.report()},
+            status_code=503,
+        )
+    return NegotiatedResponse(
+        content={"code": 0, "msg": "success", "data": Warmup.report()}
+    )
+
+
+def _notify_dedupe_id(
+    request: Request, kind: str, body: bytes, conversation_uuid: str
+) -> Optional[str]:
+    """
+    Request-id header, else the response's message uuid, else the document
+    digest within its conversation.
+    """
+    request_id = request.headers.get(NOTIFY_REQUEST_ID_HEADER)
+    if request_id:
+        return f"{kind}:id:{request_id}"
+    if kind == NotifyJob.KIND_RESPONSE:
+        message_uuid = find_message_uuid(body)
+        return f"{kind}:uuid:{message_uuid}" if message_uuid else None
+    # 同一个文件上传到另一个对话时需要再记一次账
+    return f"{kind}:body:{conversation_uuid}:{body_digest(body)}"
+
+
+async def _enqueue_notify(request: Request, kind: str) -> NegotiatedResponse:
+    """Hand the raw notify body to the accounting queue and return at once."""
+    api_key = remove_beamer(request.headers.get("Authorization", None))
+    body = await request.body()
+    conversation_uuid = get_conversation_uuid(request.headers.get("referer"))
+
+    dedupe_id = None
+    if NOTIFY_DEDUPE_ENABLED:
+        dedupe_id = _notify_dedupe_id(request, kind, body, conversation_uuid)
+    if dedupe_id:
+        dedupe_id = f"{api_key}:{dedupe_id}"
+        try:
+            first_seen = await NotifyDedupeManager().first_seen(dedupe_id)
+        except Exception as e:
+            # 去重不可用时宁可重复记账也不丢失记录
+            logger.warning(f"Notify dedupe unavailable: {e}")
+            first_seen, dedupe_id = True, None
+        if not first_seen:
+            metrics.incr(f"notify_{kind}_duplicates")
+            return NegotiatedResponse(content={"code": 0, "msg": "duplicate"})
+
+    job = NotifyJob(kind, api_key, conversation_uuid, body, dedupe_id)
+    if not await NotifyQueue.submit(job):
+        if dedupe_id:
+            try:
+                await NotifyDedupeManager().forget(dedupe_id)
+            except Exception as e:
+                logger.warning(f"Failed to release notify dedupe id: {e}")
+        return NegotiatedResponse(
+            status_code=503,
+            content={"error": {"message": "Accounting queue is full, retry later"}},
+            headers={"Retry-After": "1"},
+        )
+    return NegotiatedResponse(status_code=202, content={"code": 0, "msg": "accepted"})
+
+
 # DOCUMENT_NOTIFY_URL
 # RESPONSE_NOTIFY_URL
 @router.api_route("/document_notify", methods=["POST"])
 async def document_notify(request: Request):
-    pass
-    # # TODO: 通过refer 判断对话来自哪个对话， 然后加起来， 用以计算token。
-    # api_key = request.headers.get("Authorization", None)
-    # api_key = remove_beamer(api_key)
-    # request_data = await request.json()
-    # logger.debug(f"request_data from document_notify: \n{request_data}")
-    # text = request_data.get("ExtractedContent", "")
-    # token_usage = get_token_length(text)
-    # usage_manager = UsageManager()  # Configure host as needed
-    # # await usage_manager.increment_token_usage(api_key, token_usage)
-    # conversation_uuid = dict(request.headers).get("referer", "")
-    # if conversation_uuid:
-    #     conversation_uuid = conversation_uuid.split("/")[-1]
-    # logger.debug(f"conversation_uuid:{conversation_uuid}")
-    # token_manager = TokenUsageManager()
-    # await token_manager.increment_token_usage(api_key, conversation_uuid, token_usage)
-    # accumulative_token_usage = await token_manager.get_token_usage(
-    #     api_key, conversation_uuid
-    # )
-    # await usage_manager.increment_token_usage(api_key, accumulative_token_usage)
+    # 通过 referer 判断文档属于哪个对话, 累加到对话的 token 上
+    return await _enqueue_notify(request, NotifyJob.KIND_DOCUMENT)
 
 
 @router.api_route("/response_notify", methods=["POST"])
 async def response_notify(request: Request):
-    api_key = request.headers.get("Authorization", None)
-    api_key = remove_beamer(api_key)
-    request_data = await request.json()
-    logger.debug(f"request_data from response_notify: \n{request_data}")
-    text_values = re.findall(r'"text":"(.*?)"', request_data["Data"])
-    # 拼接提取的文本
-    # 拼接提取的文本
-    result = "".join(text_values)
-    token_usage = get_token_length(result)
-    logger.debug(f"api_key:\n{api_key}")
-    logger.debug(f"response usage:\n{token_usage}")
-    usage_manager = UsageManager()  # Configure host as needed
-    conversation_uuid = dict(request.headers).get("referer", "")
-    if conversation_uuid:
-        conversation_uuid = conversation_uuid.split("/")[-1]
-    logger.debug(f"conversation_uuid:{conversation_uuid}")
-    token_manager = TokenUsageManager()
-    await token_manager.increment_token_usage(api_key, conversation_uuid, token_usage)
-    accumulative_token_usage = await token_manager.get_token_usage(
-        api_key, conversation_uuid
+    return await _enqueue_notify(request, NotifyJob.KIND_RESPONSE)
+
+
+def _audit_error_response(
+    decision: AdmissionDecision,
+) -> Optional[NegotiatedResponse]:
+    if decision.status_code == 200:
+        return None
+    if decision.decision in ("invalid_json", "error"):
+        raise HTTPException(status_code=decision.status_code, detail=decision.message)
+    return NegotiatedResponse(
+        status_code=decision.status_code,
+        content={"error": {"message": decision.message}},
     )
-    await usage_manager.increment_token_usage(api_key, accumulative_token_usage)
+
+
+def _schedule_reconcile(
+    background_tasks: BackgroundTasks, item: AdmissionItem, decision: AdmissionDecision
+) -> None:
+    if decision.pending_estimates:
+        # 估算的附件在响应之后精确计数, 补记差值
+        background_tasks.add_task(
+            reconcile_estimated_usage,
+            item.api_key,
+            item.conversation_uuid,
+            decision.pending_estimates,
+        )
 
 
 @router.api_route("/audit_limit", methods=["GET", "POST"])
-async def audit_limit(request: Request):
+async def audit_limit(request: Request, background_tasks: BackgroundTasks):
     api_key = request.headers.get("Authorization", None)
     api_key = remove_beamer(api_key)
 
@@ -91,151 +187,67 @@ async def audit_limit(request: Request):
     if not host or not user_agent:
         raise HTTPException(status_code=400, detail="Host and User-Agent are required")
 
-    # Check device authorization
-    device_manager = DeviceManager()
-    device_identifier = user_agent  # Using user agent as device identifier
-
+    item = AdmissionItem(
+        api_key=api_key,
+        user_agent=user_agent,
+        host=host,
+        conversation_uuid=get_conversation_uuid(request.headers.get("referer")),
+        body=await request.body(),
+    )
+    (decision,) = await evaluate_admissions([item])
+    _schedule_reconcile(background_tasks, item, decision)
+    return _audit_error_response(decision)
+
+
+@router.post("/audit_limit/batch")
+async def audit_limit_batch(request: Request, background_tasks: BackgroundTasks):
+    """
+    Many /audit_limit checks in one call, for gateways fronting many users.
+    Each item carries the user's Authorization, User-Agent, host and referer
+    plus the original request body; decisions come back in item order.
+    """
     try:
-        allowed = await device_manager.check_and_add_device(
-            token=api_key,
-            device_identifier=device_identifier,
-            user_agent=user_agent,
-            host=host,
+        batch = decode_audit_batch(await request.body())
+    except msgspec.DecodeError:
+        raise HTTPException(status_code=400, detail="Invalid JSON data")
+    if len(batch.items) > AUDIT_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {AUDIT_BATCH_MAX_ITEMS} items per batch",
         )
 
-        if not allowed:
-            return JSONResponse(
-                status_code=403,
-                content={
-                    "error": {
-                        "message": f"Maximum number of devices ({MAX_DEVICES}) reached. Please logout from another device first.\n"
-                        f"已达到最大设备数 ({MAX_DEVICES})。请先从另一台设备注销。"
-                    }
-                },
+    results: List[Optional[dict]] = [None] * len(batch.items)
+    items: List[AdmissionItem] = []
+    positions: List[int] = []
+    for i, entry in enumerate(batch.items):
+        if not entry.authorization or not entry.host or not entry.user_agent:
+            results[i] = AdmissionDecision(
+                400, "invalid_item", "Authorization, Host and User-Agent are required"
+            ).to_dict()
+            continue
+        items.append(
+            AdmissionItem(
+                api_key=remove_beamer(entry.authorization),
+                user_agent=entry.user_agent,
+                host=entry.host,
+                conversation_uuid=get_conversation_uuid(entry.referer),
+                body=bytes(entry.request),
             )
-    except Exception as e:
-        return JSONResponse(
-            status_code=500,
-            content={"error": {"message": f"Failed to verify device\n无法验证设备"}},
         )
-    # 获取请求内容
-    try:
-        request_data = await request.json()
-        logger.debug(f"request_data: \n{request_data}")
-        # 获取 action - 判断请求类型
-        action = request_data.get("action", "")
-
-        # 获取 model - 模型名称
-        model = request_data.get("model", "")
-
-        # 获取 prompt - 输入内容
-        # 处理嵌套的字典结构
-        messages = request_data.get("messages", [])
-        prompt = ""
-        if messages and len(messages) > 0:
-            content = messages[0].get("content", {})
-            if isinstance(content, dict) and "parts" in content:
-                parts = content.get("parts", [])
-                if parts and len(parts) > 0:
-                    prompt = parts[0]
-        if "claude" in model.lower():
-            # Initialize usage manager
-            try:
-                usage_manager = UsageManager()  # Configure host as needed
-                # Get current usage stats
-                stats = await usage_manager.get_token_usage(api_key)
-                # Get configured limit from settings
-                # Check 3-hour usage limit
-                used_3h = stats.last_3_hours
-                remaining = RATE_LIMIT - used_3h
-                if remaining <= 0:
-                    # Calculate wait time
-                    redis = await usage_manager.get_aioredis()
-                    key = usage_manager._get_redis_key(
-                        api_key, usage_manager.PERIOD_3HOURS
-                    )
-                    ttl = await redis.ttl(key)
-
-                    wait_seconds = max(ttl, 0)
-
-                    return JSONResponse(
-                        status_code=429,
-                        content={
-                            "error": {
-                                "message": f"Usage limit exceeded. Current limit is {RATE_LIMIT} "
-                                f"tokens per 3 hours. Please wait {wait_seconds} seconds. "
-                                f"您已触发使用频率限制，当前限制为{RATE_LIMIT} tokens/3小时，"
-                                f"请等待{wait_seconds}秒后重试。"
-                            }
-                        },
-                    )
-
-                # Increment usage if within limits
-                token_usage = get_token_length(prompt)
-
-                attachments = request_data.get("raw_message", {}).get("attachments", [])
-                if attachments:
-                    attachments_text = "".join(
-                        [attach["extracted_content"] for attach in attachments]
-                    )
-                    attach_token_usage = get_token_length(attachments_text)
-                    token_usage += attach_token_usage
-                logger.debug(f"api_key:\n{api_key}")
-                logger.debug(f"input usage:\n{token_usage}")
-                conversation_uuid = dict(request.headers).get("referer", "")
-                if conversation_uuid:
-                    conversation_uuid = conversation_uuid.split("/")[-1]
-                logger.debug(f"conversation_uuid:{conversation_uuid}")
-                token_manager = TokenUsageManager()
-                await token_manager.increment_token_usage(
-                    api_key, conversation_uuid, token_usage
-                )
-                accumulative_token_usage = await token_manager.get_token_usage(
-                    api_key, conversation_uuid
-                )
-                await usage_manager.increment_token_usage(
-                    api_key, accumulative_token_usage
-                )
-
-                # Add the usage calculation here
-                usage_record = UsageRecordManager()
-
-                current_usage = await usage_record.get_usage(api_key)
-                used_3h = current_usage.last_3_hours
-                remaining = USAGE_RECORD_RATE_LIMIT - used_3h
-                if remaining <= 0:
-                    # Calculate wait time
-                    redis = await usage_record.get_aioredis()
-                    key = usage_record._get_redis_key(
-                        api_key, usage_record.PERIOD_3HOURS
-                    )
-                    ttl = await redis.ttl(key)
-
-                    wait_seconds = max(ttl, 0)
-
-                    return JSONResponse(
-                        status_code=429,
-                        content={
-                            "error": {
-                                "message": f"Usage limit exceeded. Current limit is {USAGE_RECORD_RATE_LIMIT} "
-                                f"per 3 hours. Please wait {wait_seconds} seconds. "
-                                f"您已触发使用频率限制，当前限制为{USAGE_RECORD_RATE_LIMIT} 次/3小时，"
-                                f"请等待{wait_seconds}秒后重试。"
-                            }
-                        },
-                    )
-                await usage_record.increment_usage(api_key)
-
-                return
-            except Exception as e:
-                raise HTTPException(
-                    status_code=500, detail=f"Error checking usage limits: {str(e)}"
-                )
+        positions.append(i)
 
-    except JSONDecodeError:
-        raise HTTPException(status_code=400, detail="Invalid JSON data")
+    decisions = await evaluate_admissions(items, route="/audit_limit/batch")
+    for i, item, decision in zip(positions, items, decisions):
+        _schedule_reconcile(background_tasks, item, decision)
+        results[i] = decision.to_dict()
+    return NegotiatedResponse(content={"code": 0, "msg": "success", "data": results})
 
-    return
+
+@router.get("/metrics")
+async def get_metrics():
+    return NegotiatedResponse(
+        content={"code": 0, "msg": "success", "data": metrics.snapshot()}
+    )
 
 
 @router.get("/token_stats")
@@ -249,7 +261,9 @@ async def token_stats(request: Request, usage_type: str = "token_usage"):
             
         # Get all token usage statistics
         usage_stats = await usage_manager.get_all_token_usage()
-        logger.debug(usage_stats)
+        logger.opt(lazy=True).debug(
+            "usage_stats: {}", lambda: truncate_payload(usage_stats)
+        )
         
         # Prepare response data
         stats = []
@@ -272,10 +286,10 @@ async def token_stats(request: Request, usage_type: str = "token_usage"):
         # Sort by total usage in descending order
         stats.sort(key=lambda x: x["usage"]["total"], reverse=True)
 
-        return JSONResponse(content={"code": 0, "msg": "success", "data": stats})
+        return NegotiatedResponse(content={"code": 0, "msg": "success", "data": stats})
 
     except Exception as e:
-        return JSONResponse(
+        return NegotiatedResponse(
             status_code=500,
             content={
                 "code": 500,
@@ -297,7 +311,7 @@ async def devices(request: Request):
     device_manager = DeviceManager()
     device_list = await device_manager.get_device_list(api_key)
 
-    return JSONResponse(
+    return NegotiatedResponse(
         content={
             "code": 0,
             "msg": "Success",
@@ -335,7 +349,7 @@ async def logout(request: Request):
         if not success:
             raise HTTPException(status_code=500, detail="Failed to logout device")
 
-        return JSONResponse(
+        return NegotiatedResponse(
             content={"code": 0, "msg": "Device logged out successfully"}
         )
     except:
@@ -361,7 +375,7 @@ async def all_token_devices(request: Request):
     # Sort by total number of devices
     stats.sort(key=lambda x: x["total"], reverse=True)
 
-    return JSONResponse(content={"code": 0, "msg": "Success", "data": stats})
+    return NegotiatedResponse(content={"code": 0, "msg": "Success", "data": stats})
 
 
 @router.get("/all_token_usage")
@@ -369,3 +383,89 @@ async def all_token_usage():
     token_manager = TokenUsageManager()
     all_usage = await token_manager.get_all_token_usage()
     return all_usage
+
+
+@router.get("/export/{dataset}")
+async def export(
+    dataset: str,
+    format: str = "ndjson",
+    gzip: bool = False,
+    prefix: str = "",
+    min_total: int = 0,
+    cursor: str = ExportManager.START_CURSOR,
+    limit: Optional[int] = None,
+):
+    try:
+        await validate_export(dataset, format, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    filename = f"{dataset}.{format}"
+    media_type = MEDIA_TYPES[format]
+    if gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(
+        export_chunks(dataset, format, gzip, prefix, min_total, cursor, limit),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@router.get("/usage_history")
+async def get_usage_history(
+    api_key: Optional[str] = None,
+    top: Optional[int] = None,
+    metric: str = "tokens",
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    step_hours: int = 1,
+):
+    # numpy 只在查询历史时才导入, 不拖慢启动
+    from claude_auditlimit_python.usage_history import usage_history
+
+    try:
+        data = await usage_history(metric, api_key, top, start, end, step_hours)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return NegotiatedResponse(content={"code": 0, "msg": "success", "data": data})
+
+
+# /debug/* 需要文档的 basic auth, 见 ApidocBasicAuthMiddleware
+@router.get("/debug/profile")
+async def debug_profile(
+    seconds: float = 5, interval_ms: float = 5, format: str = "collapsed"
+):
+    try:
+        profile = await profile_event_loop(seconds, interval_ms / 1000, format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except DebugBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if format == FORMAT_SPEEDSCOPE:
+        return Response(
+            content=profile,
+            media_type="application/json",
+            headers={
+                "Content-Disposition": 'attachment; filename="profile.speedscope.json"'
+            },
+        )
+    return Response(content=profile, media_type="text/plain")
+
+
+@router.get("/debug/memory")
+async def debug_memory(seconds: float = 5, top: int = 30, group_by: str = "lineno"):
+    try:
+        data = await tracemalloc_diff(seconds, top, group_by)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except DebugBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return NegotiatedResponse(content={"code": 0, "msg": "success", "data": data})
+
+
+@router.get("/debug/structures")
+async def debug_structures(request: Request):
+    return NegotiatedResponse(
+        content={"code": 0, "msg": "success", "data": structure_sizes(request.app)}
+    )
@@ -1,3 +1,52 @@
 from pydantic import BaseModel, Field
-from typing import Union, List, Dict
+from typing import Any, Union, List, Dict, Optional
 from enum import Enum
+
+import msgspec
+
+
+# /audit_limit 请求体, 只声明需要的字段, 其余字段在解码时直接跳过
+class AuditModel(msgspec.Struct):
+    model: Optional[str] = None
+
+
+class AuditMessage(msgspec.Struct):
+    content: Any = None
+
+
+class AuditAttachment(msgspec.Struct):
+    extracted_content: Optional[str] = None
+
+
+class AuditRawMessage(msgspec.Struct):
+    # 显式的 null 与缺省相同
+    attachments: Optional[List[AuditAttachment]] = None
+
+
+class AuditRequest(msgspec.Struct):
+    model: Optional[str] = None
+    # 历史消息保持为原始 JSON 片段, 只解码第一条
+    messages: Optional[List[msgspec.Raw]] = None
+    raw_message: Optional[AuditRawMessage] = None
+
+
+# /audit_limit/batch 请求体, 每一项带上单个 /audit_limit 请求的头部和原始请求体
+class AuditBatchItem(msgspec.Struct):
+    authorization: str = ""
+    user_agent: str = ""
+    host: str = ""
+    referer: Optional[str] = None
+    request: msgspec.Raw = msgspec.Raw(b"{}")
+
+
+class AuditBatchRequest(msgspec.Struct):
+    items: List[AuditBatchItem] = []
+
+
+# notify 回调的请求体
+class ResponseNotifyBody(msgspec.Struct):
+    Data: str = ""
+
+
+class DocumentNotifyBody(msgspec.Struct):
+    ExtractedContent: str = ""
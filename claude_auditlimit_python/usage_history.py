@@ -0,0 +1,149 @@
+# usage_history.py
+# /usage_history: 某个 key 或用量最高的 K 个 key 的用量序列, 由按小时/天的汇总用 numpy 聚合
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from claude_auditlimit_python.configs import (
+    HISTORY_DAILY_RETENTION_DAYS,
+    HISTORY_MAX_POINTS,
+    HISTORY_MAX_TOP_K,
+)
+from claude_auditlimit_python.redis_manager.history_manager import HistoryManager
+from claude_auditlimit_python.redis_manager.usage_manager import UsageManager
+
+METRICS = ("tokens", "requests")
+
+
+def plan_range(
+    start: Optional[int], end: Optional[int], step_hours: int, now: float
+) -> Tuple[int, int]:
+    """
+    ``(first_hour, points)`` covering [start, end) in steps of ``step_hours``;
+    whole-day steps start at a day boundary. Defaults to the last 24 hours.
+    """
+    if step_hours < 1:
+        raise ValueError("step_hours must be at least 1")
+    end = int(now) if end is None else end
+    start = end - 24 * 3600 if start is None else start
+    if start >= end:
+        raise ValueError("start must be before end")
+
+    first_hour = UsageManager.hour_bucket(start)
+    if step_hours % 24 == 0:
+        first_hour = UsageManager.day_start_hour(UsageManager.day_bucket(first_hour))
+    end_hour = -(-end // 3600)
+    points = -(-(end_hour - first_hour) // step_hours)
+    if points > HISTORY_MAX_POINTS:
+        raise ValueError(
+            f"{points} points requested, at most {HISTORY_MAX_POINTS}; use a larger step"
+        )
+    return first_hour, points
+
+
+def aggregate(
+    histories: List[Tuple[Dict[int, int], Dict[int, int]]],
+    first_hour: int,
+    step_hours: int,
+    points: int,
+) -> np.ndarray:
+    """
+    Sum each key's ``(hourly, daily)`` buckets into ``points`` bins, one row
+    per key. A day that was already downsampled counts at its first hour.
+    """
+    rows, hours, counts = [], [], []
+    for row, (hourly, daily) in enumerate(histories):
+        buckets = list(hourly) + [UsageManager.day_start_hour(d) for d in daily]
+        rows.append(np.full(len(buckets), row, dtype=np.int64))
+        hours.append(np.fromiter(buckets, dtype=np.int64, count=len(buckets)))
+        counts.append(
+            np.fromiter(
+                [*hourly.values(), *daily.values()], dtype=np.int64, count=len(buckets)
+            )
+        )
+    if not histories:
+        return np.zeros((0, points), dtype=np.int64)
+
+    rows, hours, counts = (np.concatenate(a) for a in (rows, hours, counts))
+    bins = (hours - first_hour) // step_hours
+    mask = (bins >= 0) & (bins < points)
+    flat = np.bincount(
+        rows[mask] * points + bins[mask],
+        weights=counts[mask],
+        minlength=len(histories) * points,
+    )
+    return flat.astype(np.int64).reshape(len(histories), points)
+
+
+def _top_keys(entries: List[Tuple[str, float]], k: int) -> List[str]:
+    if not entries:
+        return []
+    # 分片迁移后同一个 key 可能出现在多个节点上, 先按 key 求和
+    keys, inverse = np.unique(
+        np.array([member for member, _ in entries]), return_inverse=True
+    )
+    totals = np.bincount(
+        inverse, weights=np.array([score for _, score in entries], dtype=np.float64)
+    )
+    k = min(k, len(keys))
+    top = np.argpartition(-totals, k - 1)[:k]
+    top = top[np.argsort(-totals[top], kind="stable")]
+    return keys[top].tolist()
+
+
+async def usage_history(
+    metric: str = "tokens",
+    api_key: Optional[str] = None,
+    top: Optional[int] = None,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    step_hours: int = 1,
+    now: Optional[float] = None,
+) -> dict:
+    """
+    Usage series of ``api_key``, or of the ``top`` keys by usage in the
+    range, read from the rollups only. Timestamps are bin starts in epoch
+    seconds. Raises ValueError for invalid arguments before any Redis call.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"unknown metric {metric!r}, expected one of {METRICS}")
+    if (api_key is None) == (top is None):
+        raise ValueError("pass exactly one of api_key and top")
+    if top is not None and not 1 <= top <= HISTORY_MAX_TOP_K:
+        raise ValueError(f"top must be between 1 and {HISTORY_MAX_TOP_K}")
+    now = time.time() if now is None else now
+    first_hour, points = plan_range(start, end, step_hours, now)
+    last_hour = first_hour + points * step_hours
+
+    manager = HistoryManager()
+    if top is None:
+        api_keys = [api_key]
+    else:
+        # 超过保留期的小时已经不存在, 不必参与 ZUNION
+        current = UsageManager.hour_bucket(now)
+        oldest = current - HISTORY_DAILY_RETENTION_DAYS * 24
+        hours = list(range(max(first_hour, oldest), min(last_hour, current + 1)))
+        days = [
+            day
+            for day in range(
+                UsageManager.day_bucket(first_hour),
+                UsageManager.day_bucket(last_hour) + 1,
+            )
+            if first_hour <= UsageManager.day_start_hour(day) < last_hour
+        ]
+        api_keys = _top_keys(await manager.get_top_scores(metric, hours, days), top)
+
+    values = aggregate(
+        await manager.get_history(metric, api_keys), first_hour, step_hours, points
+    )
+    timestamps = (first_hour + np.arange(points, dtype=np.int64) * step_hours) * 3600
+    return {
+        "metric": metric,
+        "step_seconds": step_hours * 3600,
+        "timestamps": timestamps.tolist(),
+        "series": [
+            {"api_key": key, "total": int(row.sum()), "values": row.tolist()}
+            for key, row in zip(api_keys, values)
+        ],
+    }
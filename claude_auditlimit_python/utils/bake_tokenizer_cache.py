@@ -0,0 +1,32 @@
+"""
+Download the tiktoken ranks files once so workers can load them offline.
+
+    python -m claude_auditlimit_python.utils.bake_tokenizer_cache --encodings cl100k_base o200k_base
+"""
+
+import argparse
+import os
+from pathlib import Path
+
+from claude_auditlimit_python.configs import TOKENIZER_CACHE_DIR, TOKENIZER_ENCODINGS
+
+
+def bake_tokenizer_cache(cache_dir: Path, names):
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    os.environ["TIKTOKEN_CACHE_DIR"] = str(cache_dir)
+
+    import tiktoken
+
+    for name in names:
+        encoding = tiktoken.get_encoding(name)
+        print(f"{name}: {encoding.n_vocab} tokens")
+    for path in sorted(cache_dir.iterdir()):
+        print(f"{path} ({path.stat().st_size} bytes)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cache-dir", type=Path, default=TOKENIZER_CACHE_DIR)
+    parser.add_argument("--encodings", nargs="+", default=TOKENIZER_ENCODINGS)
+    args = parser.parse_args()
+    bake_tokenizer_cache(args.cache_dir, args.encodings)
@@ -0,0 +1,64 @@
+"""
+Export usage or device data as NDJSON or CSV without loading it into memory.
+
+    python -m claude_auditlimit_python.utils.export_data usage --format csv --gzip -o usage.csv.gz
+    python -m claude_auditlimit_python.utils.export_data devices --prefix sk-ant --limit 10000
+
+The last line of the output holds the cursor to pass to --cursor to resume.
+"""
+
+import argparse
+import asyncio
+import sys
+
+from claude_auditlimit_python.export import (
+    DATASETS,
+    FORMATS,
+    export_chunks,
+    validate_export,
+)
+from claude_auditlimit_python.redis_manager.export_manager import ExportManager
+from claude_auditlimit_python.redis_manager.redis_pool import RedisPool
+
+
+async def main(args):
+    try:
+        await validate_export(args.dataset, args.format, args.cursor)
+    except ValueError as e:
+        await RedisPool.shutdown()
+        sys.exit(f"error: {e}")
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        async for chunk in export_chunks(
+            args.dataset,
+            args.format,
+            args.gzip,
+            args.prefix,
+            args.min_total,
+            args.cursor,
+            args.limit,
+        ):
+            output.write(chunk)
+    finally:
+        if args.output:
+            output.close()
+        else:
+            output.flush()
+        await RedisPool.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dataset", choices=DATASETS)
+    parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--prefix", default="", help="only api keys with this prefix")
+    parser.add_argument(
+        "--min-total", type=int, default=0, help="usage only: minimum total tokens"
+    )
+    parser.add_argument("--cursor", default=ExportManager.START_CURSOR)
+    parser.add_argument(
+        "--limit", type=int, default=None, help="stop after about this many rows"
+    )
+    parser.add_argument("-o", "--output", help="file to write, default stdout")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,136 @@
+import hashlib
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+from typing import Any, Optional
+
+import msgspec
+from loguru import logger
+
+from claude_auditlimit_python import metrics
+from claude_auditlimit_python.configs import (
+    AUDIT_TRAIL_BACKUP_COUNT,
+    AUDIT_TRAIL_ENABLED,
+    AUDIT_TRAIL_MAX_BYTES,
+    AUDIT_TRAIL_PATH,
+    LOG_LEVEL,
+    LOG_PAYLOAD_MAX_CHARS,
+    LOG_QUEUE_SIZE,
+    LOG_SAMPLE_RATES,
+    LOGS_PATH,
+)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Never blocks the caller: records are dropped (and counted) when the queue is full."""
+
+    def __init__(self, name: str, maxsize: int):
+        super().__init__(queue.Queue(maxsize=maxsize))
+        self.name = name
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _BackgroundSink:
+    """A bounded queue drained by a listener thread into a file handler."""
+
+    def __init__(self, name: str, target: logging.Handler):
+        target.setFormatter(logging.Formatter("%(message)s"))
+        self.handler = DroppingQueueHandler(name, LOG_QUEUE_SIZE)
+        self.listener = logging.handlers.QueueListener(self.handler.queue, target)
+        self.listener.start()
+        metrics.register_gauge(f"{name}_dropped", lambda: self.handler.dropped)
+        metrics.register_gauge(f"{name}_queue_size", self.handler.queue.qsize)
+
+    def stop(self) -> None:
+        self.listener.stop()
+
+
+_log_sink: Optional[_BackgroundSink] = None
+_audit_sink: Optional[_BackgroundSink] = None
+_audit_logger = logging.getLogger("claude_auditlimit_python.audit")
+_audit_encoder = msgspec.json.Encoder()
+
+
+def setup_logging() -> None:
+    """
+    Console at ``LOG_LEVEL`` plus the weekly-rotated file sink, which is written
+    by a background thread through a bounded queue instead of on the request path.
+    """
+    global _log_sink, _audit_sink
+    logger.remove()
+    logger.add(sys.stderr, level=LOG_LEVEL)
+
+    _log_sink = _BackgroundSink(
+        "log",
+        logging.handlers.TimedRotatingFileHandler(
+            LOGS_PATH / "log_file.log", when="D", interval=7, encoding="utf-8"
+        ),
+    )
+    logger.add(_log_sink.handler, level=LOG_LEVEL)
+
+    if AUDIT_TRAIL_ENABLED:
+        _audit_sink = _BackgroundSink(
+            "audit",
+            logging.handlers.RotatingFileHandler(
+                AUDIT_TRAIL_PATH,
+                maxBytes=AUDIT_TRAIL_MAX_BYTES,
+                backupCount=AUDIT_TRAIL_BACKUP_COUNT,
+                encoding="utf-8",
+            ),
+        )
+        _audit_logger.addHandler(_audit_sink.handler)
+        _audit_logger.setLevel(logging.INFO)
+        _audit_logger.propagate = False
+
+
+def shutdown_logging() -> None:
+    """Flush what is still queued; called on application shutdown."""
+    for sink in (_log_sink, _audit_sink):
+        if sink is not None:
+            sink.stop()
+
+
+def should_sample(route: str) -> bool:
+    """Whether a payload-level log line should be emitted for this request."""
+    rate = LOG_SAMPLE_RATES.get(route, 1.0)
+    return rate >= 1.0 or random.random() < rate
+
+
+def truncate_payload(payload: Any, max_chars: int = LOG_PAYLOAD_MAX_CHARS) -> str:
+    text = payload if isinstance(payload, str) else repr(payload)
+    if len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]}...({len(text) - max_chars} more chars)"
+
+
+def key_id(api_key: Optional[str]) -> str:
+    """Short stable identifier so the audit trail never stores raw API keys."""
+    if not api_key:
+        return ""
+    return hashlib.sha256(api_key.encode()).hexdigest()[:12]
+
+
+def record_decision(
+    route: str, api_key: Optional[str], decision: str, status: int, **fields
+) -> None:
+    """Append one JSON line to the audit trail (no-op unless set up)."""
+    if _audit_sink is None:
+        return
+    entry = {
+        "ts": round(time.time(), 3),
+        "route": route,
+        "key": key_id(api_key),
+        "decision": decision,
+        "status": status,
+    }
+    entry.update(fields)
+    _audit_logger.info(_audit_encoder.encode(entry).decode())
@@ -0,0 +1,65 @@
+"""
+Edit limit tiers and api key assignments; running workers reload at once.
+
+    python -m claude_auditlimit_python.utils.manage_policy show
+    python -m claude_auditlimit_python.utils.manage_policy set-tier pro \
+        '{"windows": [{"metric": "tokens", "period": "3h", "limit": 3600000},
+                      {"metric": "tokens", "period": "24h", "limit": 600000, "family": "opus"},
+                      {"metric": "requests", "period": "3h", "limit": 90}],
+          "max_devices": 5}'
+    python -m claude_auditlimit_python.utils.manage_policy assign sk-xxx pro
+"""
+
+import argparse
+import asyncio
+import json
+
+from claude_auditlimit_python.policy import _tier_decoder, _validate
+from claude_auditlimit_python.redis_manager.policy_manager import PolicyManager
+from claude_auditlimit_python.redis_manager.redis_pool import RedisPool
+
+
+async def main(args):
+    manager = PolicyManager()
+    try:
+        if args.command == "show":
+            tiers, assignments = await manager.load()
+            print(
+                json.dumps(
+                    {
+                        "tiers": {name: json.loads(spec) for name, spec in tiers.items()},
+                        "keys": assignments,
+                    },
+                    indent=2,
+                    ensure_ascii=False,
+                )
+            )
+        elif args.command == "set-tier":
+            # 写入前先校验, 避免 worker 加载到无效的等级
+            _validate(_tier_decoder.decode(args.spec))
+            await manager.set_tier(args.name, args.spec)
+        elif args.command == "delete-tier":
+            print(await manager.delete_tier(args.name))
+        elif args.command == "assign":
+            await manager.assign(args.api_key, args.tier)
+        elif args.command == "unassign":
+            print(await manager.unassign(args.api_key))
+    finally:
+        await RedisPool.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("show")
+    set_tier = commands.add_parser("set-tier")
+    set_tier.add_argument("name")
+    set_tier.add_argument("spec", help="JSON tier spec")
+    delete_tier = commands.add_parser("delete-tier")
+    delete_tier.add_argument("name")
+    assign = commands.add_parser("assign")
+    assign.add_argument("api_key")
+    assign.add_argument("tier")
+    unassign = commands.add_parser("unassign")
+    unassign.add_argument("api_key")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,167 @@
+"""
+Move per-api-key keys to the configured key layout and shard.
+
+Rewrites ``token:sk-x:3h`` style keys to the layout in ``REDIS_KEY_LAYOUT``
+(e.g. ``token:{sk-x}:3h``) and moves each key to the node its api key hashes
+to on the ``REDIS_SHARDS`` ring. Keys are copied with DUMP/RESTORE keeping
+their TTL, then deleted from the source. A key whose target name already
+exists is left in place and reported as a conflict. Run it with the service
+stopped, using the environment the service will start with:
+
+    REDIS_KEY_LAYOUT=hashtag python -m claude_auditlimit_python.utils.migrate_keyspace --dry-run
+    REDIS_KEY_LAYOUT=hashtag python -m claude_auditlimit_python.utils.migrate_keyspace
+"""
+
+import argparse
+import asyncio
+from collections import Counter
+from typing import Optional, Tuple
+
+from redis.asyncio import Redis
+from redis.exceptions import ResponseError
+
+from claude_auditlimit_python.configs import REDIS_DB
+from claude_auditlimit_python.redis_manager.admission_manager import AdmissionManager
+from claude_auditlimit_python.redis_manager.device_manager import DeviceManager
+from claude_auditlimit_python.redis_manager.redis_pool import RedisPool
+from claude_auditlimit_python.redis_manager.token_usage_manager import TokenUsageManager
+from claude_auditlimit_python.redis_manager.usage_manager import UsageManager
+from claude_auditlimit_python.redis_manager.usage_record_manager import (
+    UsageRecordManager,
+)
+
+usage_manager = UsageManager()
+usage_record_manager = UsageRecordManager()
+token_usage_manager = TokenUsageManager()
+device_manager = DeviceManager()
+admission_manager = AdmissionManager()
+
+
+def _untag(identifier: str) -> str:
+    if identifier.startswith("{") and identifier.endswith("}"):
+        return identifier[1:-1]
+    return identifier
+
+
+def _split_last(rest: str) -> Tuple[str, str]:
+    identifier, _, tail = rest.rpartition(":")
+    return _untag(identifier), tail
+
+
+# (SCAN 模式, key 类型, 解析函数: key 去掉前缀后的部分 -> (api_key, 目标 key))
+def _usage_key(manager):
+    def parse(rest: str):
+        api_key, period = _split_last(rest)
+        return api_key, manager._get_redis_key(api_key, period)
+
+    return parse
+
+
+def _family_key(metric: str):
+    def parse(rest: str):
+        identifier, family, period = rest.rsplit(":", 2)
+        api_key = _untag(identifier)
+        return api_key, admission_manager._get_family_key(api_key, metric, family, period)
+
+    return parse
+
+
+def _device_info_key(rest: str):
+    api_key, device_hash = _split_last(rest)
+    return api_key, device_manager._get_device_info_key(api_key, device_hash)
+
+
+FAMILIES = [
+    ("token:", "string", _usage_key(usage_manager)),
+    ("usage:", "string", _usage_key(usage_record_manager)),
+    # 按小时/天的用量历史; top-K zset 按节点保存, 查询时跨节点求和, 不需要迁移
+    ("token:", "hash", _usage_key(usage_manager)),
+    ("usage:", "hash", _usage_key(usage_record_manager)),
+    (
+        "token_usage:",
+        "hash",
+        lambda rest: (
+            _untag(rest),
+            token_usage_manager._get_redis_key(_untag(rest)),
+        ),
+    ),
+    (
+        "token_usage_seen:",
+        "zset",
+        lambda rest: (_untag(rest), token_usage_manager._get_seen_key(_untag(rest))),
+    ),
+    (
+        "devices:",
+        "set",
+        lambda rest: (_untag(rest), device_manager._get_device_key(_untag(rest))),
+    ),
+    ("device_info:", "hash", _device_info_key),
+    ("token_family:", "string", _family_key(AdmissionManager.METRIC_TOKENS)),
+    ("usage_family:", "string", _family_key(AdmissionManager.METRIC_REQUESTS)),
+]
+
+
+def _raw_client(node: Tuple[str, int], db: int) -> Redis:
+    # DUMP 的结果是二进制, 不能用 decode_responses 的连接
+    host, port = node
+    return Redis(
+        connection_pool=RedisPool.create_pool(host, port, db, decode_responses=False)
+    )
+
+
+async def _move(
+    source: Redis, target: Redis, key: str, new_key: str, dry_run: bool
+) -> Optional[str]:
+    if dry_run:
+        return "moved"
+    dump = await source.dump(key)
+    pttl = await source.pttl(key)
+    if dump is None or pttl == -2:
+        return None
+    try:
+        await target.restore(new_key, max(pttl, 0), dump)
+    except ResponseError as e:
+        if "BUSYKEY" in str(e):
+            return "conflicts"
+        raise
+    await source.delete(key)
+    return "moved"
+
+
+async def migrate(dry_run: bool, db: int = REDIS_DB) -> Counter:
+    nodes = RedisPool.shard_nodes()
+    clients = {node: _raw_client(node, db) for node in nodes}
+    report: Counter = Counter()
+    try:
+        for node, source in clients.items():
+            for prefix, key_type, parse in FAMILIES:
+                async for raw_key in source.scan_iter(
+                    match=f"{prefix}*", count=500, _type=key_type
+                ):
+                    key = raw_key.decode()
+                    rest = key[len(prefix) :]
+                    if prefix == "token_usage:" and ":" in rest.strip("{}"):
+                        # 旧的逐对话 string key 由 TokenUsageManager.compact 处理
+                        continue
+                    api_key, new_key = parse(rest)
+                    target_node = RedisPool.shard_node(api_key)
+                    if new_key == key and target_node == node:
+                        report["unchanged"] += 1
+                        continue
+                    result = await _move(
+                        source, clients[target_node], key, new_key, dry_run
+                    )
+                    if result:
+                        report[result] += 1
+    finally:
+        for client in clients.values():
+            await client.connection_pool.disconnect()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--db", type=int, default=REDIS_DB)
+    args = parser.parse_args()
+    print(dict(asyncio.run(migrate(args.dry_run, args.db))))
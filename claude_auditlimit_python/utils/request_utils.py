@@ -0,0 +1,79 @@
+import hashlib
+import re
+from typing import List, Optional
+
+import msgspec
+
+from claude_auditlimit_python.schemas import (
+    AuditBatchRequest,
+    AuditMessage,
+    AuditModel,
+    AuditRequest,
+)
+
+_model_decoder = msgspec.json.Decoder(AuditModel)
+_audit_decoder = msgspec.json.Decoder(AuditRequest)
+_message_decoder = msgspec.json.Decoder(AuditMessage)
+_batch_decoder = msgspec.json.Decoder(AuditBatchRequest)
+
+# message_start 事件里 message.uuid, 兼容 Data 字符串中被转义的引号
+_MESSAGE_START = b"message_start"
+_MESSAGE_UUID_RE = re.compile(rb'\\?"uuid\\?"\s*:\s*\\?"([0-9a-fA-F-]{36})')
+_MESSAGE_UUID_SEARCH_BYTES = 4096
+
+
+def decode_audit_model(body: bytes) -> str:
+    """Only the model name; every other field is skipped without being built."""
+    return _model_decoder.decode(body).model or ""
+
+
+def decode_audit_request(body: bytes) -> AuditRequest:
+    return _audit_decoder.decode(body)
+
+
+def decode_audit_batch(body: bytes) -> AuditBatchRequest:
+    """Item bodies stay raw until each item is evaluated."""
+    return _batch_decoder.decode(body)
+
+
+def get_prompt(audit_request: AuditRequest) -> str:
+    """``messages[0].content.parts[0]``, or an empty string."""
+    # messages 缺省或为 null 时都是 None
+    if not audit_request.messages:
+        return ""
+    content = _message_decoder.decode(audit_request.messages[0]).content
+    if isinstance(content, dict) and "parts" in content:
+        parts = content.get("parts", [])
+        if parts and len(parts) > 0:
+            return parts[0]
+    return ""
+
+
+def get_attachment_texts(audit_request: AuditRequest) -> List[str]:
+    raw_message = audit_request.raw_message
+    if raw_message is None or not raw_message.attachments:
+        return []
+    return [attach.extracted_content or "" for attach in raw_message.attachments]
+
+
+def get_conversation_uuid(referer: Optional[str]) -> str:
+    """The conversation uuid is the last path segment of the referer."""
+    if not referer:
+        return ""
+    return referer.split("/")[-1]
+
+
+def find_message_uuid(body: bytes) -> Optional[str]:
+    """
+    ``message_start.message.uuid`` of a response notify, found by scanning the
+    raw bytes right after the first message_start event (no JSON parsing).
+    """
+    start = body.find(_MESSAGE_START)
+    if start < 0:
+        return None
+    match = _MESSAGE_UUID_RE.search(body, start, start + _MESSAGE_UUID_SEARCH_BYTES)
+    return match.group(1).decode() if match else None
+
+
+def body_digest(body: bytes) -> str:
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
@@ -1,8 +1,8 @@
 import os
 import time
 from loguru import logger
-from datetime import datetime
-import pytz
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
 
 
 def set_cn_time_zone():
@@ -17,6 +17,6 @@ def set_cn_time_zone():
 
 def get_shanghai_time():
     # 获取当前UTC时间，然后转换为上海时间
-    shanghai_tz = pytz.timezone("Asia/Shanghai")
+    shanghai_tz = ZoneInfo("Asia/Shanghai")
 
-    return datetime.utcnow().replace(tzinfo=pytz.utc).astimezone(shanghai_tz)
+    return datetime.now(timezone.utc).astimezone(shanghai_tz)
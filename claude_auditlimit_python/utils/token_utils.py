@@ -1,59 +1,356 @@
-from typing import List, Dict
+import asyncio
+import hashlib
+import math
+import os
+import random
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate
+from typing import List, Dict, Optional, Tuple
 from loguru import logger
 import tiktoken
 from functools import lru_cache
 
-from claude_auditlimit_python.configs import DEFAULT_TOKENIZER
+from claude_auditlimit_python.configs import (
+    ATTACHMENT_TOKEN_CACHE_SIZE,
+    DEFAULT_TOKENIZER,
+    TOKEN_ESTIMATE_MAX_ERROR,
+    TOKEN_ESTIMATE_MIN_CHARS,
+    TOKEN_ESTIMATE_SAMPLE_CHARS,
+    TOKEN_ESTIMATE_SAMPLES,
+    TOKENIZER_CACHE_DIR,
+    TOKENIZER_ENCODINGS,
+    TOKENIZER_NUM_THREADS,
+)
+
+# tiktoken 从这个目录离线读取词表, 目录为空时首次加载会下载并写入
+os.environ.setdefault("TIKTOKEN_CACHE_DIR", str(TOKENIZER_CACHE_DIR))
+
+# tiktoken 编码时会释放GIL, 所以用线程池就能并行
+_tokenizer_executor = ThreadPoolExecutor(
+    max_workers=TOKENIZER_NUM_THREADS, thread_name_prefix="tokenizer"
+)
 
 
 @lru_cache
-def get_tokenizer():
-    return tiktoken.get_encoding(DEFAULT_TOKENIZER)
+def get_tokenizer(name: str = DEFAULT_TOKENIZER):
+    return tiktoken.get_encoding(name)
 
 
-def get_token_length(prompt: str) -> int:
-    return len(get_tokenizer().encode(prompt))
+def preload_tokenizers(names: List[str] = TOKENIZER_ENCODINGS) -> None:
+    """Load every configured encoding so no request pays the cold start."""
+    for name in names:
+        get_tokenizer(name)
 
 
-def shorten_message_given_prompt_length(
-    messages: List[Dict], token_limits: int
-) -> List[Dict]:
-    messages_str = "\n".join(
-        [f"{message['role']}: {message['content']}" for message in messages]
+def get_token_length(prompt: str, estimate: bool = False) -> int:
+    """
+    Exact token count of ``prompt``. With ``estimate=True``, texts of at least
+    ``TOKEN_ESTIMATE_MIN_CHARS`` characters are estimated from samples when the
+    estimate is within ``TOKEN_ESTIMATE_MAX_ERROR``.
+    """
+    if estimate and len(prompt) >= TOKEN_ESTIMATE_MIN_CHARS:
+        estimated = estimate_token_length(prompt)
+        if estimated is not None:
+            return estimated
+    # encode 遇到 <|endoftext|> 等特殊 token 的文本会抛异常, 用户输入只按普通文本计数
+    return _count_ordinary(prompt)
+
+
+def _char_classes(text: str) -> Tuple[int, int]:
+    """
+    (ascii_chars, non_ascii_chars) using only C-level length computations.
+    Non-ASCII characters are assumed to be 3 bytes in UTF-8 (CJK).
+    """
+    n_chars = len(text)
+    non_ascii = min((len(text.encode("utf-8", "surrogatepass")) - n_chars) // 2, n_chars)
+    return n_chars - non_ascii, non_ascii
+
+
+def estimate_token_length(text: str) -> Optional[int]:
+    """
+    Estimate the token count of a long text from ``TOKEN_ESTIMATE_SAMPLES``
+    stratified random chunks that are tokenized exactly.
+
+    Tokens per ASCII and per non-ASCII character are fitted on the samples
+    (CJK and Latin text differ a lot under cl100k_base) and extrapolated to the
+    character classes of the whole text. Returns None when the ~95% sampling
+    error exceeds ``TOKEN_ESTIMATE_MAX_ERROR``, so callers fall back to exact.
+    """
+    n_samples = TOKEN_ESTIMATE_SAMPLES
+    chunk = TOKEN_ESTIMATE_SAMPLE_CHARS
+    if n_samples < 2 or len(text) < n_samples * chunk * 2:
+        return None
+
+    tokenizer = get_tokenizer()
+    stratum = len(text) // n_samples
+    samples = []
+    for i in range(n_samples):
+        start = i * stratum + random.randrange(stratum - chunk)
+        piece = text[start : start + chunk]
+        ascii_chars, non_ascii = _char_classes(piece)
+        samples.append((ascii_chars, non_ascii, len(tokenizer.encode_ordinary(piece))))
+
+    # 最小二乘拟合 tokens = a * ascii + b * non_ascii
+    saa = sum(a * a for a, _, _ in samples)
+    scc = sum(c * c for _, c, _ in samples)
+    sac = sum(a * c for a, c, _ in samples)
+    sat = sum(a * t for a, _, t in samples)
+    sct = sum(c * t for _, c, t in samples)
+    det = saa * scc - sac * sac
+    if det > 1e-9 * saa * scc:
+        per_ascii = (sat * scc - sct * sac) / det
+        per_non_ascii = (sct * saa - sat * sac) / det
+    else:
+        per_ascii = per_non_ascii = -1.0
+    if per_ascii < 0 or per_non_ascii < 0:
+        # 样本只有一种字符类别(或拟合失败), 退化为整体比例
+        ratio = sum(t for _, _, t in samples) / (n_samples * chunk)
+        per_ascii = per_non_ascii = ratio
+
+    ratios = []
+    for a, c, t in samples:
+        predicted = per_ascii * a + per_non_ascii * c
+        if predicted <= 0:
+            return None
+        ratios.append(t / predicted)
+    mean_ratio = sum(ratios) / n_samples
+    variance = sum((r - mean_ratio) ** 2 for r in ratios) / (n_samples - 1)
+    relative_error = 2 * math.sqrt(variance / n_samples) / mean_ratio
+    if relative_error > TOKEN_ESTIMATE_MAX_ERROR:
+        return None
+
+    ascii_chars, non_ascii = _char_classes(text)
+    return round((per_ascii * ascii_chars + per_non_ascii * non_ascii) * mean_ratio)
+
+
+class TokenCountCache:
+    """Thread-safe LRU of exact token counts keyed by a digest of the text."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._counts: OrderedDict[bytes, int] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def get(self, key: bytes) -> Optional[int]:
+        with self._lock:
+            count = self._counts.get(key)
+            if count is not None:
+                self._counts.move_to_end(key)
+            return count
+
+    def set(self, key: bytes, count: int) -> None:
+        with self._lock:
+            self._counts[key] = count
+            self._counts.move_to_end(key)
+            while len(self._counts) > self.max_size:
+                self._counts.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._counts.clear()
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+
+attachment_token_cache = TokenCountCache(ATTACHMENT_TOKEN_CACHE_SIZE)
+
+
+def _count_ordinary(text: str) -> int:
+    return len(get_tokenizer().encode_ordinary(text))
+
+
+def _lookup_cached(texts: List[str]):
+    """Split texts into cached counts and the (index, digest) pairs still missing."""
+    counts: List[Optional[int]] = []
+    missing = []
+    for i, text in enumerate(texts):
+        key = attachment_token_cache.digest(text)
+        count = attachment_token_cache.get(key)
+        counts.append(count)
+        if count is None:
+            missing.append((i, key))
+    return counts, missing
+
+
+def _lookup_and_estimate(texts: List[str]):
+    """``_lookup_cached`` plus sampled estimates of the oversized missing texts."""
+    counts, missing = _lookup_cached(texts)
+    estimates = {
+        i: estimate_token_length(texts[i])
+        for i, _ in missing
+        if len(texts[i]) >= TOKEN_ESTIMATE_MIN_CHARS
+    }
+    return counts, missing, estimates
+
+
+def get_token_lengths(texts: List[str]) -> List[int]:
+    """
+    Exact token count of each text, encoded in parallel on the tokenizer
+    threads without concatenating them. Results are cached per text.
+    """
+    counts, missing = _lookup_cached(texts)
+    results = _tokenizer_executor.map(_count_ordinary, [texts[i] for i, _ in missing])
+    for (i, key), count in zip(missing, results):
+        attachment_token_cache.set(key, count)
+        counts[i] = count
+    return counts
+
+
+async def get_token_lengths_async(
+    texts: List[str], use_cache: bool = True
+) -> List[int]:
+    """Same as ``get_token_lengths`` but never blocks the event loop."""
+    loop = asyncio.get_running_loop()
+    if not use_cache:
+        return await asyncio.gather(
+            *(
+                loop.run_in_executor(_tokenizer_executor, _count_ordinary, text)
+                for text in texts
+            )
+        )
+
+    # 大文本算摘要也很耗时, 放到分词线程里
+    counts, missing = await loop.run_in_executor(
+        _tokenizer_executor, _lookup_cached, texts
     )
-    token_length = get_token_length(messages_str)
-    if token_length <= token_limits:
-        return messages
+    results = await asyncio.gather(
+        *(
+            loop.run_in_executor(_tokenizer_executor, _count_ordinary, texts[i])
+            for i, _ in missing
+        )
+    )
+    for (i, key), count in zip(missing, results):
+        attachment_token_cache.set(key, count)
+        counts[i] = count
+    return counts
+
+
+async def get_attachments_token_length(attachment_texts: List[str]) -> int:
+    return sum(await get_token_lengths_async(attachment_texts))
+
+
+async def estimate_attachments_token_length(
+    attachment_texts: List[str],
+) -> Tuple[int, List[Tuple[str, int]]]:
+    """
+    Token usage of attachments for admission decisions.
+
+    Oversized attachments without a cached exact count are estimated; they are
+    returned as ``(text, estimated_tokens)`` pairs so the caller can count them
+    exactly later and charge the difference.
+    """
+    loop = asyncio.get_running_loop()
+    # 摘要和采样估算都在分词线程里做, 不阻塞事件循环
+    counts, missing, estimates = await loop.run_in_executor(
+        _tokenizer_executor, _lookup_and_estimate, attachment_texts
+    )
+    total = sum(count for count in counts if count is not None)
+
+    pending = []
+    exact = []
+    for i, key in missing:
+        estimated = estimates.get(i)
+        if estimated is None:
+            exact.append((i, key))
+        else:
+            pending.append((attachment_texts[i], estimated))
+            total += estimated
 
-    shortened_messages = messages.copy()
-
-    # Keep removing non-system messages from the beginning until under token limit
-    while len(shortened_messages) > 1:  # Keep at least one message
-        # Find first non-system message
-        remove_index = None
-        for i, msg in enumerate(shortened_messages):
-            if msg["role"] != "system":
-                remove_index = i
-                break
-
-        if remove_index is None:
-            break
-
-        # Remove the message
-        shortened_messages.pop(remove_index)
-
-        # Check if we're now under the limit
-        messages_str = "\n".join(
-            [
-                f"{message['role']}: {message['content']}"
-                for message in shortened_messages
-            ]
+    results = await asyncio.gather(
+        *(
+            loop.run_in_executor(
+                _tokenizer_executor, _count_ordinary, attachment_texts[i]
+            )
+            for i, _ in exact
         )
-        token_length = get_token_length(messages_str)
-        if token_length <= token_limits:
-            break
+    )
+    for (_, key), count in zip(exact, results):
+        attachment_token_cache.set(key, count)
+        total += count
+    return total, pending
+
+
+def _format_message(message: Dict) -> str:
+    return f"{message['role']}: {message['content']}"
+
+
+def count_messages_tokens_batch(conversations: List[List[Dict]]) -> List[List[int]]:
+    """
+    Token count of every formatted message of every conversation.
+    All messages are encoded in a single ``encode_ordinary_batch`` call.
+    """
+    texts = [_format_message(message) for messages in conversations for message in messages]
+    encoded = get_tokenizer().encode_ordinary_batch(
+        texts, num_threads=TOKENIZER_NUM_THREADS
+    )
+    lengths = [len(tokens) for tokens in encoded]
+
+    result = []
+    start = 0
+    for messages in conversations:
+        result.append(lengths[start : start + len(messages)])
+        start += len(messages)
+    return result
 
-    return shortened_messages
+
+def count_message_tokens(messages: List[Dict]) -> List[int]:
+    """Token count of each formatted message."""
+    return count_messages_tokens_batch([messages])[0]
+
+
+def trim_messages(
+    messages: List[Dict], token_limits: int, token_counts: Optional[List[int]] = None
+) -> List[Dict]:
+    """
+    Drop non-system messages from the beginning until the newline-joined
+    conversation fits in ``token_limits``, keeping at least one message.
+
+    The joined length is taken as the sum of per-message counts plus one token
+    per separator, so the cut point is found by binary search over prefix sums
+    instead of re-tokenizing after every removal.
+    """
+    if token_counts is None:
+        token_counts = count_message_tokens(messages)
+
+    total = sum(token_counts) + max(len(messages) - 1, 0)
+    if total <= token_limits:
+        return messages
+
+    removable = [i for i, message in enumerate(messages) if message["role"] != "system"]
+    max_removed = min(len(removable), len(messages) - 1)
+    # removed_tokens[k]: 删除前k条可删除消息后减少的token数 (含分隔符)
+    removed_tokens = list(
+        accumulate((token_counts[i] + 1 for i in removable[:max_removed]), initial=0)
+    )
+    removed = min(bisect_left(removed_tokens, total - token_limits), max_removed)
+
+    dropped = set(removable[:removed])
+    return [message for i, message in enumerate(messages) if i not in dropped]
+
+
+def trim_messages_batch(
+    conversations: List[List[Dict]], token_limits: int
+) -> List[List[Dict]]:
+    """Trim many conversations with one batched tokenizer call."""
+    token_counts = count_messages_tokens_batch(conversations)
+    return [
+        trim_messages(messages, token_limits, counts)
+        for messages, counts in zip(conversations, token_counts)
+    ]
+
+
+def shorten_message_given_prompt_length(
+    messages: List[Dict], token_limits: int
+) -> List[Dict]:
+    return trim_messages(messages, token_limits)
 
 
 if __name__ == "__main__":
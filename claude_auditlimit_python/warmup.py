@@ -0,0 +1,122 @@
+# warmup.py
+# 启动预热: 加载 tokenizer、预先建立 redis 连接、SCRIPT LOAD 所有 lua 脚本
+# 预热在后台进行, 端口先开始监听; 预热完成后 /ready 才返回 200
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+from loguru import logger
+from redis.asyncio import Redis
+
+from claude_auditlimit_python import metrics
+from claude_auditlimit_python.configs import REDIS_POOL_WARM_CONNECTIONS
+from claude_auditlimit_python.redis_manager.admission_manager import ADMIT_SCRIPT
+from claude_auditlimit_python.redis_manager.device_manager import (
+    CHECK_AND_ADD_DEVICE_SCRIPT,
+)
+from claude_auditlimit_python.redis_manager.history_manager import (
+    DOWNSAMPLE_SCRIPT,
+    DOWNSAMPLE_TOP_SCRIPT,
+)
+from claude_auditlimit_python.redis_manager.notify_dedupe_manager import (
+    FIRST_SEEN_SCRIPT,
+)
+from claude_auditlimit_python.redis_manager.redis_pool import RedisPool
+from claude_auditlimit_python.redis_manager.token_usage_manager import (
+    CHARGE_CONVERSATIONS_SCRIPT,
+    COMPACT_CONVERSATIONS_SCRIPT,
+)
+from claude_auditlimit_python.utils.token_utils import (
+    get_token_length,
+    preload_tokenizers,
+)
+
+LUA_SCRIPTS = (
+    ADMIT_SCRIPT,
+    CHECK_AND_ADD_DEVICE_SCRIPT,
+    FIRST_SEEN_SCRIPT,
+    CHARGE_CONVERSATIONS_SCRIPT,
+    COMPACT_CONVERSATIONS_SCRIPT,
+    DOWNSAMPLE_SCRIPT,
+    DOWNSAMPLE_TOP_SCRIPT,
+)
+
+
+def _warm_tokenizers() -> None:
+    preload_tokenizers()
+    # 第一次 encode 还会初始化分词正则
+    get_token_length("warm up the tokenizer")
+
+
+async def _warm_node(client: Redis) -> None:
+    # 并发的 PING 各占用一个连接, 结束后都留在连接池里
+    await asyncio.gather(*(client.ping() for _ in range(REDIS_POOL_WARM_CONNECTIONS)))
+    # 之后的 EVALSHA 不会再因为 NOSCRIPT 多一次往返
+    for script in LUA_SCRIPTS:
+        await client.script_load(script)
+
+
+class Warmup:
+    """
+    Startup warm-up, run in the background by ``lifespan.on_startup``.
+
+    Requests are served while it runs, just without the warm caches;
+    ``is_ready`` (and ``/ready``) turns true once it has finished. A Redis
+    node that cannot be warmed is logged and skipped: the request path falls
+    back to degraded mode for it as usual.
+    """
+
+    _ready = False
+    _report: Dict[str, Any] = {}
+    _task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def is_ready(cls) -> bool:
+        return cls._ready
+
+    @classmethod
+    def report(cls) -> Dict[str, Any]:
+        return {"ready": cls._ready, **cls._report}
+
+    @classmethod
+    async def _run(cls):
+        start = time.perf_counter()
+        clients = RedisPool.get_all_clients()
+        tokenizers, *nodes = await asyncio.gather(
+            asyncio.to_thread(_warm_tokenizers),
+            *(_warm_node(client) for client in clients),
+            return_exceptions=True,
+        )
+        if isinstance(tokenizers, Exception):
+            logger.error(f"Failed to warm up tokenizers: {tokenizers}")
+        failed = [result for result in nodes if isinstance(result, Exception)]
+        for error in failed:
+            logger.error(f"Failed to warm up redis node: {error}")
+        cls._report = {
+            "seconds": round(time.perf_counter() - start, 3),
+            "tokenizers": not isinstance(tokenizers, Exception),
+            "redis_nodes": len(clients),
+            "redis_nodes_failed": len(failed),
+            "scripts": len(LUA_SCRIPTS),
+        }
+        cls._ready = True
+        metrics.incr("warmup_completed")
+        logger.info(f"Warm-up finished: {cls._report}")
+
+    @classmethod
+    def start(cls):
+        cls._ready = False
+        cls._task = asyncio.create_task(cls._run())
+
+    @classmethod
+    async def wait(cls):
+        if cls._task is not None:
+            await cls._task
+
+    @classmethod
+    async def shutdown(cls):
+        cls._ready = False
+        if cls._task is not None:
+            cls._task.cancel()
+            await asyncio.gather(cls._task, return_exceptions=True)
+            cls._task = None
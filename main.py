@@ -1,29 +1,56 @@
 import argparse
-import fire
+import importlib.util
 import uvicorn
 from fastapi import FastAPI
 from loguru import logger
-from claude_auditlimit_python.configs import LOGS_PATH
+from claude_auditlimit_python.configs import SERVER_BACKLOG, SERVER_KEEP_ALIVE_SECONDS
 from claude_auditlimit_python.lifespan import lifespan
 from claude_auditlimit_python.middlewares.register_middlewares import (
     register_middleware,
 )
 from claude_auditlimit_python.router import router
+from claude_auditlimit_python.utils.log_utils import setup_logging
 
-parser = argparse.ArgumentParser()
-parser.add_argument("--host", default="0.0.0.0", help="host")
-parser.add_argument("--port", default=8000, help="port")
-parser.add_argument("--workers", default=1, type=int, help="workers")
-args = parser.parse_args()
-logger.add(LOGS_PATH / "log_file.log", rotation="1 week")  # 每周轮换一次文件
+setup_logging()  # 每周轮换一次文件, 由后台线程写入
 app = FastAPI(lifespan=lifespan)
 app = register_middleware(app)
+# 在导入时挂载路由, `uvicorn main:app` 也能直接使用
+app.include_router(router)
 
 
-def start_server(port=args.port, host=args.host):
+def server_stack(fast: bool) -> dict:
+    # 不加 --fast 时由 uvicorn 自动选择 (装了 uvloop/httptools 也会用上)
+    if not fast:
+        return {}
+    missing = [
+        module
+        for module in ("uvloop", "httptools")
+        if importlib.util.find_spec(module) is None
+    ]
+    if missing:
+        logger.warning(f"--fast needs {', '.join(missing)}; using uvicorn defaults")
+        return {}
+    return {"loop": "uvloop", "http": "httptools"}
+
+
+def start_server(
+    port=8000,
+    host="0.0.0.0",
+    workers=1,
+    fast=False,
+    keep_alive=SERVER_KEEP_ALIVE_SECONDS,
+    backlog=SERVER_BACKLOG,
+):
     logger.info(f"Starting server at {host}:{port}")
-    app.include_router(router)
-    config = uvicorn.Config(app, host=host, port=port, workers=args.workers)
+    config = uvicorn.Config(
+        app,
+        host=host,
+        port=port,
+        workers=workers,
+        timeout_keep_alive=keep_alive,
+        backlog=backlog,
+        **server_stack(fast),
+    )
     server = uvicorn.Server(config=config)
     try:
         server.run()
@@ -31,5 +58,34 @@ def start_server(port=args.port, host=args.host):
         logger.info("Server shutdown.")
 
 
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="0.0.0.0", help="host")
+    parser.add_argument("--port", default=8000, type=int, help="port")
+    parser.add_argument("--workers", default=1, type=int, help="workers")
+    parser.add_argument(
+        "--fast",
+        action="store_true",
+        help="uvloop + httptools (pip install '.[fast]')",
+    )
+    parser.add_argument(
+        "--keep-alive",
+        default=SERVER_KEEP_ALIVE_SECONDS,
+        type=int,
+        help="keep-alive timeout seconds",
+    )
+    parser.add_argument("--backlog", default=SERVER_BACKLOG, type=int, help="backlog")
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
-    fire.Fire(start_server)
+    # 只在直接运行时解析命令行, 导入 main 不会读取 sys.argv
+    args = parse_args()
+    start_server(
+        port=args.port,
+        host=args.host,
+        workers=args.workers,
+        fast=args.fast,
+        keep_alive=args.keep_alive,
+        backlog=args.backlog,
+    )
@@ -0,0 +1,99 @@
+import fakeredis
+import pytest
+import tiktoken
+from redis.exceptions import ConnectionError
+
+from claude_auditlimit_python import degraded_mode
+from claude_auditlimit_python.degraded_mode import DegradedJournal, DegradedLimiter
+from claude_auditlimit_python.policy import CompiledTier, LimitWindow, PolicyEngine, TierSpec
+from claude_auditlimit_python.redis_manager.base_redis_manager import BaseRedisManager
+from claude_auditlimit_python.redis_manager.blocklist_manager import BlocklistManager
+from claude_auditlimit_python.redis_manager.circuit_breaker import CircuitBreaker
+from claude_auditlimit_python.redis_manager.keyspace import HashRing
+from claude_auditlimit_python.redis_manager.redis_pool import RedisPool
+from claude_auditlimit_python.utils import token_utils
+
+# 按字节编码的小词表, 测试不需要下载 cl100k_base; 保留一个特殊 token
+TOY_ENCODING = tiktoken.Encoding(
+    name="toy",
+    pat_str=r"""'s|'t|'re|'ve|'m|'ll|'d| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+""",
+    mergeable_ranks={bytes([i]): i for i in range(256)},
+    special_tokens={"<|endoftext|>": 256},
+)
+
+
+@pytest.fixture(autouse=True)
+def tokenizer(monkeypatch):
+    monkeypatch.setattr(token_utils, "get_tokenizer", lambda *args, **kwargs: TOY_ENCODING)
+    token_utils.attachment_token_cache.clear()
+    return TOY_ENCODING
+
+
+@pytest.fixture(autouse=True)
+def redis_nodes(monkeypatch):
+    """One fake Redis server per node, fresh for every test."""
+    nodes = {}
+
+    def node_client(host, port, db):
+        key = (host, port, db)
+        if key not in nodes:
+            nodes[key] = fakeredis.FakeAsyncRedis(
+                server=fakeredis.FakeServer(), decode_responses=True
+            )
+        return nodes[key]
+
+    monkeypatch.setattr(RedisPool, "_node_client", staticmethod(node_client))
+    monkeypatch.setattr(RedisPool, "_ring", None)
+    monkeypatch.setattr(BaseRedisManager, "breaker", CircuitBreaker("redis"))
+    # 进程内的本地状态也不能跨测试保留
+    monkeypatch.setattr(BlocklistManager, "_local_blocklist", {})
+    monkeypatch.setattr(DegradedLimiter, "_usage", {})
+    return nodes
+
+
+@pytest.fixture
+def sharded(monkeypatch):
+    """Spread api keys over two fake nodes."""
+    monkeypatch.setattr(RedisPool, "_ring", HashRing(["shard-a:6379", "shard-b:6379"]))
+
+
+@pytest.fixture
+def tier(monkeypatch):
+    """Default tier of 200 tokens and 5 requests per 3 hours."""
+    compiled = CompiledTier(
+        "default",
+        TierSpec([LimitWindow("tokens", "3h", 200), LimitWindow("requests", "3h", 5)]),
+    )
+    monkeypatch.setattr(PolicyEngine, "_tiers", {"default": compiled})
+    monkeypatch.setattr(PolicyEngine, "_assignments", {})
+    return compiled
+
+
+@pytest.fixture
+def journal(monkeypatch, tmp_path):
+    """Degraded-mode journal segments under a temporary directory."""
+    monkeypatch.setattr(degraded_mode, "DEGRADED_JOURNAL_DIR", tmp_path)
+    monkeypatch.setattr(DegradedJournal, "_file", None)
+    monkeypatch.setattr(DegradedJournal, "_pending", 0)
+    yield tmp_path
+    DegradedJournal.close()
+
+
+@pytest.fixture
+def broken_nodes(monkeypatch):
+    """Fake clients added to the returned list fail every pipeline."""
+    broken = []
+    original = fakeredis.FakeAsyncRedis.pipeline
+
+    def pipeline(self, *args, **kwargs):
+        pipe = original(self, *args, **kwargs)
+        if any(self is client for client in broken):
+
+            async def execute(*args, **kwargs):
+                raise ConnectionError("node down")
+
+            pipe.execute = execute
+        return pipe
+
+    monkeypatch.setattr(fakeredis.FakeAsyncRedis, "pipeline", pipeline)
+    return broken
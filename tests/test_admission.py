@@ -0,0 +1,56 @@
+import msgspec
+
+from claude_auditlimit_python.admission import AdmissionItem, evaluate_admissions
+from claude_auditlimit_python.redis_manager.token_usage_manager import TokenUsageManager
+from claude_auditlimit_python.redis_manager.usage_manager import UsageManager
+from claude_auditlimit_python.redis_manager.usage_record_manager import (
+    UsageRecordManager,
+)
+
+
+def make_item(api_key, prompt="hello world", conversation="c1", model="claude-3"):
+    body = msgspec.json.encode(
+        {"model": model, "messages": [{"content": {"parts": [prompt]}}]}
+    )
+    return AdmissionItem(api_key, "ua", "host", conversation, body)
+
+
+async def test_items_of_one_key_are_applied_in_order(tier):
+    # "hello world" 是 11 个 token; 对话累计 11, 22, ..., 用量累加对话总量
+    decisions = await evaluate_admissions([make_item("k1") for _ in range(7)])
+
+    assert [d.decision for d in decisions] == ["allowed"] * 5 + [
+        "request_limit",
+        "token_limit",
+    ]
+    assert await TokenUsageManager().get_token_usage("k1", "c1") == 66
+    assert (await UsageManager().get_token_usage("k1")).last_3_hours == 231
+    assert (await UsageRecordManager().get_usage("k1")).last_3_hours == 5
+
+
+async def test_bad_item_only_fails_itself(tier):
+    items = [
+        make_item("k1"),
+        make_item("k2", prompt=123),
+        make_item("k3", prompt="strip <|endoftext|> please"),
+        make_item("k4", model="gpt-4o"),
+    ]
+
+    decisions = await evaluate_admissions(items, route="/audit_limit/batch")
+
+    assert [(d.status_code, d.decision) for d in decisions] == [
+        (200, "allowed"),
+        (500, "error"),
+        (200, "allowed"),
+        (200, "not_metered"),
+    ]
+    assert (await UsageRecordManager().get_usage("k1")).total == 1
+    assert (await UsageRecordManager().get_usage("k2")).total == 0
+    assert (await UsageRecordManager().get_usage("k3")).total == 1
+
+
+async def test_batch_with_only_bad_items_does_not_call_redis(tier):
+    decisions = await evaluate_admissions([make_item("k1", prompt=["x"])])
+
+    assert decisions[0].decision == "error"
+    assert (await UsageRecordManager().get_usage("k1")).total == 0
@@ -0,0 +1,86 @@
+import json
+import time
+
+import pytest
+
+from claude_auditlimit_python.admission import reconcile_estimated_usage
+from claude_auditlimit_python.degraded_mode import DegradedJournal
+from claude_auditlimit_python.redis_manager.base_redis_manager import BaseRedisManager
+from claude_auditlimit_python.redis_manager.redis_pool import RedisPool
+from claude_auditlimit_python.redis_manager.token_usage_manager import TokenUsageManager
+from claude_auditlimit_python.redis_manager.usage_manager import UsageManager
+from claude_auditlimit_python.redis_manager.usage_record_manager import (
+    UsageRecordManager,
+)
+
+
+def keys_on_two_shards():
+    by_node = {}
+    for i in range(100):
+        by_node.setdefault(RedisPool.shard_node(f"key-{i}"), f"key-{i}")
+    return list(by_node.values())[:2]
+
+
+def journal_lines(directory):
+    return [
+        json.loads(line)
+        for path in sorted(directory.glob("*.jsonl"))
+        for line in path.read_text().splitlines()
+    ]
+
+
+async def usage(api_key):
+    tokens = await UsageManager().get_token_usage(api_key)
+    requests = await UsageRecordManager().get_usage(api_key)
+    return tokens.total, requests.total
+
+
+async def test_replay_after_partial_failure_charges_every_line_once(
+    sharded, journal, broken_nodes
+):
+    key_a, key_b = keys_on_two_shards()
+    DegradedJournal.append(key_a, "c1", 10, True)
+    DegradedJournal.append(key_b, "c2", 20, True)
+    DegradedJournal.append(key_a, "c1", 5, False, correction=True)
+
+    broken_nodes.append(await TokenUsageManager().get_aioredis(key_b))
+    with pytest.raises(RuntimeError):
+        await DegradedJournal.replay()
+    broken_nodes.clear()
+
+    assert await usage(key_a) == (10, 1)
+    assert await usage(key_b) == (0, 0)
+    # 只剩没有记账的行, 顺序不变
+    assert [(line["api_key"], line["tokens"]) for line in journal_lines(journal)] == [
+        (key_b, 20),
+        (key_a, 5),
+    ]
+
+    assert await DegradedJournal.replay() == 2
+    assert await usage(key_a) == (15, 1)
+    assert await usage(key_b) == (20, 1)
+    assert await TokenUsageManager().get_token_usage(key_a, "c1") == 15
+    assert journal_lines(journal) == []
+
+
+async def test_reconcile_journals_the_correction_when_redis_is_down(journal):
+    breaker = BaseRedisManager.breaker
+    breaker.state, breaker.opened_at = breaker.OPEN, time.monotonic()
+
+    await reconcile_estimated_usage("k1", "c1", [("exact text", 3)])
+
+    DegradedJournal.close()
+    [line] = journal_lines(journal)
+    assert (line["tokens"], line["request"], line["correction"]) == (7, False, True)
+
+    breaker.state = breaker.CLOSED
+    assert await DegradedJournal.replay() == 1
+    assert await usage("k1") == (7, 0)
+    assert await TokenUsageManager().get_token_usage("k1", "c1") == 7
+
+
+async def test_reconcile_charges_the_difference(journal):
+    await reconcile_estimated_usage("k1", "c1", [("exact text", 3)])
+
+    assert await usage("k1") == (7, 0)
+    assert journal_lines(journal) == []
@@ -0,0 +1,64 @@
+import json
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from claude_auditlimit_python.redis_manager import export_manager
+from claude_auditlimit_python.redis_manager.token_usage_manager import TokenUsageManager
+from claude_auditlimit_python.router import router
+
+API_KEYS = [f"key-{i}" for i in range(30)]
+
+
+@pytest.fixture
+async def client(sharded, monkeypatch):
+    # 小批次, 让一次导出跨越多个 SCAN 批次和两个分片
+    monkeypatch.setattr(export_manager, "EXPORT_SCAN_COUNT", 4)
+    await TokenUsageManager().charge_conversations(
+        [(api_key, "c1", 10, 1) for api_key in API_KEYS]
+    )
+    app = FastAPI()
+    app.include_router(router)
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        yield client
+
+
+async def test_export_resumes_from_cursor(client, monkeypatch):
+    checks = []
+    check_cursor = export_manager.ExportManager.check_cursor
+
+    async def counting_check_cursor(self, cursor):
+        checks.append(cursor)
+        await check_cursor(self, cursor)
+
+    monkeypatch.setattr(
+        export_manager.ExportManager, "check_cursor", counting_check_cursor
+    )
+    exported = []
+    cursor = "0:0"
+    pages = 0
+    while cursor is not None:
+        response = await client.get(
+            "/export/usage", params={"cursor": cursor, "limit": 5}
+        )
+        assert response.status_code == 200
+        *rows, trailer = [json.loads(line) for line in response.text.splitlines()]
+        assert trailer["_export"]["rows"] == len(rows)
+        exported += [row["api_key"] for row in rows]
+        assert all(row["tokens"]["total"] == 10 for row in rows)
+        cursor = trailer["_export"]["next_cursor"]
+        pages += 1
+
+    assert pages > 1
+    # 游标只在路由里检查一次
+    assert len(checks) == pages
+    # SCAN 续传可能重复, 但不能遗漏
+    assert set(exported) == set(API_KEYS)
+
+
+async def test_export_rejects_bad_cursor_before_streaming(client):
+    response = await client.get("/export/usage", params={"cursor": "5:0"})
+    assert response.status_code == 400
@@ -0,0 +1,127 @@
+import json
+
+import httpx
+import msgspec
+import pytest
+from fastapi import FastAPI
+
+from claude_auditlimit_python import notify_queue
+from claude_auditlimit_python.configs import NOTIFY_MAX_DELIVERIES
+from claude_auditlimit_python.degraded_mode import DegradedJournal
+from claude_auditlimit_python.notify_queue import (
+    NotifyJob,
+    NotifyQueue,
+    RedisStreamNotifyBackend,
+)
+from claude_auditlimit_python.redis_manager.notify_dedupe_manager import (
+    NotifyDedupeManager,
+)
+from claude_auditlimit_python.redis_manager.notify_stream_manager import (
+    NotifyStreamManager,
+)
+from claude_auditlimit_python.redis_manager.token_usage_manager import TokenUsageManager
+from claude_auditlimit_python.redis_manager.usage_manager import UsageManager
+from claude_auditlimit_python.router import router
+
+# "hello world" 是 11 个 token
+RESPONSE = msgspec.json.encode({"Data": '{"text":"hello world"}'})
+HEADERS = {
+    "Authorization": "Bearer k1",
+    "Referer": "https://claude.ai/chat/c1",
+    "X-Request-Id": "r1",
+}
+
+
+@pytest.fixture
+async def client():
+    app = FastAPI()
+    app.include_router(router)
+    await NotifyQueue.start()
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        yield client
+    await NotifyQueue.shutdown()
+
+
+async def notify(client):
+    response = await client.post("/response_notify", content=RESPONSE, headers=HEADERS)
+    await NotifyQueue.backend.drain()
+    return response
+
+
+async def usage_3h(api_key):
+    return (await UsageManager().get_token_usage(api_key)).last_3_hours
+
+
+async def test_memory_queue_journals_charges_redis_rejected(
+    client, journal, broken_nodes
+):
+    broken_nodes.append(await TokenUsageManager().get_aioredis("k1"))
+    response = await notify(client)
+    broken_nodes.clear()
+
+    assert response.status_code == 202
+    assert await usage_3h("k1") == 0
+    DegradedJournal.close()
+    [line] = [
+        json.loads(line)
+        for path in journal.glob("*.jsonl")
+        for line in path.read_text().splitlines()
+    ]
+    assert (line["api_key"], line["conversation_uuid"], line["tokens"]) == (
+        "k1",
+        "c1",
+        11,
+    )
+
+    assert await DegradedJournal.replay() == 1
+    assert await usage_3h("k1") == 11
+    assert await TokenUsageManager().get_token_usage("k1", "c1") == 11
+
+
+async def test_dropped_job_releases_its_dedupe_id(client, monkeypatch):
+    async def fail_to_count(texts, use_cache=True):
+        raise RuntimeError("tokenizer crashed")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(notify_queue, "get_token_lengths_async", fail_to_count)
+        assert (await notify(client)).status_code == 202
+
+    # 上游用同一个 request id 重试, 不能被当作重复丢掉
+    response = await notify(client)
+    assert response.status_code == 202
+    assert response.json()["msg"] == "accepted"
+    assert await usage_3h("k1") == 11
+
+    response = await notify(client)
+    assert response.json()["msg"] == "duplicate"
+    assert await usage_3h("k1") == 11
+
+
+async def test_forget_clears_an_id_recorded_in_the_previous_bucket(monkeypatch):
+    manager = NotifyDedupeManager()
+    bucket = manager._current_bucket()
+    assert await manager.first_seen("r1")
+
+    monkeypatch.setattr(NotifyDedupeManager, "_current_bucket", lambda self: bucket + 1)
+    assert not await manager.first_seen("r1")
+    await manager.forget("r1")
+    assert await manager.first_seen("r1")
+
+
+async def test_dead_lettered_stream_job_releases_its_dedupe_id(monkeypatch):
+    monkeypatch.setattr(NotifyStreamManager, "CLAIM_IDLE_MS", 0)
+    backend = RedisStreamNotifyBackend()
+    await backend.start()
+    assert await NotifyDedupeManager().first_seen("k1:r1")
+    await backend.put(NotifyJob(NotifyJob.KIND_RESPONSE, "k1", "c1", RESPONSE, "k1:r1"))
+
+    # 一直不确认, 直到超过最大投递次数被移到死信 stream
+    for _ in range(NOTIFY_MAX_DELIVERIES):
+        assert len(await backend.get_batch(0)) == 1
+    assert await backend.get_batch(0) == []
+
+    redis = await NotifyStreamManager().get_aioredis()
+    assert await redis.xlen(NotifyStreamManager.DEAD_LETTER_KEY) == 1
+    assert await NotifyDedupeManager().first_seen("k1:r1")
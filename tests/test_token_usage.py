@@ -0,0 +1,44 @@
+import time
+
+from claude_auditlimit_python.configs import TOKEN_USAGE_IDLE_TTL_SECONDS
+from claude_auditlimit_python.redis_manager.token_usage_manager import TokenUsageManager
+from claude_auditlimit_python.redis_manager.usage_manager import UsageManager
+
+
+async def set_last_seen(manager, api_key, uuid, seconds_ago):
+    redis = await manager.get_aioredis(api_key)
+    await redis.zadd(manager._get_seen_key(api_key), {uuid: int(time.time()) - seconds_ago})
+
+
+async def test_compaction_keeps_resumable_conversations(sharded):
+    manager = TokenUsageManager()
+    await manager.charge_conversations([("key-1", "c1", 10, 1), ("key-1", "c2", 20, 1)])
+    # c1 空闲一天, 仍可能被恢复; c2 已超过过期时间
+    await set_last_seen(manager, "key-1", "c1", 24 * 60 * 60 + 1)
+    await set_last_seen(manager, "key-1", "c2", TOKEN_USAGE_IDLE_TTL_SECONDS + 1)
+
+    report = await manager.compact()
+    assert report.conversations_compacted == 1
+
+    # 恢复的对话继续按对话总量计费
+    await manager.charge_conversations([("key-1", "c1", 5, 1)])
+    assert await manager.get_token_usage("key-1", "c1") == 15
+    assert (await UsageManager().get_token_usage("key-1")).total == 10 + 20 + 15
+
+    assert await manager.get_all_token_usage("key-1") == {"c1": 15}
+    assert await manager.get_all_token_usage() == {"key-1": {"c1": 15}}
+
+
+async def test_legacy_keys_are_migrated_across_shards(sharded):
+    manager = TokenUsageManager()
+    legacy = {f"key-{i}": 100 + i for i in range(20)}
+    source = manager.get_all_aioredis()[0]
+    for api_key, value in legacy.items():
+        await source.set(manager._get_legacy_redis_key(api_key, "c1"), value)
+
+    report = await manager.compact()
+
+    assert report.legacy_keys_migrated == len(legacy)
+    assert await source.keys("token_usage:*:*") == []
+    for api_key, value in legacy.items():
+        assert await manager.get_token_usage(api_key, "c1") == value
@@ -0,0 +1,16 @@
+from claude_auditlimit_python.utils.token_utils import (
+    get_token_length,
+    get_token_lengths_async,
+)
+
+
+def test_prompt_with_special_token_text_is_counted_as_ordinary_text(tokenizer):
+    prompt = "how do I strip <|endoftext|> from my training data?"
+
+    assert get_token_length(prompt) == len(tokenizer.encode_ordinary(prompt))
+
+
+async def test_prompt_and_attachment_counts_agree(tokenizer):
+    text = "notes <|endoftext|> more notes"
+
+    assert await get_token_lengths_async([text]) == [get_token_length(text)]